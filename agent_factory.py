@@ -1,28 +1,54 @@
-from typing import Dict, Optional, Union
+import importlib
+# Import importlib to load each provider's agent module the first time that provider is used
+
+import os
+# Import the os module to read the pool settings from environment variables
+
+import threading
+# Import threading so the agent pool can be shared safely between Streamlit sessions
+
+import time
+# Import time to record when each pooled agent was last used
+
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Type, Union
 # Import typing hints to specify the expected types of variables and function parameters/returns
+# TYPE_CHECKING: True only for type checkers, so the agent classes can be named without importing them
 # Dict: A dictionary with keys and values of specific types
 # Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+# Type: A class (rather than an instance of it)
 # Union: Indicates that a value can be one of several types
 
 from base_agent import BaseAgent
 # Import the BaseAgent abstract base class that defines the common interface for all agents
 
-from openai_agent import OpenAIAgent
-# Import the OpenAIAgent class that implements the BaseAgent interface for OpenAI models
-
-from anthropic_agent import AnthropicAgent
-# Import the AnthropicAgent class that implements the BaseAgent interface for Anthropic models
+if TYPE_CHECKING:
+    # Only for type hints; at runtime each agent module is imported on first use (see AGENT_REGISTRY)
+    from openai_agent import OpenAIAgent
+    from anthropic_agent import AnthropicAgent
+    from deepseek_agent import DeepseekAgent
 
-from deepseek_agent import DeepseekAgent
-# Import the DeepseekAgent class that implements the BaseAgent interface for Deepseek models
+AGENT_REGISTRY: Dict[str, Tuple[str, str]] = {
+    "gpt-4": ("openai_agent", "OpenAIAgent"),
+    "claude": ("anthropic_agent", "AnthropicAgent"),
+    "deepseek": ("deepseek_agent", "DeepseekAgent")
+}
+# Where each agent type's class lives: (module name, class name)
+# Importing a provider SDK (openai, anthropic) takes hundreds of milliseconds, so a module is only
+# imported when its agent type is first used; a replica that only serves Claude never loads openai
 
 class AgentFactory:
     """Factory class for creating LLM agent instances."""
     # This class implements the Factory design pattern to create different types of AI agents
     # The Factory pattern centralizes object creation and makes it easier to change implementations
     
-    def __init__(self):
-        """Initialize the agent factory."""
+    def __init__(self, idle_timeout: Optional[float] = None):
+        """Initialize the agent factory.
+        
+        Args:
+            idle_timeout (float, optional): Seconds an unused agent stays in the pool.
+                Defaults to the AGENT_IDLE_TIMEOUT environment variable, or 600.
+        """
         # Constructor method that runs when a new AgentFactory is created
         
         self.agent_map = {
@@ -34,8 +60,77 @@ class AgentFactory:
         # This allows us to easily look up the correct method to call based on the agent type
         # The keys are strings representing the agent types
         # The values are methods of this class that create the corresponding agent types
+        
+        self.default_models = {
+            "gpt-4": "gpt-4",
+            "claude": "claude-3-5-sonnet-20240620",
+            "deepseek": "deepseek-chat"
+        }
+        # The model each agent type uses when no model name is given
+        # We need this to build the pool key, so "no model" and "the default model" share one agent
+        
+        self.registry = dict(AGENT_REGISTRY)
+        # Where each agent type's class lives (add more with register_agent)
+        
+        self._classes: Dict[str, Type[BaseAgent]] = {}
+        # Agent classes that have already been imported, keyed by agent type
+        
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("AGENT_IDLE_TIMEOUT", "600"))
+        # How long (in seconds) an agent may sit unused before it is removed from the pool
+        
+        self._pool: Dict[Tuple[str, str, str], Tuple[BaseAgent, float]] = {}
+        # The pool of live agents, keyed by (agent type, API key, model name)
+        # Each value holds the agent and the time it was last handed out
+        # Reusing an agent reuses its SDK client, so its HTTP connections and TLS sessions are reused too
+        
+        self._lock = threading.Lock()
+        # A lock so two sessions asking for the same agent at once don't both create one
+    
+    def load_agent_class(self, agent_type: str) -> Type[BaseAgent]:
+        """Return the agent class for an agent type, importing its module the first time.
+        
+        Args:
+            agent_type (str): The agent type ("gpt-4", "claude", "deepseek", ...)
+            
+        Returns:
+            Type[BaseAgent]: The agent class
+        """
+        if agent_type not in self._classes:
+            # First use of this provider: import its module (and its SDK) now
+            module_name, class_name = self.registry[agent_type]
+            # Look up where the class lives
+            
+            start = time.perf_counter()
+            # Time the import, since it is part of the first request's latency
+            
+            self._classes[agent_type] = getattr(importlib.import_module(module_name), class_name)
+            # Import the module and get the class from it (Python caches the module, so this is only slow once)
+            
+            print(f"DEBUG - Loaded {class_name} from {module_name} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        
+        return self._classes[agent_type]
+        # Return the class
+    
+    def register_agent(self, agent_type: str, module_name: str, class_name: str, default_model: str):
+        """Add an agent type without importing it yet.
+        
+        Args:
+            agent_type (str): The name used with get_agent
+            module_name (str): The module that defines the agent class
+            class_name (str): The agent class, which takes api_key and model_name
+            default_model (str): The model used when get_agent is given none
+        """
+        self.registry[agent_type] = (module_name, class_name)
+        # Remember where the class lives
+        
+        self.default_models[agent_type] = default_model
+        # Remember its default model
+        
+        self.agent_map[agent_type] = lambda api_key, model_name=default_model: \
+            self.load_agent_class(agent_type)(api_key=api_key, model_name=model_name)
+        # Create agents of this type like the built-in ones
     
-    def create_openai_agent(self, api_key: str, model_name: str = "gpt-4") -> OpenAIAgent:
+    def create_openai_agent(self, api_key: str, model_name: str = "gpt-4") -> "OpenAIAgent":
         """Create an instance of the OpenAI agent.
         
         Args:
@@ -49,10 +144,10 @@ class AgentFactory:
         # Takes an API key and an optional model name
         # Returns a new OpenAIAgent instance
         
-        return OpenAIAgent(api_key=api_key, model_name=model_name)
+        return self.load_agent_class("gpt-4")(api_key=api_key, model_name=model_name)
         # Create and return a new OpenAIAgent with the provided API key and model name
     
-    def create_anthropic_agent(self, api_key: str, model_name: str = "claude-3-5-sonnet-20240620") -> AnthropicAgent:
+    def create_anthropic_agent(self, api_key: str, model_name: str = "claude-3-5-sonnet-20240620") -> "AnthropicAgent":
         """Create an instance of the Anthropic agent.
         
         Args:
@@ -66,10 +161,10 @@ class AgentFactory:
         # Takes an API key and an optional model name
         # Returns a new AnthropicAgent instance
         
-        return AnthropicAgent(api_key=api_key, model_name=model_name)
+        return self.load_agent_class("claude")(api_key=api_key, model_name=model_name)
         # Create and return a new AnthropicAgent with the provided API key and model name
     
-    def create_deepseek_agent(self, api_key: str, model_name: str = "deepseek-chat") -> DeepseekAgent:
+    def create_deepseek_agent(self, api_key: str, model_name: str = "deepseek-chat") -> "DeepseekAgent":
         """Create an instance of the Deepseek agent.
         
         Args:
@@ -83,12 +178,15 @@ class AgentFactory:
         # Takes an API key and an optional model name
         # Returns a new DeepseekAgent instance
         
-        return DeepseekAgent(api_key=api_key, model_name=model_name)
+        return self.load_agent_class("deepseek")(api_key=api_key, model_name=model_name)
         # Create and return a new DeepseekAgent with the provided API key and model name
     
     def get_agent(self, agent_type: str, api_key: str, model_name: Optional[str] = None) -> Optional[BaseAgent]:
         """Get an agent instance based on the specified type.
         
+        Agents are pooled per (agent_type, api_key, model_name), so repeated calls
+        return the same live agent until it has been idle for ``idle_timeout`` seconds.
+        
         Args:
             agent_type (str): Type of agent to create ("gpt-4", "claude", or "deepseek")
             api_key (str): API key for the agent
@@ -108,14 +206,63 @@ class AgentFactory:
             return None
             # If not, return None to indicate that the agent type is not supported
         
-        create_func = self.agent_map[agent_type]
-        # Get the creation function for the requested agent type from our map
-        
-        if model_name:
-            # Check if a specific model name was provided
-            return create_func(api_key=api_key, model_name=model_name)
-            # If so, call the creation function with the API key and model name
-        else:
-            # If no model name was provided
-            return create_func(api_key=api_key) 
-            # Call the creation function with just the API key, using the default model name 
\ No newline at end of file
+        model_name = model_name or self.default_models[agent_type]
+        # Use the default model for this agent type if no model name was provided
+        
+        key = (agent_type, api_key, model_name)
+        # Build the pool key for this agent
+        
+        now = time.monotonic()
+        # Get the current time (monotonic, so clock changes can't break eviction)
+        
+        with self._lock:
+            # Only one session at a time may read or change the pool
+            
+            self._evict_idle(now)
+            # Remove agents that haven't been used for a while
+            
+            if key in self._pool:
+                # If we already have a live agent for this type, key and model
+                agent = self._pool[key][0]
+                # Reuse it instead of building a new client
+            else:
+                # Otherwise create a new agent
+                create_func = self.agent_map[agent_type]
+                # Get the creation function for the requested agent type from our map
+                
+                agent = create_func(api_key=api_key, model_name=model_name)
+                # Call the creation function with the API key and model name
+            
+            self._pool[key] = (agent, now)
+            # Store the agent with its last-used time
+            
+            return agent
+            # Return the pooled agent
+    
+    def clear_pool(self):
+        """Remove every agent from the pool."""
+        # Useful when API keys are rotated and the old clients should not be reused
+        
+        with self._lock:
+            # Protect the pool while we clear it
+            self._pool.clear()
+    
+    def _evict_idle(self, now: float):
+        """Remove agents that have been idle for longer than the idle timeout.
+        
+        Args:
+            now (float): The current monotonic time
+        """
+        # Private helper; the caller must already hold the lock
+        
+        expired = [key for key, (_, last_used) in self._pool.items() if now - last_used > self.idle_timeout]
+        # Find every agent whose last use is older than the idle timeout
+        
+        for key in expired:
+            # Loop over the expired agents
+            del self._pool[key]
+            # Drop them so their clients and connections can be garbage collected
+
+shared_agent_factory = AgentFactory()
+# The single, process-wide factory that app.py uses
+# Because Python caches imported modules, its pool is shared by every rerun and every session
@@ -1,20 +1,30 @@
-from typing import List, Dict, Any
+import contextlib
+# Import contextlib to keep a streaming response open after the rate limiter hands it back
+
+from typing import List, Dict, Any, AsyncIterator
 # Import typing hints to specify the expected types of variables and function parameters/returns
 # List: A list of items of a specific type
 # Dict: A dictionary with keys and values of specific types
 # Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
 
 import anthropic
 # Import the anthropic package, which provides the client for Anthropic's Claude AI models
 
-from base_agent import BaseAgent
+from base_agent import BaseAgent, StreamInterruptedError
 # Import the BaseAgent abstract base class that defines the common interface for all agents
 
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
 class AnthropicAgent(BaseAgent):
     """Agent for generating answers using Anthropic's Claude models."""
     # This class implements the BaseAgent interface for Anthropic's Claude models
     # It handles the specifics of communicating with the Anthropic API
     
+    token_provider = "anthropic"
+    # Count context tokens the way Anthropic does (see BaseAgent.format_context)
+    
     def __init__(self, api_key: str, model_name: str = "claude-3-5-sonnet-20240620"):
         """Initialize Anthropic agent with an API key and model name.
         
@@ -32,16 +42,95 @@ class AnthropicAgent(BaseAgent):
         self.model_name = model_name
         # Store the model name as an instance variable
         
-        self.client = anthropic.Anthropic(api_key=api_key)
-        # Create an Anthropic client with the provided API key
-        # This client will be used to make API calls to Anthropic
+        # The AsyncAnthropic client is created on first use by _get_client (see BaseAgent)
+        # so it can share the event loop's keep-alive connection pool
+
+    def _create_client(self, http_client) -> anthropic.AsyncAnthropic:
+        """Create an AsyncAnthropic client on top of the shared HTTP client.
+        
+        Args:
+            http_client (httpx.AsyncClient): The shared keep-alive HTTP client for the current loop
+            
+        Returns:
+            anthropic.AsyncAnthropic: The client used to make API calls to Anthropic
+        """
+        return anthropic.AsyncAnthropic(api_key=self.api_key, http_client=http_client, max_retries=0)
+        # Create an async Anthropic client with the API key that sends its requests through the shared pool
+        # The SDK's own retries are turned off; the rate limiter retries instead (see _rate_limiter)
+
+    def _build_request(self, query: str, context: str) -> Dict[str, Any]:
+        """Build the arguments for an Anthropic messages request.
+        
+        Args:
+            query (str): The user's question
+            context (str): The formatted retrieved information
+            
+        Returns:
+            Dict[str, Any]: Keyword arguments for messages.create / messages.stream
+        """
+        # Shared by generate_answer and stream_answer so both send exactly the same prompt
+        
+        return {
+            "model": self.model_name,
+            # Specify which model to use (e.g., "claude-3-5-sonnet-20240620")
+            "max_tokens": self.max_output_tokens,
+            # Set the maximum number of tokens (words/parts of words) in the response
+            "system": "You are a helpful assistant that provides comprehensive answers based on the retrieved information. Cite your sources when appropriate.",
+            # The system message sets the behavior of the assistant
+            # This content tells the model to act as a helpful assistant and cite sources
+            "messages": [
+                # Provide a list of messages that define the conversation
+                {"role": "user", "content": f"Based on the following information, please provide a comprehensive answer to this question: '{query}'\n\nRetrieved Information:\n{context}"}
+                # The user message contains the user's question and the context
+                # This content includes the user's question and the formatted context
+            ]
+        }
+
+    async def request_answer(self, query: str, results: List[RetrievedChunk]) -> str:
+        """Generate an answer using Claude, raising an exception if the API call fails.
+        
+        Args:
+            query (str): The user's question
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
+            
+        Returns:
+            str: The generated answer
+        """
+        # Callers that need to know about failures (like the provider router) use this method
+        # generate_answer below wraps it and turns failures into the fallback message
+        
+        context = self.format_context(results)
+        # Format the retrieved results into a context string using the method from BaseAgent
+        
+        request = self._build_request(query, context)
+        # Build the request
+        
+        with self._provider_call() as call:
+            # Time the API call and export it as a metric
+            response = await self._rate_limiter().call(
+                lambda: self._get_client().messages.create(**request),
+                tokens=self._estimate_tokens(request["system"] + request["messages"][0]["content"]),
+                # Wait for request and token budget, and retry 429s and overloads with backoff (see rate_limiter.py)
+                usage=lambda response: response.usage.input_tokens + response.usage.output_tokens
+                # Correct the token budget with what the call really used
+            )
+            # Make an asynchronous API call to create a message with the model, token limit, system prompt and messages
+            # Awaiting it lets other generations run on the same event loop in the meantime
+            # The API call returns a response object with the generated message
+            
+            call.record_usage(response.usage.input_tokens, response.usage.output_tokens)
+            # Record the tokens Anthropic says the call used
+        
+        return response.content[0].text
+        # Extract the text content of the first (and only) message in the response and return it
+        # This is the actual answer generated by the model
 
-    async def generate_answer(self, query: str, results: List[Dict[str, Any]]) -> str:
+    async def generate_answer(self, query: str, results: List[RetrievedChunk]) -> str:
         """Generate a comprehensive answer from retrieved results using Claude.
         
         Args:
             query (str): The user's question
-            results (List[Dict[str, Any]]): Retrieved results from Pinecone
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
             
         Returns:
             str: The generated answer
@@ -50,43 +139,78 @@ class AnthropicAgent(BaseAgent):
         # This method generates an answer to the user's question based on the retrieved results
         # It's marked as async, which means it's an asynchronous method that can be awaited
         
+        try:
+            # Try to generate an answer using the Claude API
+            return await self.request_answer(query, results)
+            
+        except Exception as e:
+            # If there's an error during the API call
+            print(f"Error generating answer with Claude: {e}")
+            # Print the error message for debugging
+            
+            return self.FALLBACK_ANSWER
+            # Return a fallback message to the user
+
+    async def stream_answer(self, query: str, results: List[RetrievedChunk]) -> AsyncIterator[str]:
+        """Stream an answer from retrieved results using Claude, one text delta at a time.
+        
+        Args:
+            query (str): The user's question
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
+            
+        Yields:
+            str: The next piece of the generated answer
+        """
+        # Same request as generate_answer, but using the streaming messages API
+        # Claude then sends the answer in small chunks as it is generated
+        
         context = self.format_context(results)
         # Format the retrieved results into a context string using the method from BaseAgent
         
+        sent = False
+        # Whether any text has reached the caller yet
+        
         try:
-            # Try to generate an answer using the Anthropic API
-            
-            # Since the Anthropic client doesn't have async methods, we'll use it synchronously
-            # In a production environment, you might want to use asyncio.to_thread() to run this in a thread pool
-            # This comment explains that the Anthropic client doesn't support async operations natively
-            # In a real production app, you'd want to run this in a separate thread to avoid blocking
+            # Try to stream an answer using the Anthropic API
+            request = self._build_request(query, context)
+            # Build the request
             
-            response = self.client.messages.create(
-                # Make an API call to create a message
-                model=self.model_name,
-                # Specify which model to use (e.g., "claude-3-5-sonnet-20240620")
-                max_tokens=1000,
-                # Set the maximum number of tokens (words/parts of words) in the response
-                system="You are a helpful assistant that provides comprehensive answers based on the retrieved information. Cite your sources when appropriate.",
-                # The system message sets the behavior of the assistant
-                # This content tells the model to act as a helpful assistant and cite sources
-                messages=[
-                    # Provide a list of messages that define the conversation
-                    {"role": "user", "content": f"Based on the following information, please provide a comprehensive answer to this question: '{query}'\n\nRetrieved Information:\n{context}"}
-                    # The user message contains the user's question and the context
-                    # This content includes the user's question and the formatted context
-                ]
-            )
-            # The API call returns a response object with the generated message
+            estimate = self._estimate_tokens(request["system"] + request["messages"][0]["content"])
+            # The tokens the rate limiter reserves until the stream reports what it used
             
-            return response.content[0].text
-            # Extract the text content of the first (and only) message in the response and return it
-            # This is the actual answer generated by the model
+            with self._provider_call() as call:
+                # Time the API call and export it as a metric
+                async with contextlib.AsyncExitStack() as stack:
+                    # The exit stack closes the stream (and releases the connection) when we're done
+                    stream = await self._rate_limiter().call(
+                        lambda: stack.enter_async_context(self._get_client().messages.stream(**request)),
+                        tokens=estimate
+                        # Wait for budget; a 429 when opening the stream is retried before any text is sent
+                    )
+                    
+                    async for text in stream.text_stream:
+                        # Loop over the text pieces as they arrive
+                        sent = True
+                        yield text
+                        # Pass the new text on to the caller straight away
+                    
+                    message = await stream.get_final_message()
+                    # The complete message, which includes the token usage
+                    
+                    self._rate_limiter().settle(estimate, message.usage.input_tokens + message.usage.output_tokens)
+                    # Correct the token budget with what the call really used
+                    
+                    call.record_usage(message.usage.input_tokens, message.usage.output_tokens)
+                    # Record the tokens Anthropic says the call used
             
         except Exception as e:
             # If there's an error during the API call
-            print(f"Error generating answer with Claude: {e}")
+            print(f"Error streaming answer with Claude: {e}")
             # Print the error message for debugging
             
-            return "I couldn't generate an answer based on the retrieved information."
-            # Return a fallback message to the user 
\ No newline at end of file
+            if sent:
+                # Part of the answer is already out: appending the fallback message would pass as the answer's end
+                raise StreamInterruptedError(f"Claude stream failed after part of the answer was sent: {e}") from e
+            
+            yield self.FALLBACK_ANSWER
+            # Nothing was sent yet, so send a fallback message to the user
@@ -0,0 +1,344 @@
+import asyncio
+# Import asyncio to notice when a streaming client disconnects
+
+import concurrent.futures
+# Import concurrent.futures to give the retrieval threads a pool sized for API traffic
+
+import json
+# Import json to read requests and write responses
+
+import os
+# Import the os module to read the server settings from environment variables
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Awaitable: Something that can be awaited, like a coroutine
+# Callable: A function
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+
+from dotenv import load_dotenv
+# Import load_dotenv to read the same .env file as the app
+
+load_dotenv()
+# Load the settings before our own modules are imported, because their shared caches read them
+
+from metrics import registry
+# Import the process-wide metrics, served at /metrics
+
+from base_agent import StreamInterruptedError
+# Import the error an agent raises when its stream fails partway
+
+from rag_service import Answer, RAGService, get_service
+# Import the question-answering service the Streamlit page uses too
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
+from tracing import Trace
+# Import the per-query stage timings, returned with every answer
+
+# A headless HTTP API over the same pipeline as the Streamlit page, for other services to call
+# It is a plain ASGI application, so it runs on any ASGI server without a web framework:
+#
+#   uvicorn api_server:app --host 0.0.0.0 --port 8000
+#
+# Endpoints:
+#   POST /answer          {"query": "...", "model": "gpt-4", "failover": false}  -> JSON answer
+#   POST /answer/stream   same body                                             -> server-sent events
+#   GET  /healthz                                                               -> {"status": "ok"}
+#   GET  /metrics                                                               -> Prometheus metrics
+
+MAX_BODY_BYTES = 64 * 1024
+# Requests are a question and two options, so anything bigger is refused
+
+class HTTPError(Exception):
+    """An error with an HTTP status code, returned to the client as {"error": message}."""
+
+    def __init__(self, status: int, message: str):
+        """Store the status code and the message."""
+        super().__init__(message)
+        self.status = status
+
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+# The ASGI send function
+
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+# The ASGI receive function
+
+async def send_response(send: Send, status: int, body: bytes, content_type: str):
+    """Send a complete (non-streaming) response."""
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+async def send_json(send: Send, status: int, payload: Any):
+    """Send a JSON response."""
+    await send_response(send, status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+def sse_event(event: str, data: Any) -> bytes:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+async def read_request(receive: Receive) -> Tuple[str, str, bool]:
+    """Read and validate an /answer request body.
+
+    Returns:
+        Tuple[str, str, bool]: The query, the agent type and whether to fail over
+
+    Raises:
+        HTTPError: If the body is too large, isn't JSON or has no query
+    """
+    body = b""
+    # The body arrives in one or more messages
+
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+
+        if not message.get("more_body"):
+            break
+
+    try:
+        request = json.loads(body or b"{}")
+    except json.JSONDecodeError:
+        raise HTTPError(400, "The request body must be JSON")
+
+    query = request.get("query") if isinstance(request, dict) else None
+    # The question to answer
+
+    if not isinstance(query, str) or not query.strip():
+        raise HTTPError(400, "'query' is required")
+
+    return query, str(request.get("model", "gpt-4")), bool(request.get("failover", False))
+
+def sources(results: List[RetrievedChunk]) -> List[Dict[str, Any]]:
+    """The retrieved documents an answer is based on, without their full text."""
+    return [{"title": result.title, "score": result.score} for result in results]
+
+def trace_summary(trace: Trace) -> Dict[str, Any]:
+    """Stage timings in milliseconds and token counts, as returned to the client."""
+    return {"timings_ms": {stage: round(seconds * 1000, 1) for stage, seconds in trace.durations().items()},
+            "tokens": trace.counts}
+
+class APIServer:
+    """The ASGI application."""
+
+    def __init__(self, service_factory: Callable[[], RAGService] = get_service):
+        """Initialize the application.
+
+        Args:
+            service_factory (Callable[[], RAGService], optional): Returns the service to answer with.
+                Defaults to the shared service configured from .env.
+        """
+        self.service_factory = service_factory
+        # Store how to get the service (it is created at startup, or on the first request)
+
+        self.service: Optional[RAGService] = None
+        # The service, once created
+
+    async def _get_service(self) -> RAGService:
+        """Return the service, creating it on a worker thread the first time (it connects to Pinecone)."""
+        if self.service is None:
+            self.service = await asyncio.to_thread(self.service_factory)
+
+        return self.service
+
+    async def __call__(self, scope: Dict[str, Any], receive: Receive, send: Send):
+        """Handle one ASGI connection."""
+        if scope["type"] == "lifespan":
+            # Server startup and shutdown
+            await self._lifespan(receive, send)
+            return
+
+        if scope["type"] != "http":
+            # No websockets
+            return
+
+        method, path = scope["method"], scope["path"]
+
+        try:
+            if method == "GET" and path == "/healthz":
+                await send_json(send, 200, {"status": "ok"})
+            elif method == "GET" and path == "/metrics":
+                await send_response(send, 200, registry.render_prometheus().encode("utf-8"),
+                                    "text/plain; version=0.0.4; charset=utf-8")
+            elif method == "POST" and path == "/answer":
+                await self._answer(scope, receive, send)
+            elif method == "POST" and path == "/answer/stream":
+                await self._stream(scope, receive, send)
+            else:
+                raise HTTPError(404, f"No route for {method} {path}")
+        except HTTPError as e:
+            # A problem with the request
+            await send_json(send, e.status, {"error": str(e)})
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        """Create the service at startup, so the first request doesn't pay for connecting."""
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(
+                    max_workers=int(os.getenv("API_RETRIEVAL_THREADS", "32")), thread_name_prefix="retrieval"))
+                # Retrieval is synchronous, so each in-flight search needs a thread
+
+                try:
+                    await self._get_service()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _new_trace(self, scope: Dict[str, Any]) -> Trace:
+        """A trace for one request, labelled with the caller so the rate limiters share capacity fairly.
+
+        The caller is the X-Session-Id header when the client sends one, otherwise its address.
+        """
+        headers = dict(scope.get("headers") or [])
+        # ASGI headers are (lowercase name, value) byte pairs
+
+        session = headers.get(b"x-session-id", b"").decode("latin-1").strip()
+        # The client's own session id, if it has one
+
+        if not session and scope.get("client"):
+            # Fall back to the client's host
+            session = scope["client"][0]
+
+        return Trace(session=session or None)
+
+    async def _check_request(self, receive: Receive) -> Tuple[RAGService, str, str, bool]:
+        """Read the request and check its model before doing any work.
+
+        Returns:
+            Tuple[RAGService, str, str, bool]: The service, the query, the agent type and whether to fail over
+
+        Raises:
+            HTTPError: If the request is invalid or names an unknown model
+        """
+        query, agent_type, failover = await read_request(receive)
+        # The question and options
+
+        service = await self._get_service()
+        # The shared service
+
+        try:
+            service.get_agent(agent_type)
+        except ValueError as e:
+            # An unknown model, or one without an API key
+            raise HTTPError(400, str(e))
+
+        return service, query, agent_type, failover
+
+    async def _answer(self, scope: Dict[str, Any], receive: Receive, send: Send):
+        """POST /answer: retrieve, generate and return the whole answer as JSON."""
+        service, query, agent_type, failover = await self._check_request(receive)
+        # The question and options
+
+        trace = self._new_trace(scope)
+        # Time this request's stages
+
+        retrieval = await service.aretrieve(query, trace)
+        # Embed and search on a worker thread
+
+        if not retrieval.results:
+            await send_json(send, 200, {"answer": None, "sources": [], **trace_summary(trace)})
+            return
+
+        answer = await service.generate(retrieval, agent_type, trace, failover=failover)
+        # Generate on this event loop, with the pooled agent's keep-alive client
+
+        await send_json(send, 200 if answer.ok else 502, {**answer.to_dict(), "sources": sources(retrieval.results),
+                                                          **trace_summary(trace)})
+
+    async def _stream(self, scope: Dict[str, Any], receive: Receive, send: Send):
+        """POST /answer/stream: send "sources", then "token" events as the answer arrives, then "done"."""
+        service, query, agent_type, _ = await self._check_request(receive)
+        # The question (failover doesn't apply: a stream can't switch providers halfway)
+
+        trace = self._new_trace(scope)
+        # Time this request's stages
+
+        retrieval = await service.aretrieve(query, trace)
+        # Embed and search on a worker thread
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]})
+        # Start the event stream
+
+        disconnected = asyncio.Event()
+        # Set when the client goes away, so we stop generating (and paying for) tokens nobody reads
+
+        async def watch_disconnect():
+            """Wait for the client to go away."""
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        # Listen for the disconnect while we stream
+
+        async def emit(event: str, data: Any, more: bool = True):
+            """Send one event (more=False ends the response)."""
+            await send({"type": "http.response.body", "body": sse_event(event, data), "more_body": more})
+
+        try:
+            await emit("sources", sources(retrieval.results))
+
+            if not retrieval.results:
+                await emit("done", {"answer": None, **trace_summary(trace)}, more=False)
+                return
+
+            answer = service.cached_answer(retrieval, agent_type)
+            # Reuse an answer to a near-identical question
+
+            if answer is not None:
+                # Send the whole cached answer as one piece
+                await emit("token", {"text": answer.answer})
+            else:
+                pieces = []
+                # Everything streamed so far
+
+                interrupted = False
+                # Whether the provider failed partway
+
+                stream = service.stream(retrieval, agent_type, trace)
+                # The service caches the answer once the stream finishes
+
+                try:
+                    async for piece in stream:
+                        if disconnected.is_set():
+                            # Nobody is listening any more
+                            return
+
+                        pieces.append(piece)
+                        await emit("token", {"text": piece})
+                except StreamInterruptedError as e:
+                    # The tokens sent so far are not a whole answer; "done" says so with "ok": false
+                    print(f"DEBUG - {e}")
+                    interrupted = True
+                finally:
+                    await stream.aclose()
+                    # Closes the provider's stream too when we stopped early
+
+                answer = Answer("".join(pieces), agent_type, service.get_agent(agent_type).model_name,
+                                interrupted=interrupted)
+
+            await emit("done", {**answer.to_dict(), **trace_summary(trace)}, more=False)
+        finally:
+            watcher.cancel()
+            # Stop listening for the disconnect
+
+app = APIServer()
+# The ASGI application: uvicorn api_server:app
@@ -4,44 +4,56 @@ import os
 import streamlit as st
 # Import Streamlit library which is used to create web applications with Python
 
-import asyncio
-# Import asyncio for asynchronous programming, allowing non-blocking operations
+import concurrent.futures
+# Import concurrent.futures to wait for several answers and handle each one as soon as it is ready
 
-import json
-# Import json module for handling JSON data
+import uuid
+# Import uuid to give each browser session an id, so provider capacity is shared fairly between users
 
 from dotenv import load_dotenv
 # Import load_dotenv to load environment variables from a .env file
 
-from pinecone.grpc import PineconeGRPC as Pinecone
-# Import the Pinecone GRPC client for vector database operations
-# GRPC is a high-performance remote procedure call framework
+# Load environment variables from .env file
+load_dotenv()
+# This loads API keys and other configuration from a .env file in the project directory
+# It runs before our own modules are imported, because their shared caches read settings from the environment
 
-from openai import OpenAI
-# Import OpenAI client for accessing OpenAI's API services
+# Import the process-wide background event loop
+from async_runner import get_runner
+# Import the helper that returns the long-lived event loop our async agents run on
 
-from langchain_openai import OpenAIEmbeddings
-# Import OpenAIEmbeddings from langchain to create vector embeddings of text
+# Import the process-wide resource manager
+from resource_manager import resource_manager, IndexNotFoundError
+# Import the shared cache for the Pinecone client, embeddings and vector store
+# It lives outside app.py so it survives Streamlit reruns
 
-from langchain_pinecone import PineconeVectorStore
-# Import PineconeVectorStore from langchain to interact with Pinecone vector database
+# Import the process-wide retrieval cache
+from retrieval_cache import retrieval_cache
+# Import the cache that reuses search results, so switching models doesn't repeat the Pinecone query
 
-import anthropic
-# Import anthropic for accessing Anthropic's Claude AI models
+# Import the Pinecone retrieval backend
+from retrieval_backend import PineconeBackend
+# Import the wrapper that gives Pinecone the same search interface as the local index
 
-import requests
-# Import requests for making HTTP requests
+# Import the query pipeline
+from query_pipeline import QueryPipeline
+# Import the retrieval-and-answer path (embed -> search -> format_context -> generate) shared with the benchmark
 
-from PIL import Image
-# Import Image from PIL (Pillow) for handling image files
+# Import the per-query stage timings
+from tracing import Trace
+# Import the trace that records how long each stage of a query took
 
-# Import our agent factory
-from agent_factory import AgentFactory
-# Import the AgentFactory class which creates different AI agents (OpenAI, Anthropic, Deepseek)
+# Import the metrics exporter
+from metrics import start_metrics_server
+# Import the helper that serves Prometheus metrics when METRICS_PORT is set
 
-# Load environment variables from .env file
-load_dotenv()
-# This loads API keys and other configuration from a .env file in the project directory
+from base_agent import StreamInterruptedError
+# Import the error an agent raises when its stream fails partway
+
+# Import the question-answering service
+from rag_service import RAGService
+# Import the service that answers questions (with the answer cache and provider failover), shared with the HTTP API
+# It gets its agents from the shared AgentFactory, which pools them so their API clients survive reruns
 
 # Configure Streamlit page
 st.set_page_config(page_title="Pinecone Query Agent", page_icon="🔍", layout="wide")
@@ -84,225 +96,231 @@ if not deepseek_api_key:
     st.stop()
     # Stop the application execution
 
-# Initialize Pinecone by getting the API key and index name from environment variables
-pinecone_api_key = os.getenv("PINECONE_API_KEY")
-# Get the Pinecone API key from environment variables
+# Choose where documents are searched: Pinecone (the default) or a local index built with local_index.py
+retrieval_backend_name = os.getenv("RETRIEVAL_BACKEND", "pinecone").lower()
+# Set RETRIEVAL_BACKEND=local to run the whole query path without Pinecone
 
-pinecone_index_name = os.getenv("PINECONE_INDEX_NAME", "pydanticai")
-# Get the Pinecone index name from environment variables, defaulting to "pydanticai" if not specified
+if retrieval_backend_name == "local":
+    # Search a local, memory-mapped vector index (for offline development and load tests)
+    local_index_dir = os.getenv("LOCAL_INDEX_DIR", ".cache/local_index")
+    # Get the index directory from environment variables
+    
+    try:
+        # Try to open the shared local index
+        backend = resource_manager.get_local_backend(openai_api_key, local_index_dir)
+        # The index is memory-mapped once per process and shared by every session
+        
+    except Exception as e:
+        # If the index is missing or can't be read
+        st.error(f"Error opening the local index: {str(e)}")
+        # Display an error message
+        
+        st.stop()
+        # Stop the application execution
 
-# Debug print statements - these will only show in the terminal, not in the Streamlit UI
-print(f"DEBUG - Pinecone API key first 5 chars: {pinecone_api_key[:5] if pinecone_api_key else 'None'}")
-# Print the first 5 characters of the Pinecone API key for debugging
+else:
+    # Initialize Pinecone by getting the API key and index name from environment variables
+    pinecone_api_key = os.getenv("PINECONE_API_KEY")
+    # Get the Pinecone API key from environment variables
 
-print(f"DEBUG - Pinecone API key length: {len(pinecone_api_key) if pinecone_api_key else 'None'}")
-# Print the length of the Pinecone API key for debugging
+    pinecone_index_name = os.getenv("PINECONE_INDEX_NAME", "pydanticai")
+    # Get the Pinecone index name from environment variables, defaulting to "pydanticai" if not specified
 
-print(f"DEBUG - Pinecone index name: {pinecone_index_name}")
-# Print the Pinecone index name for debugging
+    # Debug print statements - these will only show in the terminal, not in the Streamlit UI
+    print(f"DEBUG - Pinecone API key first 5 chars: {pinecone_api_key[:5] if pinecone_api_key else 'None'}")
+    # Print the first 5 characters of the Pinecone API key for debugging
 
-# Check for special characters or whitespace in the API key
-if pinecone_api_key:
-    # If the Pinecone API key exists
-    if pinecone_api_key.strip() != pinecone_api_key:
-        # Check if the API key has leading or trailing whitespace
-        print("WARNING: Pinecone API key contains leading or trailing whitespace!")
-        # Print a warning if whitespace is detected
+    print(f"DEBUG - Pinecone API key length: {len(pinecone_api_key) if pinecone_api_key else 'None'}")
+    # Print the length of the Pinecone API key for debugging
+
+    print(f"DEBUG - Pinecone index name: {pinecone_index_name}")
+    # Print the Pinecone index name for debugging
+
+    # Check for special characters or whitespace in the API key
+    if pinecone_api_key:
+        # If the Pinecone API key exists
+        if pinecone_api_key.strip() != pinecone_api_key:
+            # Check if the API key has leading or trailing whitespace
+            print("WARNING: Pinecone API key contains leading or trailing whitespace!")
+            # Print a warning if whitespace is detected
         
-        # Try to clean the API key by removing whitespace
-        pinecone_api_key = pinecone_api_key.strip()
-        # Remove leading and trailing whitespace from the API key
+            # Try to clean the API key by removing whitespace
+            pinecone_api_key = pinecone_api_key.strip()
+            # Remove leading and trailing whitespace from the API key
         
-        print(f"DEBUG - Cleaned API key first 5 chars: {pinecone_api_key[:5]}")
-        # Print the first 5 characters of the cleaned API key for debugging
-
-# Allow manual input of API key if needed
-if not pinecone_api_key:
-    # If the Pinecone API key is not found in environment variables
-    st.warning("Pinecone API key not found in environment variables.")
-    # Display a warning message
+            print(f"DEBUG - Cleaned API key first 5 chars: {pinecone_api_key[:5]}")
+            # Print the first 5 characters of the cleaned API key for debugging
+
+    # Allow manual input of API key if needed
+    if not pinecone_api_key:
+        # If the Pinecone API key is not found in environment variables
+        st.warning("Pinecone API key not found in environment variables.")
+        # Display a warning message
     
-    pinecone_api_key = st.text_input("Enter your Pinecone API key:", type="password")
-    # Create a text input field for the user to enter their Pinecone API key
+        pinecone_api_key = st.text_input("Enter your Pinecone API key:", type="password")
+        # Create a text input field for the user to enter their Pinecone API key
     
-    if not pinecone_api_key:
-        # If the user doesn't enter an API key
-        st.stop()
-        # Stop the application execution
+        if not pinecone_api_key:
+            # If the user doesn't enter an API key
+            st.stop()
+            # Stop the application execution
 
-if not pinecone_index_name:
-    # If the Pinecone index name is not found in environment variables
-    st.warning("Pinecone index name not found in environment variables.")
-    # Display a warning message
+    if not pinecone_index_name:
+        # If the Pinecone index name is not found in environment variables
+        st.warning("Pinecone index name not found in environment variables.")
+        # Display a warning message
     
-    pinecone_index_name = st.text_input("Enter your Pinecone index name:", value="pydanticai")
-    # Create a text input field for the user to enter their Pinecone index name, with a default value
+        pinecone_index_name = st.text_input("Enter your Pinecone index name:", value="pydanticai")
+        # Create a text input field for the user to enter their Pinecone index name, with a default value
     
-    if not pinecone_index_name:
-        # If the user doesn't enter an index name
-        st.stop()
-        # Stop the application execution
+        if not pinecone_index_name:
+            # If the user doesn't enter an index name
+            st.stop()
+            # Stop the application execution
 
-# SIMPLIFIED PINECONE INITIALIZATION
-try:
-    # Try to initialize Pinecone and connect to the index
+    # SIMPLIFIED PINECONE INITIALIZATION
+    try:
+        # Try to initialize Pinecone and connect to the index
     
-    # Initialize Pinecone client using the GRPC client
-    print("DEBUG - Creating Pinecone connection via LangChain...")
-    # Print a debug message
+        # The client, index list, embeddings and vector store are cached by the resource manager
+        # Only the first run in this process pays for the network round trips; later reruns reuse them
+        print("DEBUG - Getting Pinecone connection from the resource manager...")
+        # Print a debug message
     
-    try:
-        # Try to initialize the Pinecone client
-        
-        # Initialize Pinecone with the GRPC client
-        pc = Pinecone(api_key=pinecone_api_key)
-        # Create a Pinecone client instance with the API key
-        
-        print("DEBUG - Pinecone initialized successfully")
-        # Print a debug message if initialization is successful
-        
-        # Verify connection by listing indexes
         try:
-            # Try to list the available indexes
-            indexes = pc.list_indexes()
-            # Get a list of all indexes in the Pinecone account
-            
-            print(f"DEBUG - Successfully listed indexes: {indexes}")
-            # Print a debug message with the list of indexes
-            
-            # Check if our index exists
-            index_names = [idx.name for idx in indexes]
-            # Create a list of index names
+            # Try to get the shared Pinecone connection
+        
+            # Verify connection by listing indexes
+            try:
+                # Try to get the vector store for our index (this lists the indexes the first time)
+                vector_store = resource_manager.get_vector_store(
+                    pinecone_api_key=pinecone_api_key,  # The Pinecone API key
+                    openai_api_key=openai_api_key,      # The OpenAI API key used for query embeddings
+                    index_name=pinecone_index_name      # The name of the Pinecone index
+                )
             
-            if pinecone_index_name not in index_names:
+            except IndexNotFoundError as e:
                 # If the specified index name is not found
-                st.error(f"Index '{pinecone_index_name}' not found in your Pinecone account. Available indexes: {index_names}")
+                st.error(str(e))
                 # Display an error message with the available indexes
-                
+            
                 st.stop()
                 # Stop the application execution
-                
-        except Exception as e:
-            # If there's an error listing indexes
-            print(f"DEBUG - Error listing indexes: {str(e)}")
-            # Print a debug message with the error
             
-            st.error(f"Error connecting to Pinecone: {str(e)}")
-            # Display an error message
+            except Exception as e:
+                # If there's an error listing indexes
+                print(f"DEBUG - Error listing indexes: {str(e)}")
+                # Print a debug message with the error
             
-            st.error("Your API key may be invalid or expired. Please check your Pinecone console.")
-            # Display a more specific error message about the API key
+                resource_manager.invalidate(pinecone_api_key)
+                # Forget the failed client so the next attempt starts from scratch
             
-            # Option to enter a new API key
-            new_api_key = st.text_input("Enter a new Pinecone API key:", type="password", key="new_api_key")
-            # Create a text input field for the user to enter a new API key
+                st.error(f"Error connecting to Pinecone: {str(e)}")
+                # Display an error message
+            
+                st.error("Your API key may be invalid or expired. Please check your Pinecone console.")
+                # Display a more specific error message about the API key
             
-            if new_api_key and st.button("Try with new API key"):
-                # If the user enters a new API key and clicks the button
-                pinecone_api_key = new_api_key
-                # Update the API key
+                # Option to enter a new API key
+                new_api_key = st.text_input("Enter a new Pinecone API key:", type="password", key="new_api_key")
+                # Create a text input field for the user to enter a new API key
+            
+                if new_api_key and st.button("Try with new API key"):
+                    # If the user enters a new API key and clicks the button
+                    pinecone_api_key = new_api_key
+                    # Update the API key
                 
-                st.experimental_rerun()
-                # Rerun the application with the new API key
+                    st.experimental_rerun()
+                    # Rerun the application with the new API key
             
-            st.stop()
-            # Stop the application execution
-        
-        # Initialize OpenAI embeddings for converting text to vectors
-        embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",  # Use OpenAI's text-embedding-3-small model
-            openai_api_key=openai_api_key    # Pass the OpenAI API key
-        )
-        
-        # Create the vector store directly - using the correct method for the GRPC client
-        vector_store = PineconeVectorStore.from_existing_index(
-            index_name=pinecone_index_name,  # The name of the Pinecone index
-            embedding=embeddings,            # The embedding model to use
-            text_key="text"                  # The key in the metadata that contains the text
-        )
-        print("DEBUG - PineconeVectorStore created successfully")
-        # Print a debug message if the vector store is created successfully
+                st.stop()
+                # Stop the application execution
         
-        # Get the underlying index
-        index = vector_store._index
-        # Access the underlying Pinecone index object
+            # Get the underlying index
+            index = vector_store._index
+            # Access the underlying Pinecone index object
         
-        print("DEBUG - Successfully connected to index")
-        # Print a debug message if the connection is successful
+        except Exception as e:
+            # If there's an error creating the Pinecone connection
+            print(f"DEBUG - Error creating Pinecone connection: {str(e)}")
+            # Print a debug message with the error
         
-    except Exception as e:
-        # If there's an error creating the Pinecone connection
-        print(f"DEBUG - Error creating Pinecone connection: {str(e)}")
-        # Print a debug message with the error
+            resource_manager.invalidate(pinecone_api_key)
+            # Forget the failed client so the next attempt starts from scratch
         
-        st.error(f"Error connecting to Pinecone: {str(e)}")
-        # Display an error message
+            st.error(f"Error connecting to Pinecone: {str(e)}")
+            # Display an error message
         
-        # Provide more helpful error messages based on common issues
-        if "401" in str(e) or "unauthorized" in str(e).lower() or "invalid api key" in str(e).lower():
-            # If the error is related to authentication
-            st.error("Authentication failed. Your Pinecone API key appears to be invalid or expired.")
-            # Display a more specific error message about authentication
+            # Provide more helpful error messages based on common issues
+            if "401" in str(e) or "unauthorized" in str(e).lower() or "invalid api key" in str(e).lower():
+                # If the error is related to authentication
+                st.error("Authentication failed. Your Pinecone API key appears to be invalid or expired.")
+                # Display a more specific error message about authentication
             
-            st.info("Please check your Pinecone console and generate a new API key if needed.")
-            # Display information about how to fix the issue
+                st.info("Please check your Pinecone console and generate a new API key if needed.")
+                # Display information about how to fix the issue
             
-            # Option to enter a new API key
-            new_api_key = st.text_input("Enter a new Pinecone API key:", type="password", key="new_api_key_inner")
-            # Create a text input field for the user to enter a new API key
+                # Option to enter a new API key
+                new_api_key = st.text_input("Enter a new Pinecone API key:", type="password", key="new_api_key_inner")
+                # Create a text input field for the user to enter a new API key
             
-            if new_api_key and st.button("Try with new API key", key="try_new_key_inner"):
-                # If the user enters a new API key and clicks the button
-                pinecone_api_key = new_api_key
-                # Update the API key
+                if new_api_key and st.button("Try with new API key", key="try_new_key_inner"):
+                    # If the user enters a new API key and clicks the button
+                    pinecone_api_key = new_api_key
+                    # Update the API key
                 
-                st.experimental_rerun()
-                # Rerun the application with the new API key
+                    st.experimental_rerun()
+                    # Rerun the application with the new API key
         
-        st.stop()
-        # Stop the application execution
+            st.stop()
+            # Stop the application execution
     
-except Exception as e:
-    # If there's an error in the outer try block
-    print(f"DEBUG - Outer exception: {str(e)}")
-    # Print a debug message with the error
+    except Exception as e:
+        # If there's an error in the outer try block
+        print(f"DEBUG - Outer exception: {str(e)}")
+        # Print a debug message with the error
     
-    st.error(f"Error connecting to Pinecone: {str(e)}")
-    # Display an error message
+        st.error(f"Error connecting to Pinecone: {str(e)}")
+        # Display an error message
     
-    st.exception(e)
-    # Display the full exception details
+        st.exception(e)
+        # Display the full exception details
     
-    st.stop()
-    # Stop the application execution
+        st.stop()
+        # Stop the application execution
 
-# Initialize agent factory for creating AI agents
-agent_factory = AgentFactory()
-# Create an instance of the AgentFactory class
+    backend = PineconeBackend(pinecone_index_name, vector_store)
+    # Wrap the vector store in the same interface as the local index
 
-# Helper function to run async functions in Streamlit
-def run_async(coro):
-    """
-    Run an asynchronous coroutine in a synchronous context.
-    
-    Args:
-        coro: The coroutine (async function) to run
-        
-    Returns:
-        The result of the coroutine
-    """
-    loop = asyncio.new_event_loop()
-    # Create a new event loop
-    
-    asyncio.set_event_loop(loop)
-    # Set the event loop
-    
-    try:
-        return loop.run_until_complete(coro)
-        # Run the coroutine until it completes and return the result
-    finally:
-        loop.close()
-        # Close the event loop
+# Get the background event loop used to run async agent code from Streamlit
+runner = get_runner()
+# One loop runs for the whole process on its own thread, so pooled async connections survive between queries
+
+# Serve stage latencies, provider call latencies and token counts for Prometheus
+start_metrics_server()
+# Does nothing unless METRICS_PORT is set, and only starts one server however often the script reruns
+
+# Get the appropriate agent based on the selected model
+agent_type_map = {
+    "GPT-4": "gpt-4",           # Map the display name to the internal name
+    "Claude": "claude",          # Map the display name to the internal name
+    "Deepseek": "deepseek"       # Map the display name to the internal name
+}
+
+display_name_map = {agent_type: name for name, agent_type in agent_type_map.items()}
+# The reverse mapping, used to label each answer in compare mode
+
+# Map the agent type to the corresponding API key
+api_key_map = {
+    "gpt-4": openai_api_key,           # Map the internal name to the API key
+    "claude": anthropic_api_key,        # Map the internal name to the API key
+    "deepseek": deepseek_api_key        # Map the internal name to the API key
+}
+
+# Build the question-answering service on top of the chosen backend
+service = RAGService(QueryPipeline(backend), api_key_map)
+# The same service the HTTP API uses (see rag_service.py): retrieval, the answer cache and provider failover
+# It shares the retrieval cache, keyword index, reranker and pooled agents, so building it on every rerun is cheap
 
 # Query interface section
 st.subheader("Ask a question")
@@ -315,6 +333,17 @@ model_option = st.radio(
     horizontal=True                                 # Display the options horizontally
 )
 
+# Option to route around slow or failing providers
+use_failover = st.checkbox(
+    "Fail over to other models when the selected one is slow or failing",
+    help="Sends a backup request to another model if the selected one is slower than usual, and uses whichever answers first."
+)
+# When checked, the answer comes from the provider router instead of streaming from the selected model
+
+# Option to ask every model at once
+compare_all = st.checkbox("Compare all models side by side")
+# When checked, every model answers concurrently and the answers are shown next to each other
+
 # Text input for the user's question
 query = st.text_input("Enter your question:")
 # Create a text input field for the user to enter their question
@@ -329,14 +358,19 @@ if st.button("Get Answer"):
             try:
                 # Try to search and generate an answer
                 
-                # Query Pinecone using the vector store's similarity search
-                search_results = vector_store.similarity_search_with_score(
-                    query=query,  # The user's question
-                    k=5            # Return the top 5 most similar results - adjust this value to retrieve more or fewer results
-                )
+                trace = Trace(session=st.session_state.setdefault("session_id", uuid.uuid4().hex))
+                # Record how long each stage of this query takes
+                # The session id lets the rate limiters share provider capacity fairly between users
+                
+                st.session_state.query_traces = (st.session_state.get("query_traces", []) + [(query, trace)])[-5:]
+                # Keep the last few queries' timings for the sidebar (the trace fills in as the query runs)
+                
+                # Embed the question, search the index and prepare the results for the agents
+                retrieval = service.retrieve(query, trace)
+                # See query_pipeline.py: embed -> search (plus keyword search and reranking) -> processed results
                 
                 # Check if we got any results
-                if not search_results:
+                if not retrieval.results:
                     # If no results were found
                     st.info("No relevant information found to answer your question.")
                     # Display an information message
@@ -344,65 +378,100 @@ if st.button("Get Answer"):
                     st.stop()
                     # Stop the application execution
                 
-                # Process results without displaying them
-                processed_results = []
-                # Create an empty list to store the processed results
-                
-                for doc, score in search_results:
-                    # For each document and its similarity score
+                if compare_all:
+                    # Compare mode: every model answers the same question, using the same search results
+                    st.subheader("Answers from all models")
+                    # Display a subheading for the comparison
                     
-                    # Create a result dictionary for the agent
-                    result_dict = {
-                        "score": float(score),           # The similarity score as a float
-                        "text": doc.page_content,        # The content of the document
-                        **doc.metadata                   # Include all metadata from the document
-                    }
-                    processed_results.append(result_dict)
-                    # Add the result dictionary to the processed results list
-                
-                # Get the appropriate agent based on the selected model
-                agent_type_map = {
-                    "GPT-4": "gpt-4",           # Map the display name to the internal name
-                    "Claude": "claude",          # Map the display name to the internal name
-                    "Deepseek": "deepseek"       # Map the display name to the internal name
-                }
-                
-                # Map the agent type to the corresponding API key
-                api_key_map = {
-                    "gpt-4": openai_api_key,           # Map the internal name to the API key
-                    "claude": anthropic_api_key,        # Map the internal name to the API key
-                    "deepseek": deepseek_api_key        # Map the internal name to the API key
-                }
+                    agent_types = service.agent_types
+                    # Every agent type we have an API key for
+                    
+                    columns = st.columns(len(agent_types))
+                    # One column per model
+                    
+                    placeholders = {}
+                    # The empty slot in each column where the answer will appear
+                    
+                    pending = {}
+                    # The answers still being generated, keyed by their future
+                    
+                    for column, agent_type in zip(columns, agent_types):
+                        # Loop through each model and its column
+                        column.markdown(f"**{display_name_map.get(agent_type, agent_type)}**")
+                        # Label the column with the model's display name
+                        
+                        placeholders[agent_type] = column.empty()
+                        # Reserve a slot for the answer
+                        
+                        placeholders[agent_type].info("Generating...")
+                        # Show that this model is still working
+                        
+                        future = runner.submit(service.generate(retrieval, agent_type, trace))
+                        # Start the generation on the background loop without waiting for it (cached answers return at once)
+                        # All models run at the same time, so the total wait is the slowest model, not the sum
+                        
+                        pending[future] = agent_type
+                        # Remember which model this future belongs to
+                    
+                    for future in concurrent.futures.as_completed(pending):
+                        # Handle each answer as soon as it finishes, in whatever order they finish
+                        try:
+                            answer = future.result()
+                            # Get the generated answer
+                        except Exception as e:
+                            # This model failed; the other columns still get their answers
+                            placeholders[pending[future]].error(f"Error generating answer: {str(e)}")
+                            # Show the error in this model's column
+                            continue
+                        
+                        badge = ":green[**⚡ cached**]\n\n" if answer.cached else ""
+                        # Show a badge so users know the answer was reused
+                        
+                        placeholders[pending[future]].markdown(f"{badge}{answer.answer}")
+                        # Display the answer in the model's column
                 
-                # Get the agent type and API key
-                agent_type = agent_type_map.get(model_option)
-                # Get the internal agent type name based on the selected model
+                else:
+                    # Single-model mode
+                    # Get the agent type
+                    agent_type = agent_type_map.get(model_option)
+                    # Get the internal agent type name based on the selected model
                 
-                api_key = api_key_map.get(agent_type)
-                # Get the API key for the selected agent type
+                    # Display the answer
+                    st.subheader(f"Answer (Generated by {model_option})")
+                    # Display a subheading with the model name
                 
-                # Create and use the agent
-                agent = agent_factory.get_agent(agent_type, api_key)
-                # Create an agent of the selected type with the appropriate API key
+                    # Look for an answer to a near-identical question
+                    cached = service.cached_answer(retrieval, agent_type)
+                    # Returns None if no similar enough question has been answered recently
                 
-                if not agent:
-                    # If the agent couldn't be created
-                    st.error(f"Could not create agent for {model_option}")
-                    # Display an error message
+                    if cached is not None:
+                        # If we found a cached answer
+                        st.markdown(":green[**⚡ cached**]")
+                        # Show a badge so users know the answer was reused
                     
-                    st.stop()
-                    # Stop the application execution
-                
-                # Generate the answer using the agent
-                answer = run_async(agent.generate_answer(query, processed_results))
-                # Run the agent's generate_answer method asynchronously
-                
-                # Display the answer
-                st.subheader(f"Answer (Generated by {model_option})")
-                # Display a subheading with the model name
+                        st.markdown(cached.answer)
+                        # Display the cached answer with Markdown formatting
+                    elif use_failover:
+                        # Generate the answer through the router, which hedges and fails over between providers
+                        answer = runner.run(service.generate(retrieval, agent_type, trace, failover=True))
+                        # The answer says which agent type produced it
+                    
+                        if answer.agent_type != agent_type:
+                            # Another provider answered first (or the selected one failed)
+                            st.caption(f"Answered by {display_name_map.get(answer.agent_type, answer.agent_type)} because {model_option} was slow or unavailable.")
+                            # Tell the user which model the answer actually came from
+                    
+                        st.markdown(answer.answer)
+                        # Display the generated answer with Markdown formatting
+                    else:
+                        # Generate the answer using the agent, showing each piece as it arrives
+                        st.write_stream(runner.iterate(service.stream(retrieval, agent_type, trace)))
+                        # st.write_stream renders the text progressively; the service caches the finished answer
                 
-                st.markdown(answer)
-                # Display the generated answer with Markdown formatting
+            except StreamInterruptedError as e:
+                # The model stopped partway, so the text above is incomplete (and wasn't cached)
+                st.warning(f"The answer was cut off because the model stopped responding: {str(e)}")
+                # Tell the user the answer is incomplete
                 
             except Exception as e:
                 # If there's an error during search or answer generation
@@ -423,8 +492,7 @@ with st.sidebar:
     # Display logo at the top of the sidebar if it exists
     logo_path = os.path.join("assets", "AIworkshopLogo.png")
     if os.path.exists(logo_path):
-        logo = Image.open(logo_path)
-        st.image(logo, width=100)  # Adjust width as needed for proper display in the sidebar
+        st.image(logo_path, width=100)  # Adjust width as needed for proper display in the sidebar
         # The logo is placed at the top of the sidebar for better visibility and branding
     
     st.subheader("About")
@@ -444,8 +512,32 @@ with st.sidebar:
     st.subheader("Configuration")
     # Display a subheading
     
-    st.write(f"**Index:** {pinecone_index_name}")
-    # Display the Pinecone index name
+    st.write(f"**Index:** {backend.name}")
+    # Display the index being searched
+    
+    if st.button("Refresh search results", help="Use this after updating the index, so cached search results are not reused."):
+        # If the user says the index has changed
+        retrieval_cache.invalidate(backend.name)
+        # Forget every cached search result for this index
+    
+    query_traces = st.session_state.get("query_traces", [])
+    # The timings of this session's last few queries
+    
+    if query_traces:
+        # Show where the time went, newest query first
+        st.subheader("Query Timings")
+        # Display a subheading
+        
+        for position, (traced_query, trace) in enumerate(reversed(query_traces)):
+            # One collapsible panel per query, with only the newest one open
+            with st.expander(traced_query[:60], expanded=position == 0):
+                for stage, seconds in trace.durations().items():
+                    # Time spent in each stage (provider_call:* is the API call alone)
+                    st.write(f"**{stage}:** {seconds * 1000:.0f} ms")
+                
+                for name, amount in sorted(trace.counts.items()):
+                    # Tokens used per provider (tokens:<provider>:prompt / completion), tokens saved and results sent
+                    st.write(f"**{name}:** {amount:.0f}")
     
     st.subheader("Available Models")
     # Display a subheading
@@ -0,0 +1,181 @@
+import asyncio
+# Import asyncio for asynchronous programming, allowing non-blocking operations
+
+import atexit
+# Import atexit so the background loop is shut down cleanly when the process exits
+
+import concurrent.futures
+# Import concurrent.futures for the Future objects returned to synchronous callers
+
+import threading
+# Import threading to run the event loop on its own dedicated thread
+
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
+# Coroutine: The object returned by calling an async function
+# Iterator: An object that produces values one at a time with "for"
+# Optional: Indicates that a value can be of a specific type or None
+
+class BackgroundLoop:
+    """A long-lived asyncio event loop running on a dedicated thread."""
+    # Streamlit scripts are synchronous, but our agents are async
+    # Instead of creating and closing a new event loop for every query (which throws away
+    # every pooled connection bound to that loop), we keep one loop running for the whole process
+    # and hand coroutines to it from whichever thread the Streamlit session runs on
+
+    def __init__(self, name: str = "async-runner"):
+        """Initialize the runner. The loop thread is started on first use.
+
+        Args:
+            name (str, optional): Name of the loop thread. Defaults to "async-runner".
+        """
+        self.name = name
+        # Store the thread name (it shows up in debuggers and thread dumps)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # The event loop, created when the runner starts
+
+        self._thread: Optional[threading.Thread] = None
+        # The thread the event loop runs on
+
+        self._lock = threading.Lock()
+        # A lock so two sessions can't start the loop at the same time
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The running background event loop (started if necessary)."""
+        self._ensure_started()
+        # Make sure the loop thread is running
+
+        return self._loop
+        # Return the loop
+
+    def _ensure_started(self):
+        """Start the loop thread if it isn't running yet."""
+        # Private helper called before every submit
+
+        with self._lock:
+            # Only one thread at a time may start the loop
+
+            if self._thread is not None and self._thread.is_alive():
+                # The loop is already running
+                return
+
+            self._loop = asyncio.new_event_loop()
+            # Create the event loop that will live for the whole process
+
+            self._thread = threading.Thread(target=self._run_loop, name=self.name, daemon=True)
+            # Create a daemon thread so it never keeps the process alive on its own
+
+            self._thread.start()
+            # Start the thread, which runs the loop forever
+
+    def _run_loop(self):
+        """Thread target: run the event loop until stop() is called."""
+        asyncio.set_event_loop(self._loop)
+        # Make the loop the current loop for this thread
+
+        self._loop.run_forever()
+        # Process submitted coroutines until the loop is stopped
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedule a coroutine on the background loop without waiting for it.
+
+        Args:
+            coro: The coroutine (async function call) to run
+
+        Returns:
+            concurrent.futures.Future: A future that will hold the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+        # Hand the coroutine to the loop thread; this is safe to call from any thread
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the background loop and wait for its result.
+
+        Args:
+            coro: The coroutine (async function call) to run
+            timeout (float, optional): Seconds to wait before giving up. Defaults to None (wait forever).
+
+        Returns:
+            The result of the coroutine
+        """
+        future = self.submit(coro)
+        # Schedule the coroutine on the background loop
+
+        try:
+            return future.result(timeout)
+            # Block this (Streamlit) thread until the result is ready
+        except BaseException:
+            # If we time out, or Streamlit interrupts the script (for example on a rerun)
+            future.cancel()
+            # Cancel the coroutine so it doesn't keep running in the background
+            raise
+
+    def iterate(self, agen: AsyncIterator) -> Iterator:
+        """Iterate over an async generator from synchronous code.
+
+        Each item is produced on the background loop and handed back as soon as it is ready.
+
+        Args:
+            agen: The async generator to iterate over
+
+        Yields:
+            Each item produced by the async generator
+        """
+        try:
+            while True:
+                # Keep pulling items until the generator is finished
+                try:
+                    yield self.run(_anext(agen))
+                    # Run the generator up to its next item on the background loop
+                except StopAsyncIteration:
+                    # The generator has no more items
+                    break
+        finally:
+            self.run(agen.aclose())
+            # Let the generator clean up (for example release its HTTP connection),
+            # also when the caller stops early
+
+    def stop(self):
+        """Stop the background loop and wait for its thread to finish."""
+        with self._lock:
+            # Protect the loop and thread while we shut them down
+
+            if self._thread is None or not self._thread.is_alive():
+                # Nothing to stop
+                return
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            # Ask the loop to stop after its current iteration
+
+            self._thread.join(timeout=5)
+            # Wait (briefly) for the thread to exit
+
+            self._loop.close()
+            # Release the loop's resources
+
+            self._thread = None
+            # Forget the thread so the runner can be restarted if needed
+
+async def _anext(agen: AsyncIterator) -> Any:
+    """Await the next item of an async generator."""
+    # run_coroutine_threadsafe needs a real coroutine, and agen.__anext__() is only an awaitable
+    return await agen.__anext__()
+
+_runner = BackgroundLoop()
+# The single, process-wide background loop
+# Because Python caches imported modules, it is shared by every Streamlit rerun and session
+
+atexit.register(_runner.stop)
+# Stop the loop cleanly when the process exits
+
+def get_runner() -> BackgroundLoop:
+    """Return the process-wide background loop runner.
+
+    Returns:
+        BackgroundLoop: The shared runner
+    """
+    return _runner
@@ -3,17 +3,60 @@ from abc import ABC, abstractmethod
 # ABC is used to create abstract classes that can't be instantiated directly
 # abstractmethod is a decorator that defines abstract methods that must be implemented by subclasses
 
-from typing import Any, List, Dict
+import os
+# Import the os module to read the context token budget from environment variables
+
+import asyncio
+# Import asyncio to find the event loop an agent is being used on
+
+import weakref
+# Import weakref so per-loop API clients are forgotten when their loop goes away
+
+from typing import AsyncIterator, List
 # Import typing hints to specify the expected types of variables and function parameters/returns
-# Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
 # List: A list of items of a specific type
-# Dict: A dictionary with keys and values of specific types
+
+from context_packer import ContextPacker, count_tokens
+# Import the packer that fits retrieved results into a token budget, and the token counter
+
+from http_pool import get_async_http_client
+# Import the helper that returns the shared keep-alive HTTP client for the current event loop
+
+from metrics import CONTEXT_TOKENS_SAVED
+# Import the counter of context tokens the packer saved
+
+from rate_limiter import RateLimiter, get_rate_limiter
+# Import the per-provider rate limiter every API call goes through
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
+from tracing import current_trace, provider_call, span
+# Import the helpers that find the current query's trace, time a stage of it and time each provider API call
+
+class StreamInterruptedError(RuntimeError):
+    """Raised by stream_answer when the provider fails after part of the answer has been sent."""
+    # Before any text is sent, a failed stream sends FALLBACK_ANSWER instead, like generate_answer
+    # After that, appending the message would look like the end of a real answer (and could be cached as one)
 
 class BaseAgent(ABC):
     """Base class for different LLM agents."""
     # This is an abstract base class that defines the common interface for all AI agents
     # LLM stands for Large Language Model (like GPT-4, Claude, etc.)
 
+    token_provider = "openai"
+    # Whose tokenizer to use when counting context tokens ("openai", "anthropic" or "deepseek")
+    # Child classes for other providers override this
+
+    max_output_tokens = 1000
+    # The most tokens an answer may use; child classes send it as max_tokens where the API takes one
+    # It is also what the rate limiter reserves for the answer before the call is sent
+
+    FALLBACK_ANSWER = "I couldn't generate an answer based on the retrieved information."
+    # The message every agent returns when the provider call fails
+    # Callers compare against it, for example to avoid caching a failed answer
+
     def __init__(self, api_key: str):
         """Initialize the agent with the provided API key."""
         # Constructor method that runs when a new agent is created
@@ -24,6 +67,12 @@ class BaseAgent(ABC):
         
         self._validate_api_key()
         # Call the validation method to ensure the API key is not empty
+        
+        self._clients = weakref.WeakKeyDictionary()
+        # The API clients this agent has created, one per event loop (see _get_client)
+        
+        self.context_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        # The most tokens the retrieved context may use in a prompt
 
     def _validate_api_key(self):
         """Validate that the API key is not empty."""
@@ -36,11 +85,58 @@ class BaseAgent(ABC):
             # If the API key is empty, raise a ValueError with an error message
             # This will stop the program and show the error message
 
-    def format_context(self, results: List[Dict[str, Any]]) -> str:
-        """Format the context string from retrieved results.
+    def _create_client(self, http_client):
+        """Create the provider's API client on top of a shared HTTP client.
+        
+        Child classes that talk to an API through an SDK override this.
         
         Args:
-            results (List[Dict[str, Any]]): A list of result dictionaries.
+            http_client (httpx.AsyncClient): The shared keep-alive HTTP client for the current loop
+
+        Returns:
+            The API client to use (the default is the HTTP client itself)
+        """
+        return http_client
+        # Agents that call the HTTP API directly can use the shared client as-is
+
+    def _get_client(self):
+        """Return this agent's API client for the running event loop, creating it on first use."""
+        # Async connections belong to the event loop that opened them,
+        # so we keep one client per loop, all built on that loop's shared connection pool
+        
+        loop = asyncio.get_running_loop()
+        # Get the event loop we're running on
+        
+        if loop not in self._clients:
+            # If we haven't made a client for this loop yet
+            self._clients[loop] = self._create_client(get_async_http_client())
+            # Create one on top of the loop's shared HTTP client
+        
+        return self._clients[loop]
+        # Return the client for this loop
+
+    def _provider_call(self):
+        """Time one provider API call and export it as a metric.
+        
+        Use it as "with self._provider_call() as call:" around the API call,
+        and call call.record_usage(prompt_tokens, completion_tokens) once the response arrives.
+        """
+        return provider_call(self.token_provider, getattr(self, "model_name", type(self).__name__))
+        # Label the call with the provider and the model
+
+    def _rate_limiter(self) -> RateLimiter:
+        """Return the shared rate limiter for this agent's provider (see rate_limiter.py)."""
+        return get_rate_limiter(self.token_provider)
+
+    def _estimate_tokens(self, prompt: str) -> int:
+        """Estimate the tokens a call will use: the prompt plus the longest possible answer."""
+        return count_tokens(prompt, self.token_provider, getattr(self, "model_name", "gpt-4")) + self.max_output_tokens
+
+    def format_context(self, results: List[RetrievedChunk]) -> str:
+        """Format the context string from retrieved results, within the agent's token budget.
+        
+        Args:
+            results (List[RetrievedChunk]): The retrieved results.
 
         Returns:
             str: Formatted context string.
@@ -48,50 +144,43 @@ class BaseAgent(ABC):
         # Method to format the search results into a string that can be used as context for the AI
         # Takes a list of dictionaries containing the search results
         # Returns a formatted string with all the relevant information
+        # The ContextPacker drops duplicate chunks and shortens or drops low-scoring results
+        # so the prompt stays within self.context_budget tokens (counted with this provider's tokenizer)
+        
+        packer = ContextPacker(
+            budget_tokens=self.context_budget,   # The most tokens the context may use
+            provider=self.token_provider,        # Count tokens the way this provider does
+            model_name=getattr(self, "model_name", "gpt-4")  # Pick the right encoding for OpenAI models
+        )
+        
+        with span("format_context"):
+            # Time the packing as its own stage of the query
+            context, stats = packer.pack(results)
+            # Build the context string in one pass and get statistics about what was trimmed
         
-        context = ""
-        # Initialize an empty string to store the formatted context
-        
-        for i, result in enumerate(results):
-            # Loop through each result in the results list
-            # enumerate gives us both the index (i) and the value (result)
-            
-            context += f"Document {i + 1}:\n"
-            # Add a header for each document with its number (starting from 1)
-            
-            if "title" in result:
-                # Check if the result has a title field
-                context += f"Title: {result.get('title', 'Untitled')}\n"
-                # Add the title to the context, or 'Untitled' if the title is None
-            
-            if "description" in result:
-                # Check if the result has a description field
-                context += f"Description: {result.get('description', '')}\n"
-                # Add the description to the context, or an empty string if the description is None
-            
-            if "text" in result:
-                # Check if the result has a text field
-                context += f"Content: {result.get('text', '')}\n"
-                # Add the content to the context, or an empty string if the text is None
-            
-            context += f"Relevance Score: {result.get('score', 0):.4f}\n\n"
-            # Add the relevance score to the context, formatted to 4 decimal places
-            # If there's no score, use 0 as the default
-            # Add two newlines to separate this result from the next one
+        CONTEXT_TOKENS_SAVED.inc(stats.tokens_saved, provider=self.token_provider)
+        # Export the tokens saved (the agent is shared by every session, so nothing per query is stored on it)
+        
+        trace = current_trace()
+        # The trace of the query being answered, if any
+        
+        if trace is not None:
+            trace.add(f"tokens_saved:{self.token_provider}", stats.tokens_saved)
+            # Show the tokens saved with the query, next to the tokens it used
         
         return context
         # Return the complete formatted context string
 
     @abstractmethod
     # This decorator marks the method as abstract, meaning it must be implemented by any subclass
-    async def generate_answer(self, query: str, results: List[Dict[str, Any]]) -> str:
+    async def generate_answer(self, query: str, results: List[RetrievedChunk]) -> str:
         """Abstract method for generating an answer.
         
         Each child class must implement this method.
         
         Args:
             query (str): The query for which to generate an answer.
-            results (List[Dict[str, Any]]): The results to base the answer on.
+            results (List[RetrievedChunk]): The results to base the answer on.
 
         Returns:
             str: The generated answer.
@@ -104,4 +193,55 @@ class BaseAgent(ABC):
         
         pass 
         # The pass statement is a placeholder that does nothing
-        # In an abstract method, the implementation is provided by the subclasses 
\ No newline at end of file
+        # In an abstract method, the implementation is provided by the subclasses
+
+    async def request_answer(self, query: str, results: List[RetrievedChunk]) -> str:
+        """Generate an answer, raising an exception instead of returning the fallback message.
+        
+        Child classes override this with their raw provider call. The default implementation
+        wraps generate_answer, so agents that only implement generate_answer still work.
+        
+        Args:
+            query (str): The query for which to generate an answer.
+            results (List[RetrievedChunk]): The results to base the answer on.
+
+        Returns:
+            str: The generated answer.
+
+        Raises:
+            RuntimeError: If the agent could not generate an answer.
+        """
+        # generate_answer hides failures behind FALLBACK_ANSWER, which is right for the UI
+        # Code that reacts to failures (retries, failover to another provider) needs to see them
+        
+        answer = await self.generate_answer(query, results)
+        # Generate the answer the normal way
+        
+        if answer == self.FALLBACK_ANSWER:
+            # The agent swallowed an error
+            raise RuntimeError(f"{type(self).__name__} could not generate an answer")
+        
+        return answer
+
+    async def stream_answer(self, query: str, results: List[RetrievedChunk]) -> AsyncIterator[str]:
+        """Generate an answer as a stream of text pieces.
+        
+        Child classes override this to yield tokens as the provider sends them.
+        The default implementation waits for generate_answer and yields the whole answer at once.
+        
+        Args:
+            query (str): The query for which to generate an answer.
+            results (List[RetrievedChunk]): The results to base the answer on.
+
+        Yields:
+            str: The next piece of the answer (just FALLBACK_ANSWER if the provider failed before sending any).
+
+        Raises:
+            StreamInterruptedError: If the provider failed after part of the answer was sent.
+        """
+        # This is an async generator: callers use "async for piece in agent.stream_answer(...)"
+        # Streaming lets the UI show the first words after a few hundred milliseconds
+        # instead of waiting for the whole answer to be generated
+        
+        yield await self.generate_answer(query, results)
+        # Fall back to a single piece containing the full answer
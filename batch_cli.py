@@ -0,0 +1,410 @@
+import argparse
+# Import argparse to parse the command-line options
+
+import asyncio
+# Import asyncio to run many questions at the same time
+
+import concurrent.futures
+# Import concurrent.futures to give the search threads a pool as large as the search concurrency
+
+import json
+# Import json to read questions and write answers as JSON lines
+
+import os
+# Import the os module to check whether an earlier output file exists
+
+import sys
+# Import sys to exit with an error code when some questions failed
+
+import time
+# Import time to measure how long each answer took
+
+from typing import Any, Dict, Iterable, List, Optional, Set
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# Iterable: Anything that can be looped over
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Set: A set of unique items
+
+from dotenv import load_dotenv
+# Import load_dotenv to read the same .env file as the app
+
+load_dotenv()
+# Load the settings before our own modules are imported, because their shared caches read them
+
+from base_agent import BaseAgent
+# Import the BaseAgent class, the interface every answering agent implements
+
+from query_pipeline import QueryPipeline
+# Import the pipeline app.py runs, so batch answers are produced exactly like interactive ones
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
+from tracing import Trace, span
+# Import the per-query stage timings, written out with every answer
+
+# Answers a file of questions without the Streamlit page, for nightly evaluation runs
+#
+# Questions are read from a .jsonl file ({"id": ..., "question": ...} per line) or a text file (one question per line).
+# Query embeddings are requested in batches, searches and answers run concurrently with a limit per provider,
+# and every finished question is appended to the output file straight away.
+# Running the same command again resumes: questions already in the output file are skipped, failed ones
+# (including answers that are only a provider's fallback message) are tried again.
+#
+# Example:
+#   python batch_cli.py questions.jsonl --output answers.jsonl --providers gpt-4,claude --concurrency gpt-4=4,claude=8
+
+def read_questions(path: str) -> List[Dict[str, str]]:
+    """Read the questions to answer.
+
+    Args:
+        path (str): A .jsonl file with a "question" (or "query") and an optional "id" per line,
+            or a text file with one question per line
+
+    Returns:
+        List[Dict[str, str]]: One {"id", "question"} dictionary per question (the id defaults to the line number)
+    """
+    questions = []
+    # The questions, in file order
+
+    with open(path, encoding="utf-8") as f:
+        # Read the file line by line
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+
+            if not line:
+                # Skip blank lines
+                continue
+
+            if path.endswith(".jsonl"):
+                # One JSON object per line
+                record = json.loads(line)
+                question = record.get("question") or record.get("query")
+
+                if not question:
+                    raise ValueError(f"{path}:{line_number} has no 'question' field")
+
+                questions.append({"id": str(record.get("id", line_number)), "question": question})
+            else:
+                # One plain question per line
+                questions.append({"id": str(line_number), "question": line})
+
+    return questions
+
+def is_failed(record: Dict[str, Any]) -> bool:
+    """Whether a result needs another run: its question failed, or a provider answered with its fallback."""
+    return "error" in record or any(not answer.get("ok", True) for answer in record.get("answers", {}).values())
+
+def read_finished_ids(path: str) -> Set[str]:
+    """Return the ids of questions already answered in an output file (for resuming).
+
+    Args:
+        path (str): The output file of an earlier run (it may not exist)
+
+    Returns:
+        Set[str]: The ids of questions every provider answered (failed ones are tried again)
+    """
+    finished = set()
+    # The ids found so far
+
+    if not os.path.exists(path):
+        # Nothing has been written yet
+        return finished
+
+    with open(path, encoding="utf-8") as f:
+        # Read the earlier results line by line
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off when the last run was stopped; that question is answered again
+                continue
+
+            if not is_failed(record):
+                finished.add(str(record["id"]))
+
+    return finished
+
+def parse_limits(text: Optional[str], providers: Iterable[str], default: int) -> Dict[str, int]:
+    """Parse per-provider concurrency limits like "gpt-4=4,claude=8".
+
+    Args:
+        text (str, optional): The limits; a bare number applies to every provider
+        providers (Iterable[str]): The providers in use
+        default (int): The limit for providers that aren't mentioned
+
+    Returns:
+        Dict[str, int]: The limit for every provider
+    """
+    limits = {provider: default for provider in providers}
+    # Start every provider at the default
+
+    for part in (text or "").split(","):
+        # Apply each "provider=limit" (or bare limit)
+        part = part.strip()
+
+        if not part:
+            continue
+
+        if "=" in part:
+            provider, value = part.split("=", 1)
+            limits[provider.strip()] = int(value)
+        else:
+            limits = {provider: int(part) for provider in limits}
+
+    return limits
+
+def embed_queries(embeddings: Any, texts: List[str]) -> List[List[float]]:
+    """Embed several questions in one call (through the embedding cache when there is one)."""
+    if hasattr(embeddings, "embed_queries"):
+        # CachedEmbeddings only sends the questions it hasn't seen before
+        return embeddings.embed_queries(texts)
+
+    return embeddings.embed_documents(texts)
+    # Any other Embeddings object can embed a list of texts at once
+
+class BatchRunner:
+    """Answers many questions through the query pipeline and appends each result to a JSONL file."""
+
+    def __init__(self, pipeline: QueryPipeline, agents: Dict[str, BaseAgent], output_path: str,
+                 provider_limits: Dict[str, int], search_concurrency: int = 8, embed_batch_size: int = 64,
+                 max_in_flight: int = 256):
+        """Initialize the runner.
+
+        Args:
+            pipeline (QueryPipeline): The pipeline to answer with
+            agents (Dict[str, BaseAgent]): Every provider answers every question
+            output_path (str): The JSONL file results are appended to
+            provider_limits (Dict[str, int]): Answers generated at the same time, per provider
+            search_concurrency (int, optional): Searches run at the same time. Defaults to 8.
+            embed_batch_size (int, optional): Questions embedded per API call. Defaults to 64.
+            max_in_flight (int, optional): Questions started but not yet written, which bounds memory. Defaults to 256.
+        """
+        self.pipeline = pipeline
+        # Store the pipeline
+
+        self.agents = agents
+        # Store the agents
+
+        self.output_path = output_path
+        # Store the output file
+
+        self.provider_limits = provider_limits
+        # Store the per-provider limits (the semaphores are created inside the event loop)
+
+        self.search_concurrency = search_concurrency
+        # Store the search limit
+
+        self.embed_batch_size = embed_batch_size
+        # Store the embedding batch size
+
+        self.max_in_flight = max(max_in_flight, embed_batch_size)
+        # Store the in-flight limit (at least one full embedding batch)
+
+        self.answered = 0
+        # Questions every provider answered
+
+        self.failed = 0
+        # Questions written with an error or with a provider's fallback answer
+
+    def _write(self, output, record: Dict[str, Any]):
+        """Append one result and flush it, so a stopped run loses nothing that finished."""
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+
+        if is_failed(record):
+            self.failed += 1
+        else:
+            self.answered += 1
+
+        done = self.answered + self.failed
+
+        if done % 50 == 0:
+            # Show progress now and then
+            print(f"DEBUG - {done} questions done ({self.failed} failed)")
+
+    async def _generate(self, provider: str, agent: BaseAgent, question: str, results: List[RetrievedChunk],
+                        trace: Trace) -> Dict[str, Any]:
+        """Answer one question with one provider, within that provider's concurrency limit."""
+        async with self._provider_semaphores[provider]:
+            # Wait for a free slot with this provider
+            start = time.perf_counter()
+            answer = await self.pipeline.generate(agent, question, results, trace)
+            # The agent returns its fallback message instead of raising on an API error
+
+        return {
+            "model": agent.model_name,                     # The model that answered
+            "answer": answer,                              # The answer
+            "ok": answer != agent.FALLBACK_ANSWER,         # False when the provider call failed
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+
+    async def _answer(self, output, item: Dict[str, str], query_vector: List[float], trace: Trace):
+        """Search for one question, answer it with every provider and write the result."""
+        try:
+            async with self._search_semaphore:
+                # Wait for a free search slot
+                retrieval = await asyncio.to_thread(self.pipeline.retrieve, item["question"], trace, query_vector)
+                # Retrieval is synchronous (as in app.py), so run it on a worker thread
+
+            answers = {}
+            # The answer from each provider
+
+            if retrieval.results:
+                # Ask every provider at the same time
+                generated = await asyncio.gather(*(
+                    self._generate(provider, agent, item["question"], retrieval.results, trace)
+                    for provider, agent in self.agents.items()
+                ))
+                answers = dict(zip(self.agents, generated))
+
+            self._write(output, {
+                "id": item["id"],
+                "question": item["question"],
+                "answers": answers,                       # Empty when nothing relevant was found
+                "sources": [{"title": result.title, "score": result.score} for result in retrieval.results],
+                "timings_ms": {stage: round(seconds * 1000, 1) for stage, seconds in trace.durations().items()},
+                "tokens": trace.counts
+            })
+        except Exception as e:
+            # Record the failure and carry on with the other questions; a resumed run tries it again
+            self._write(output, {"id": item["id"], "question": item["question"], "error": str(e)})
+        finally:
+            self._in_flight.release()
+            # Let the next question start
+
+    async def run(self, questions: List[Dict[str, str]]):
+        """Answer every question, appending results to the output file as they finish.
+
+        Args:
+            questions (List[Dict[str, str]]): {"id", "question"} dictionaries (see read_questions)
+        """
+        self._provider_semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in self.provider_limits.items()}
+        # One limit per provider, so a slow provider can't use up the others' slots
+
+        self._search_semaphore = asyncio.Semaphore(self.search_concurrency)
+        # The search limit
+
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        # The in-flight limit
+
+        asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=self.search_concurrency + 1))
+        # Threads for the searches, plus one for the embedding calls
+
+        tasks = []
+        # One task per question
+
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            # Append, so a resumed run keeps the earlier results
+            for start in range(0, len(questions), self.embed_batch_size):
+                # Embed the questions a batch at a time, while earlier batches are searched and answered
+                batch = questions[start:start + self.embed_batch_size]
+
+                for _ in batch:
+                    # Wait until there is room for the whole batch
+                    await self._in_flight.acquire()
+
+                traces = [Trace() for _ in batch]
+                # One trace per question
+
+                try:
+                    with span("embed", traces[0]):
+                        # Time the batched call (recorded below for every question in the batch)
+                        vectors = await asyncio.to_thread(
+                            embed_queries, self.pipeline.backend.embeddings, [item["question"] for item in batch])
+                except Exception as e:
+                    # The whole batch failed to embed
+                    for item in batch:
+                        self._write(output, {"id": item["id"], "question": item["question"], "error": str(e)})
+                        self._in_flight.release()
+                    continue
+
+                for trace in traces[1:]:
+                    # Every question in the batch waited for the same call
+                    trace.record("embed", traces[0].durations()["embed"])
+
+                for item, vector, trace in zip(batch, vectors, traces):
+                    # Search for and answer each question in the background
+                    tasks.append(asyncio.create_task(self._answer(output, item, vector, trace)))
+
+            await asyncio.gather(*tasks)
+            # Wait for the last questions to finish
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the batch from the command line and return the exit code."""
+    parser = argparse.ArgumentParser(description="Answer a file of questions and write the answers as JSON lines.")
+    parser.add_argument("questions", help="A .jsonl file ({\"id\", \"question\"} per line) or a text file (one question per line)")
+    parser.add_argument("--output", required=True, help="The JSONL file to append answers to (existing answers are skipped)")
+    parser.add_argument("--providers", default="gpt-4", help="Comma-separated agent types to answer with (default: gpt-4)")
+    parser.add_argument("--concurrency", help="Answers at the same time per provider, e.g. gpt-4=4,claude=8 (default: 4 each)")
+    parser.add_argument("--search-concurrency", type=int, default=8, help="Searches at the same time (default: 8)")
+    parser.add_argument("--embed-batch", type=int, default=64, help="Questions per embedding request (default: 64)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Questions started but not yet written (default: 256)")
+    parser.add_argument("--limit", type=int, help="Only answer the first N unanswered questions")
+    parser.add_argument("--stub", action="store_true", help="Use the benchmark's stub providers (no API keys or network)")
+    args = parser.parse_args(argv)
+
+    providers = [provider.strip() for provider in args.providers.split(",") if provider.strip()]
+    # The agent types to answer with
+
+    if args.stub:
+        # Offline dry run against the stand-ins used by benchmark.py
+        from stub_providers import StubEmbeddings, StubVectorBackend, create_stub_agents
+
+        backend = StubVectorBackend(StubEmbeddings())
+        agents = {provider: agent for provider, agent in create_stub_agents({}).items() if provider in providers}
+    else:
+        # The backend and pooled agents the app and the HTTP API use, configured from .env
+        from rag_service import RAGService, load_api_keys, open_backend
+        # Imported here so --stub runs don't need the Pinecone and provider packages
+
+        backend = open_backend()
+        service = RAGService(QueryPipeline(backend), load_api_keys())
+        agents = {provider: service.get_agent(provider) for provider in providers}
+        # Raises ValueError for an unknown provider or a missing API key
+
+    questions = read_questions(args.questions)
+    # Every question in the file
+
+    finished = read_finished_ids(args.output)
+    # The questions an earlier run already answered
+
+    seen = set(finished)
+    todo = []
+    # The questions still to answer (duplicate ids are answered once)
+
+    for item in questions:
+        if item["id"] not in seen:
+            seen.add(item["id"])
+            todo.append(item)
+
+    if args.limit is not None:
+        todo = todo[:args.limit]
+
+    print(f"DEBUG - {len(questions)} questions, {len(finished)} already answered, {len(todo)} to go")
+
+    runner = BatchRunner(
+        QueryPipeline(backend, cache=None),          # Every question is different, so the retrieval cache would only use memory
+        agents,
+        args.output,
+        parse_limits(args.concurrency, agents, 4),
+        search_concurrency=args.search_concurrency,
+        embed_batch_size=args.embed_batch,
+        max_in_flight=args.max_in_flight
+    )
+
+    start = time.perf_counter()
+    asyncio.run(runner.run(todo))
+
+    print(f"Answered {runner.answered} questions ({runner.failed} failed) in {time.perf_counter() - start:.1f}s; "
+          f"results are in {args.output}")
+
+    return 1 if runner.failed else 0
+    # A non-zero exit code tells a nightly job that some questions need another run
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import argparse
+# Import argparse to parse the command-line options
+
+import asyncio
+# Import asyncio to run many queries at the same time
+
+import concurrent.futures
+# Import concurrent.futures to give the retrieval threads a pool as large as the concurrency
+
+import json
+# Import json to save and compare results
+
+import sys
+# Import sys to exit with an error code when a regression is found
+
+import time
+# Import time to measure throughput
+
+from typing import Any, Dict, List, Optional
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+
+from base_agent import StreamInterruptedError
+# Import the error an agent raises when its stream fails partway
+
+from query_pipeline import QueryPipeline
+# Import the pipeline app.py runs, so the benchmark measures the real hot path
+
+from stub_providers import Latency, StubEmbeddings, StubVectorBackend, create_stub_agents
+# Import the local stand-ins for the embedding, search and LLM providers
+
+from tracing import Trace
+# Import the per-query stage timings
+
+# Runs the app's query pipeline (embed -> search -> format_context -> generate) against stub providers
+# and reports per-stage p50/p95/p99 latency and throughput at several concurrency levels.
+#
+# Example:
+#   python benchmark.py --queries 200 --concurrency 1,8,32 --embed-ms 40 --search-ms 60 --llm-ms 800
+#   python benchmark.py --output baseline.json                 # save a baseline
+#   python benchmark.py --baseline baseline.json               # fail if any stage's p95 regressed
+
+STAGES = ["embed", "search", "fusion", "rerank", "format_context", "generate", "first_token", "total"]
+# Stages in pipeline order; "generate" includes format_context, and "total" is the whole query
+
+def percentile(values: List[float], p: float) -> float:
+    """Return the p-th percentile of some values (nearest rank).
+
+    Args:
+        values (List[float]): The values
+        p (float): The percentile, between 0 and 100
+
+    Returns:
+        float: The percentile (0.0 when there are no values)
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    # Sort the values
+
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    # The value at the percentile's position
+
+def make_questions(count: int) -> List[str]:
+    """Generate repeatable benchmark questions."""
+    topics = ["error", "config", "index", "vector", "agent", "token", "cache", "query", "model", "latency"]
+    # Words from the stub corpus, so keyword scoring has something to match
+
+    return [f"How do I fix {topics[i % len(topics)]} {topics[(i * 7) % len(topics)]} problem ERR_{i}?" for i in range(count)]
+
+async def run_level(pipeline: QueryPipeline, agents: Dict[str, Any], questions: List[str],
+                    concurrency: int, stream: bool) -> Dict[str, Any]:
+    """Run every question with a given number in flight at once.
+
+    Args:
+        pipeline (QueryPipeline): The pipeline to benchmark
+        agents (Dict[str, Any]): The agents to cycle through
+        questions (List[str]): The questions
+        concurrency (int): How many queries run at the same time
+        stream (bool): Whether to stream answers (records first_token) instead of waiting for the full answer
+
+    Returns:
+        Dict[str, Any]: Per-stage percentiles in milliseconds and the throughput
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # Limits how many queries are in flight
+
+    agent_list = list(agents.values())
+    # The agents, used in turn
+
+    traces: List[Trace] = []
+    # One trace per finished query
+
+    async def one(number: int, question: str):
+        """Run one query through the pipeline."""
+        async with semaphore:
+            # Wait for a free slot
+            trace = Trace()
+            start = time.perf_counter()
+
+            retrieval = await asyncio.to_thread(pipeline.retrieve, question, trace)
+            # Retrieval is synchronous (as in app.py), so run it on a worker thread
+
+            agent = agent_list[number % len(agent_list)]
+            # Spread the queries over the providers
+
+            if stream:
+                try:
+                    async for _ in pipeline.stream(agent, question, retrieval.results, trace):
+                        pass
+                except StreamInterruptedError as e:
+                    # A provider failed partway; keep the timings measured so far, like a failed generate does
+                    print(f"DEBUG - {e}")
+            else:
+                await pipeline.generate(agent, question, retrieval.results, trace)
+
+            trace.record("total", time.perf_counter() - start)
+            traces.append(trace)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(number, question) for number, question in enumerate(questions)))
+    elapsed = time.perf_counter() - start
+    # Run everything and time the whole level
+
+    stages: Dict[str, Dict[str, float]] = {}
+    # Percentiles per stage
+
+    for stage in STAGES:
+        values = [trace.durations()[stage] * 1000 for trace in traces if stage in trace.durations()]
+        # This stage's duration in every query, in milliseconds
+
+        if values:
+            stages[stage] = {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)}
+
+    return {"concurrency": concurrency, "queries": len(traces), "seconds": elapsed,
+            "throughput": len(traces) / elapsed if elapsed else 0.0, "stages": stages}
+
+def print_level(level: Dict[str, Any]):
+    """Print one concurrency level as a table."""
+    print(f"\nConcurrency {level['concurrency']}: {level['queries']} queries in {level['seconds']:.2f}s "
+          f"({level['throughput']:.1f} queries/s)")
+    print(f"  {'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    for stage, values in level["stages"].items():
+        print(f"  {stage:<16}{values['p50']:>10.1f}{values['p95']:>10.1f}{values['p99']:>10.1f}")
+
+def find_regressions(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float,
+                     min_ms: float = 1.0) -> List[str]:
+    """Compare p95 latencies and throughput with a saved baseline.
+
+    Args:
+        results (List[Dict[str, Any]]): This run's levels
+        baseline (List[Dict[str, Any]]): The baseline's levels
+        tolerance (float): Allowed slowdown as a share (0.2 = 20% slower)
+        min_ms (float, optional): Differences below this many milliseconds are ignored as noise. Defaults to 1.0.
+
+    Returns:
+        List[str]: A description of every regression
+    """
+    previous = {level["concurrency"]: level for level in baseline}
+    # Baseline levels by concurrency
+
+    regressions = []
+    # What got worse
+
+    for level in results:
+        # Compare each level that is in both runs
+        old = previous.get(level["concurrency"])
+
+        if old is None:
+            continue
+
+        for stage, values in level["stages"].items():
+            # Compare each stage's p95
+            old_p95 = old["stages"].get(stage, {}).get("p95")
+
+            if old_p95 is not None and values["p95"] > old_p95 * (1 + tolerance) and values["p95"] - old_p95 > min_ms:
+                regressions.append(f"concurrency {level['concurrency']}: {stage} p95 {old_p95:.1f}ms -> {values['p95']:.1f}ms")
+
+        if level["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(f"concurrency {level['concurrency']}: throughput "
+                               f"{old['throughput']:.1f} -> {level['throughput']:.1f} queries/s")
+
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmark from the command line and return the exit code."""
+    parser = argparse.ArgumentParser(description="Benchmark the query pipeline against stub providers.")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per concurrency level (default: 200)")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels (default: 1,8,32)")
+    parser.add_argument("--embed-ms", type=float, default=40, help="Injected embedding latency (default: 40)")
+    parser.add_argument("--search-ms", type=float, default=60, help="Injected search latency (default: 60)")
+    parser.add_argument("--llm-ms", type=float, default=800, help="Injected time to first token for every provider (default: 800)")
+    parser.add_argument("--openai-ms", type=float, help="Time to first token for GPT-4 (default: --llm-ms)")
+    parser.add_argument("--anthropic-ms", type=float, help="Time to first token for Claude (default: --llm-ms)")
+    parser.add_argument("--deepseek-ms", type=float, help="Time to first token for Deepseek (default: --llm-ms)")
+    parser.add_argument("--token-ms", type=float, default=0, help="Injected delay between answer tokens (default: 0)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency spread, 0 for fixed delays (default: 0.2)")
+    parser.add_argument("--docs", type=int, default=1000, help="Documents in the stub corpus (default: 1000)")
+    parser.add_argument("--provider", choices=["gpt-4", "claude", "deepseek", "all"], default="all",
+                        help="Which stub provider answers (default: all, in turn)")
+    parser.add_argument("--stream", action="store_true", help="Stream answers (also reports first_token)")
+    parser.add_argument("--use-caches", action="store_true", help="Keep the retrieval cache and call coalescing on (off by default, to measure the full path)")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with a saved JSON file and exit with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    embeddings = StubEmbeddings(latency=Latency(args.embed_ms, args.jitter, seed=1))
+    # The OpenAI embeddings stand-in
+
+    backend = StubVectorBackend(embeddings, num_docs=args.docs, latency=Latency(args.search_ms, args.jitter, seed=2))
+    # The Pinecone stand-in
+
+    pipeline = QueryPipeline(backend, **({} if args.use_caches else {"cache": None, "flights": None}))
+    # The real pipeline, with the reranker and keyword search configured as in the app
+
+    agents = create_stub_agents({
+        "gpt-4": args.openai_ms if args.openai_ms is not None else args.llm_ms,
+        "claude": args.anthropic_ms if args.anthropic_ms is not None else args.llm_ms,
+        "deepseek": args.deepseek_ms if args.deepseek_ms is not None else args.llm_ms
+    }, jitter=args.jitter, token_ms=args.token_ms)
+    # The LLM stand-ins
+
+    if args.provider != "all":
+        # Only benchmark one provider
+        agents = {args.provider: agents[args.provider]}
+
+    questions = make_questions(args.queries)
+    # The questions to ask
+
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    # The concurrency levels to try
+
+    results = []
+    # One result per level
+
+    for concurrency in levels:
+        # Run each level on a fresh loop with a thread pool big enough for its retrievals
+        async def run():
+            asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=concurrency))
+            return await run_level(pipeline, agents, questions, concurrency, args.stream)
+
+        level = asyncio.run(run())
+        print_level(level)
+        results.append(level)
+
+    if args.output:
+        # Save the results, for example as the next baseline
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        # Compare with the baseline
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+
+        if regressions:
+            print("\nRegressions against the baseline:")
+
+            for regression in regressions:
+                print(f"  {regression}")
+
+            return 1
+
+        print("\nNo regressions against the baseline.")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+import os
+# Import the os module to read the index location from environment variables and build file paths
+
+import argparse
+# Import argparse to parse the command-line options of the index builder
+
+import concurrent.futures
+# Import concurrent.futures to run the keyword search while the vector search is in flight
+
+import hashlib
+# Import hashlib to match the same document across the keyword and vector results
+
+import json
+# Import json to read and write the vocabulary and the index settings
+
+import math
+# Import math for the BM25 idf logarithm
+
+import threading
+# Import threading so the index is only loaded once, however many sessions ask for it
+
+from collections import Counter, defaultdict
+# Import Counter to count words per document, and defaultdict to collect postings while building
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# Iterable: Anything that can be looped over
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+import numpy as np
+# Import numpy to store the postings as compact arrays and score them in one step
+
+from langchain_core.documents import Document
+# Import Document, the same result type the vector store returns, so keyword results fit in everywhere
+
+from document_store import DocumentStore, DocumentStoreWriter, read_jsonl_records, read_pinecone_records
+# Import the document sidecar shared by the local indexes, and the readers for the builder's document sources
+
+from reranker import tokenize
+# Import the tokenizer shared with the lexical reranker, so both agree on what a "word" is
+
+# Files that make up an index directory:
+#   meta.json          - number of documents, average length and the BM25 parameters
+#   vocab.json         - word -> row number in offsets.npy
+#   offsets.npy        - where each word's postings start and end (int64, one more than the vocabulary size)
+#   postings_docs.npy  - the document numbers of every posting (uint32)
+#   postings_tf.npy    - how often the word appears in that document (uint16)
+#   doc_lengths.npy    - the length of each document in words (uint32)
+#   docs.jsonl         - the documents themselves (see document_store.py)
+#   docs_offsets.npy   - where each document starts in docs.jsonl
+# The .npy arrays are memory-mapped, so loading is instant and the operating system shares the pages
+# between every Streamlit session (and every process) that uses the index.
+
+def doc_key(doc: Document) -> str:
+    """Return a stable id for a document, based on its text.
+
+    The vector store doesn't return Pinecone ids with its results, so the text is the one thing
+    a vector result and a keyword result for the same chunk are guaranteed to share.
+
+    Args:
+        doc (Document): The document
+
+    Returns:
+        str: The id
+    """
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+class BM25Index:
+    """A read-only, memory-mapped BM25 inverted index."""
+    # Build one with build_index() (or the command line below) and open it with BM25Index(directory)
+
+    def __init__(self, directory: str):
+        """Open an index directory.
+
+        Args:
+            directory (str): The directory written by build_index()
+        """
+        self.directory = directory
+        # Store the directory
+
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            # Read the index settings
+            meta = json.load(f)
+
+        self.num_docs: int = meta["num_docs"]
+        # How many documents are indexed
+
+        self.average_length: float = meta["average_length"] or 1.0
+        # The average document length in words
+
+        self.k1: float = meta.get("k1", 1.2)
+        # How quickly repeated words stop adding to the score
+
+        self.b: float = meta.get("b", 0.75)
+        # How much long documents are penalized
+
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            # Read the vocabulary (the only part kept fully in memory)
+            self.vocab: Dict[str, int] = json.load(f)
+
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        # Where each word's postings start and end
+
+        self.postings_docs = np.load(os.path.join(directory, "postings_docs.npy"), mmap_mode="r")
+        # The documents each word appears in
+
+        self.postings_tf = np.load(os.path.join(directory, "postings_tf.npy"), mmap_mode="r")
+        # How often the word appears in each of those documents
+
+        self.doc_lengths = np.load(os.path.join(directory, "doc_lengths.npy"), mmap_mode="r")
+        # The length of every document
+
+        self.documents = DocumentStore(directory)
+        # The document text and metadata, read on demand
+
+    def search(self, query: str, k: int = 50) -> List[Tuple[Document, float]]:
+        """Return the k documents that best match the query's words.
+
+        Args:
+            query (str): The user's question
+            k (int, optional): How many results to return. Defaults to 50.
+
+        Returns:
+            List[Tuple[Document, float]]: (document, BM25 score) pairs, best first
+        """
+        rows = [self.vocab[term] for term in set(tokenize(query)) if term in self.vocab]
+        # The vocabulary rows of the query words we know about
+
+        if not rows:
+            # None of the query's words appear in the index
+            return []
+
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        # One score per document
+
+        for row in rows:
+            # Add each query word's contribution to the documents that contain it
+            start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+            # This word's slice of the postings
+
+            docs = self.postings_docs[start:end]
+            # The documents that contain the word
+
+            tf = self.postings_tf[start:end].astype(np.float32)
+            # How often it appears in each
+
+            idf = math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            # Rare words count for more than common ones
+
+            lengths = self.doc_lengths[docs].astype(np.float32)
+            # The lengths of those documents
+
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths / self.average_length))
+            # The BM25 formula, for every matching document at once (a word appears once per document in the postings)
+
+        matched = int(np.count_nonzero(scores))
+        # Only documents containing at least one query word are results
+
+        k = min(k, matched)
+        # We can't return more than that
+
+        if k == 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        # The k best documents, in no particular order (faster than sorting everything)
+
+        top = top[np.argsort(-scores[top])]
+        # Sort just those k, best first
+
+        return [(self.documents.get_document(int(number)), float(scores[number])) for number in top]
+        # Read the documents from the sidecar
+
+def build_index(records: Iterable[Dict[str, Any]], directory: str, k1: float = 1.2, b: float = 0.75) -> int:
+    """Build an index directory from documents.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): Documents as {"id": ..., "text": ..., "metadata": {...}}
+        directory (str): Where to write the index
+        k1 (float, optional): BM25 term frequency saturation. Defaults to 1.2.
+        b (float, optional): BM25 length normalization. Defaults to 0.75.
+
+    Returns:
+        int: The number of documents indexed
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Create the directory if it doesn't exist
+
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        # Remove the old settings first, so a half-rebuilt index can't be opened
+        os.remove(os.path.join(directory, "meta.json"))
+
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    # word -> [(document number, count), ...]
+
+    doc_lengths: List[int] = []
+    # The length of each document
+
+    documents = DocumentStoreWriter(directory)
+    # Write the sidecar as we go, so the text never has to be held in memory
+
+    for number, record in enumerate(records):
+        # Loop through the documents
+        counts = Counter(tokenize(record.get("text", "")))
+        # Count the words in this document
+
+        for term, count in counts.items():
+            # Add a posting for every distinct word
+            postings[term].append((number, min(count, np.iinfo(np.uint16).max)))
+
+        doc_lengths.append(sum(counts.values()))
+        # Remember the document length
+
+        documents.write(record.get("id"), record.get("text", ""), record.get("metadata"))
+        # Write the document to the sidecar
+
+    documents.close()
+    # Finish the sidecar (this also saves its line offsets)
+
+    if not doc_lengths:
+        # An empty index can't be memory-mapped, and would never match anything anyway
+        raise ValueError("No documents to index")
+
+    vocab: Dict[str, int] = {}
+    # word -> row number
+
+    offsets = [0]
+    # Where each word's postings start (plus the end of the last one)
+
+    postings_docs: List[int] = []
+    postings_tf: List[int] = []
+    # The flattened postings
+
+    for row, term in enumerate(sorted(postings)):
+        # Lay the postings out one word after another
+        vocab[term] = row
+
+        for number, count in postings[term]:
+            postings_docs.append(number)
+            postings_tf.append(count)
+
+        offsets.append(len(postings_docs))
+
+    np.save(os.path.join(directory, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(directory, "postings_docs.npy"), np.asarray(postings_docs, dtype=np.uint32))
+    np.save(os.path.join(directory, "postings_tf.npy"), np.asarray(postings_tf, dtype=np.uint16))
+    np.save(os.path.join(directory, "doc_lengths.npy"), np.asarray(doc_lengths, dtype=np.uint32))
+    # Save the arrays in .npy format so they can be memory-mapped
+
+    with open(os.path.join(directory, "vocab.json"), "w", encoding="utf-8") as f:
+        # Save the vocabulary
+        json.dump(vocab, f, ensure_ascii=False)
+
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        # Save the settings last, so a half-written index can't be opened
+        json.dump({
+            "num_docs": len(doc_lengths),
+            "average_length": sum(doc_lengths) / len(doc_lengths),
+            "k1": k1,
+            "b": b
+        }, f)
+
+    return len(doc_lengths)
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Tuple[Document, float]]], top_k: Optional[int] = None,
+                           k: int = 60) -> List[Tuple[Document, float]]:
+    """Merge several ranked result lists with reciprocal rank fusion.
+
+    Each document scores 1 / (k + rank) in every list it appears in, and the scores are added up.
+    Only ranks are used, so dense similarities and BM25 scores never have to be put on the same scale.
+
+    Args:
+        result_lists (Sequence[List[Tuple[Document, float]]]): Ranked (document, score) lists, best first
+        top_k (int, optional): How many fused results to return. Defaults to all of them.
+        k (int, optional): Damping constant; larger values flatten the rank differences. Defaults to 60.
+
+    Returns:
+        List[Tuple[Document, float]]: (document, fused score) pairs, best first
+    """
+    fused: Dict[str, float] = {}
+    # Fused score per document id
+
+    documents: Dict[str, Document] = {}
+    # The first copy seen of each document
+
+    for results in result_lists:
+        # Loop through each ranked list
+        for rank, (doc, _) in enumerate(results, start=1):
+            # Loop through its results, best first
+            key = doc_key(doc)
+            # Identify the document
+
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            # Add this list's contribution
+
+            documents.setdefault(key, doc)
+            # Keep the first copy (from the earlier list, which is the vector search)
+
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    # Best fused score first
+
+    if top_k is not None:
+        # Keep only the best top_k
+        ranked = ranked[:top_k]
+
+    return [(documents[key], score) for key, score in ranked]
+
+_index: Optional[BM25Index] = None
+# The loaded index, shared by every session
+
+_index_lock = threading.Lock()
+# A lock so only one session loads the index
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
+# Threads that run keyword searches next to the vector search
+
+def get_bm25_index() -> Optional[BM25Index]:
+    """Return the process-wide keyword index, or None if BM25_INDEX_DIR isn't set or has no index.
+
+    Returns:
+        Optional[BM25Index]: The index
+    """
+    global _index
+
+    directory = os.getenv("BM25_INDEX_DIR", "")
+    # Where the index lives (empty turns hybrid search off)
+
+    if not directory or not os.path.exists(os.path.join(directory, "meta.json")):
+        # No index configured or built
+        return None
+
+    with _index_lock:
+        # Only one thread at a time may load the index
+        if _index is None or _index.directory != directory:
+            _index = BM25Index(directory)
+            # Open (memory-map) the index
+            print(f"DEBUG - Loaded BM25 index with {_index.num_docs} documents from {directory}")
+
+        return _index
+
+def search_in_background(query: str, k: int) -> Optional[concurrent.futures.Future]:
+    """Start a keyword search on a background thread.
+
+    Args:
+        query (str): The user's question
+        k (int): How many results to return
+
+    Returns:
+        Optional[concurrent.futures.Future]: A future for the results, or None if there is no keyword index
+    """
+    index = get_bm25_index()
+    # Get the shared index
+
+    if index is None:
+        # Hybrid search is turned off
+        return None
+
+    return _executor.submit(index.search, query, k)
+    # Run the search without waiting for it
+
+def main():
+    """Build a BM25 index from a JSONL file or from the documents stored in Pinecone."""
+    from dotenv import load_dotenv
+    # Import load_dotenv to read the Pinecone settings from the .env file
+
+    load_dotenv()
+    # Load the environment variables
+
+    parser = argparse.ArgumentParser(description="Build the local BM25 keyword index used for hybrid search.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--jsonl", help="Build from a JSONL file with one {\"id\", \"text\", ...} document per line")
+    source.add_argument("--pinecone-index", default=os.getenv("PINECONE_INDEX_NAME", "pydanticai"),
+                        help="Build from the documents in this Pinecone index (default: PINECONE_INDEX_NAME)")
+    parser.add_argument("--namespace", default="", help="Pinecone namespace to read (default: the default namespace)")
+    parser.add_argument("--out", default=os.getenv("BM25_INDEX_DIR") or ".cache/bm25",
+                        help="Where to write the index (default: BM25_INDEX_DIR or .cache/bm25)")
+    args = parser.parse_args()
+
+    records = read_jsonl_records(args.jsonl) if args.jsonl else read_pinecone_records(args.pinecone_index, args.namespace)
+    # Pick the document source
+
+    count = build_index(records, args.out)
+    # Build the index
+
+    print(f"Indexed {count} documents into {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import os
+# Import the os module to read the default token budget from environment variables
+
+import re
+# Import re (regular expressions) to split text into words for duplicate detection
+
+from typing import Any, Dict, List, Optional, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
+try:
+    import tiktoken
+    # tiktoken is OpenAI's tokenizer; it gives exact token counts for GPT models
+except ImportError:
+    # tiktoken is optional; without it we estimate tokens from the number of characters
+    tiktoken = None
+
+CHARS_PER_TOKEN = {
+    "openai": 4.0,
+    # GPT models average about 4 characters of English text per token
+    "deepseek": 3.8,
+    # Deepseek's tokenizer is slightly finer-grained
+    "anthropic": 3.5
+    # Claude's tokenizer produces a few more tokens for the same text
+}
+# Characters per token used when no exact tokenizer is available
+
+_encoders: Dict[str, Any] = {}
+# tiktoken encoders we've already loaded, keyed by model name (loading one takes a moment)
+
+def _get_encoder(model_name: str):
+    """Return a tiktoken encoder for a model, or None if tiktoken isn't installed."""
+    if tiktoken is None:
+        # No exact tokenizer available
+        return None
+
+    if model_name not in _encoders:
+        # Load the encoder the first time we see this model
+        try:
+            _encoders[model_name] = tiktoken.encoding_for_model(model_name)
+            # Use the model's own encoding when tiktoken knows the model
+        except KeyError:
+            _encoders[model_name] = tiktoken.get_encoding("cl100k_base")
+            # Otherwise use the GPT-4 encoding as a close approximation
+
+    return _encoders[model_name]
+
+def count_tokens(text: str, provider: str = "openai", model_name: str = "gpt-4") -> int:
+    """Count (or estimate) the number of tokens in a piece of text for a provider.
+
+    Args:
+        text (str): The text to measure
+        provider (str, optional): "openai", "anthropic" or "deepseek". Defaults to "openai".
+        model_name (str, optional): The model, used to pick the OpenAI encoding. Defaults to "gpt-4".
+
+    Returns:
+        int: The number of tokens
+    """
+    if provider == "openai":
+        # Only OpenAI's own tokenizer gives exact counts
+        encoder = _get_encoder(model_name)
+
+        if encoder is not None:
+            # Count the tokens exactly
+            return len(encoder.encode(text))
+
+    return int(len(text) / CHARS_PER_TOKEN.get(provider, 4.0)) + 1
+    # Estimate from the number of characters (rounding up)
+
+def truncate_to_tokens(text: str, max_tokens: int, provider: str = "openai", model_name: str = "gpt-4") -> str:
+    """Cut text down so it fits in a number of tokens.
+
+    Args:
+        text (str): The text to shorten
+        max_tokens (int): The most tokens the result may use
+        provider (str, optional): "openai", "anthropic" or "deepseek". Defaults to "openai".
+        model_name (str, optional): The model, used to pick the OpenAI encoding. Defaults to "gpt-4".
+
+    Returns:
+        str: The shortened text (ending in "..." if anything was cut)
+    """
+    if max_tokens <= 0:
+        # No room at all
+        return ""
+
+    if count_tokens(text, provider, model_name) <= max_tokens:
+        # Already fits
+        return text
+
+    encoder = _get_encoder(model_name) if provider == "openai" else None
+    # Use the exact tokenizer when we have one
+
+    if encoder is not None:
+        # Keep exactly the first max_tokens tokens
+        return encoder.decode(encoder.encode(text)[:max_tokens]) + "..."
+
+    return text[:int(max_tokens * CHARS_PER_TOKEN.get(provider, 4.0))] + "..."
+    # Otherwise keep roughly the right number of characters
+
+class PackingStats:
+    """What the context packer did for one query."""
+
+    def __init__(self):
+        """Initialize all counters to zero."""
+        self.tokens_before = 0
+        # Tokens the context would have used with every result included in full
+
+        self.tokens_after = 0
+        # Tokens the packed context actually uses
+
+        self.duplicates = 0
+        # Results dropped because they repeated a higher-scoring result
+
+        self.dropped = 0
+        # Results dropped because they didn't fit in the budget
+
+        self.truncated = 0
+        # Results that were shortened to fit
+
+    @property
+    def tokens_saved(self) -> int:
+        """Tokens saved compared to sending every result in full."""
+        return max(0, self.tokens_before - self.tokens_after)
+
+    def __repr__(self) -> str:
+        """Show the stats in a readable form (used in debug prints)."""
+        return (f"PackingStats(tokens_before={self.tokens_before}, tokens_after={self.tokens_after}, "
+                f"saved={self.tokens_saved}, duplicates={self.duplicates}, dropped={self.dropped}, "
+                f"truncated={self.truncated})")
+
+def _shingles(text: str, size: int = 3) -> set:
+    """Return the set of overlapping word triples in a text (used to spot overlapping chunks)."""
+    words = re.findall(r"\w+", text.lower())
+    # Split the text into lowercase words
+
+    if len(words) < size:
+        # Very short text: use the words themselves
+        return {tuple(words)} if words else set()
+
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+    # Every run of `size` consecutive words
+
+class ContextPacker:
+    """Builds the context string for a prompt within a token budget."""
+    # Steps for each query:
+    #   1. Sort the results by score, best first
+    #   2. Drop results whose text mostly repeats a better result (overlapping chunks)
+    #   3. Add results in order until the budget is used; the first one that doesn't fit is shortened,
+    #      and the rest are dropped
+    #   4. Join the pieces once at the end (instead of growing a string with += in a loop)
+
+    def __init__(self, budget_tokens: Optional[int] = None, provider: str = "openai", model_name: str = "gpt-4",
+                 overlap_threshold: float = 0.8, min_truncated_tokens: int = 100):
+        """Initialize the packer.
+
+        Args:
+            budget_tokens (int, optional): Most tokens the context may use.
+                Defaults to the CONTEXT_TOKEN_BUDGET environment variable, or 6000.
+            provider (str, optional): Whose tokenizer to count with. Defaults to "openai".
+            model_name (str, optional): The model, used to pick the OpenAI encoding. Defaults to "gpt-4".
+            overlap_threshold (float, optional): Share of a result's word triples found in a better result
+                above which it counts as a duplicate. Defaults to 0.8.
+            min_truncated_tokens (int, optional): Smallest useful shortened result. Defaults to 100.
+        """
+        self.budget_tokens = budget_tokens if budget_tokens is not None else int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        # Store the token budget
+
+        self.provider = provider
+        # Store the provider
+
+        self.model_name = model_name
+        # Store the model name
+
+        self.overlap_threshold = overlap_threshold
+        # Store the duplicate threshold
+
+        self.min_truncated_tokens = min_truncated_tokens
+        # Store the smallest useful shortened result
+
+    def _count(self, text: str) -> int:
+        """Count tokens with this packer's tokenizer."""
+        return count_tokens(text, self.provider, self.model_name)
+
+    def _format_block(self, number: int, result: RetrievedChunk, text: Optional[str] = None) -> str:
+        """Format one result exactly the way the prompt expects it."""
+        parts = [f"Document {number}:\n"]
+        # Add a header for each document with its number (starting from 1)
+
+        if result.title is not None:
+            # Check if the result has a title field
+            parts.append(f"Title: {result.title}\n")
+
+        if result.description is not None:
+            # Check if the result has a description field
+            parts.append(f"Description: {result.description}\n")
+
+        parts.append(f"Content: {result.text if text is None else text}\n")
+        # Every result has text
+
+        parts.append(f"Relevance Score: {result.score:.4f}\n\n")
+        # Add the relevance score, formatted to 4 decimal places, and a blank line
+
+        return "".join(parts)
+        # Join the pieces of this block
+
+    def pack(self, results: List[RetrievedChunk]) -> Tuple[str, PackingStats]:
+        """Build the context string for a list of results.
+
+        Args:
+            results (List[RetrievedChunk]): The retrieved results
+
+        Returns:
+            Tuple[str, PackingStats]: The context string and what was done to fit it in the budget
+        """
+        stats = PackingStats()
+        # Start counting
+
+        stats.tokens_before = sum(self._count(self._format_block(i + 1, result)) for i, result in enumerate(results))
+        # What the context would cost with every result included in full
+
+        ranked = sorted(results, key=lambda result: result.score, reverse=True)
+        # Best results first, so they are the last to be shortened or dropped
+
+        kept: List[RetrievedChunk] = []
+        # The results that survive de-duplication
+
+        kept_shingles: List[set] = []
+        # The word triples of each kept result
+
+        for result in ranked:
+            # Loop through the results, best first
+            shingles = _shingles(result.text)
+            # The word triples of this result
+
+            if shingles and any(len(shingles & other) / len(shingles) >= self.overlap_threshold for other in kept_shingles):
+                # Most of this result already appears in a better result
+                stats.duplicates += 1
+                continue
+
+            kept.append(result)
+            kept_shingles.append(shingles)
+
+        blocks: List[str] = []
+        # The formatted blocks that go into the context
+
+        used = 0
+        # Tokens used so far
+
+        for index, result in enumerate(kept):
+            # Add results until the budget is used up
+            block = self._format_block(len(blocks) + 1, result)
+            # Format the result in full
+
+            tokens = self._count(block)
+            # Its cost in tokens
+
+            if used + tokens <= self.budget_tokens:
+                # It fits
+                blocks.append(block)
+                used += tokens
+                continue
+
+            remaining = self.budget_tokens - used - (tokens - self._count(result.text)) - 2
+            # Tokens left for this result's text once its title, description and score are paid for
+            # (minus a little room for the "..." that marks the cut)
+
+            if remaining >= self.min_truncated_tokens:
+                # Enough room for a useful part of the text
+                text = truncate_to_tokens(result.text, remaining, self.provider, self.model_name)
+                # Shorten the text to fit
+
+                block = self._format_block(len(blocks) + 1, result, text)
+                # Format the shortened result
+
+                blocks.append(block)
+                used += self._count(block)
+                stats.truncated += 1
+            else:
+                # Not enough room left
+                stats.dropped += 1
+
+            stats.dropped += len(kept) - index - 1
+            # Every remaining (lower-scoring) result is dropped too
+            break
+
+        stats.tokens_after = used
+        # What the packed context costs
+
+        return "".join(blocks), stats
+        # Build the context string in one pass
@@ -1,23 +1,27 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator
 # Import typing hints to specify the expected types of variables and function parameters/returns
 # List: A list of items of a specific type
 # Dict: A dictionary with keys and values of specific types
 # Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
 
-import requests
-# Import the requests package for making HTTP requests to the Deepseek API
+import json
+# Import json to decode the streamed chunks sent by the Deepseek API
 
-import asyncio
-# Import asyncio for asynchronous programming, allowing non-blocking operations
-
-from base_agent import BaseAgent
+from base_agent import BaseAgent, StreamInterruptedError
 # Import the BaseAgent abstract base class that defines the common interface for all agents
 
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
 class DeepseekAgent(BaseAgent):
     """Agent for generating answers using Deepseek models."""
     # This class implements the BaseAgent interface for Deepseek models
     # It handles the specifics of communicating with the Deepseek API
     
+    token_provider = "deepseek"
+    # Count context tokens the way Deepseek does (see BaseAgent.format_context)
+    
     def __init__(self, api_key: str, model_name: str = "deepseek-chat"):
         """Initialize Deepseek agent with an API key and model name.
         
@@ -39,12 +43,117 @@ class DeepseekAgent(BaseAgent):
         # Store the API endpoint URL as an instance variable
         # This is the URL that we'll send requests to
 
-    async def generate_answer(self, query: str, results: List[Dict[str, Any]]) -> str:
+    def _build_headers(self) -> Dict[str, str]:
+        """Build the HTTP headers for a Deepseek request.
+        
+        Returns:
+            Dict[str, str]: The request headers
+        """
+        return {
+            "Content-Type": "application/json",
+            # Specify that we're sending JSON data
+            "Authorization": f"Bearer {self.api_key}"
+            # Include the API key in the Authorization header using Bearer token authentication
+        }
+
+    def _build_payload(self, query: str, context: str, stream: bool = False) -> Dict[str, Any]:
+        """Build the JSON body for a Deepseek chat completion request.
+        
+        Args:
+            query (str): The user's question
+            context (str): The formatted retrieved information
+            stream (bool, optional): Whether to ask for a streamed response. Defaults to False.
+            
+        Returns:
+            Dict[str, Any]: The request body
+        """
+        # Shared by generate_answer and stream_answer so both send exactly the same prompt
+        
+        return {
+            "model": self.model_name,
+            # Specify which model to use (e.g., "deepseek-chat")
+            "messages": [
+                # Provide a list of messages that define the conversation
+                {"role": "system", "content": "You are a helpful assistant that provides comprehensive answers based on the retrieved information. Cite your sources when appropriate."},
+                # The system message sets the behavior of the assistant
+                # This content tells the model to act as a helpful assistant and cite sources
+                {"role": "user", "content": f"Based on the following information, please provide a comprehensive answer to this question: '{query}'\n\nRetrieved Information:\n{context}"}
+                # The user message contains the user's question and the context
+                # This content includes the user's question and the formatted context
+            ],
+            "max_tokens": self.max_output_tokens,
+            # Set the maximum number of tokens (words/parts of words) in the response
+            "stream": stream
+            # When True, the API sends the answer as server-sent events while it is generated
+        }
+
+    async def request_answer(self, query: str, results: List[RetrievedChunk]) -> str:
+        """Generate an answer using Deepseek, raising an exception if the API call fails.
+        
+        Args:
+            query (str): The user's question
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
+            
+        Returns:
+            str: The generated answer
+        """
+        # Callers that need to know about failures (like the provider router) use this method
+        # generate_answer below wraps it and turns failures into the fallback message
+        
+        context = self.format_context(results)
+        # Format the retrieved results into a context string using the method from BaseAgent
+        
+        headers = self._build_headers()
+        # Build the HTTP headers, including the API key
+        
+        data = self._build_payload(query, context)
+        # Build the JSON body with the model, messages and token limit
+        
+        async def post():
+            """Send the request, raising for error status codes (like 401 or 429) instead of parsing an error body."""
+            response = await self._get_client().post(self.api_url, headers=headers, json=data)
+            # Send the POST request through the shared keep-alive HTTP client (see BaseAgent._get_client)
+            # This awaits the network without a thread hop and reuses an open connection when there is one
+            
+            response.raise_for_status()
+            # A 429 or 5xx raises httpx.HTTPStatusError, which the rate limiter retries
+            
+            return response
+        
+        with self._provider_call() as call:
+            # Time the API call and export it as a metric
+            response = await self._rate_limiter().call(
+                post,
+                tokens=self._estimate_tokens(data["messages"][0]["content"] + data["messages"][1]["content"]),
+                # Wait for request and token budget, and retry 429s with backoff (see rate_limiter.py)
+                usage=lambda response: (response.json().get("usage") or {}).get("total_tokens")
+                # Correct the token budget with what the call really used
+            )
+            
+            response_json = response.json()
+            # Parse the JSON response into a Python dictionary
+            
+            if "choices" not in response_json or len(response_json["choices"]) == 0:
+                # If the response doesn't contain choices or is empty
+                raise ValueError(f"Unexpected response format from Deepseek: {response_json}")
+                # Treat it as a failed call
+            
+            usage = response_json.get("usage") or {}
+            # The token usage Deepseek reports (OpenAI's format)
+            
+            call.record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+            # Record the tokens the call used
+        
+        return response_json["choices"][0]["message"]["content"]
+        # Extract the content of the first choice's message and return it
+        # This is the actual answer generated by the model
+
+    async def generate_answer(self, query: str, results: List[RetrievedChunk]) -> str:
         """Generate a comprehensive answer from retrieved results using Deepseek.
         
         Args:
             query (str): The user's question
-            results (List[Dict[str, Any]]): Retrieved results from Pinecone
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
             
         Returns:
             str: The generated answer
@@ -53,69 +162,120 @@ class DeepseekAgent(BaseAgent):
         # This method generates an answer to the user's question based on the retrieved results
         # It's marked as async, which means it's an asynchronous method that can be awaited
         
+        try:
+            # Try to generate an answer using the Deepseek API
+            return await self.request_answer(query, results)
+            
+        except Exception as e:
+            # If there's an error during the API call
+            print(f"Error generating answer with Deepseek: {e}")
+            # Print the error message for debugging
+            
+            return self.FALLBACK_ANSWER
+            # Return a fallback message to the user
+
+    async def stream_answer(self, query: str, results: List[RetrievedChunk]) -> AsyncIterator[str]:
+        """Stream an answer from retrieved results using Deepseek, one text delta at a time.
+        
+        Args:
+            query (str): The user's question
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
+            
+        Yields:
+            str: The next piece of the generated answer
+        """
+        # Deepseek uses the same streaming format as OpenAI: server-sent events,
+        # one "data: {json}" line per chunk, ending with "data: [DONE]"
+        
         context = self.format_context(results)
         # Format the retrieved results into a context string using the method from BaseAgent
         
+        sent = False
+        # Whether any text has reached the caller yet
+        
         try:
-            # Try to generate an answer using the Deepseek API
+            # Try to stream an answer using the Deepseek API
+            headers = self._build_headers()
+            # Build the HTTP headers, including the API key
             
-            headers = {
-                "Content-Type": "application/json",
-                # Specify that we're sending JSON data
-                "Authorization": f"Bearer {self.api_key}"
-                # Include the API key in the Authorization header using Bearer token authentication
-            }
-            
-            data = {
-                "model": self.model_name,
-                # Specify which model to use (e.g., "deepseek-chat")
-                "messages": [
-                    # Provide a list of messages that define the conversation
-                    {"role": "system", "content": "You are a helpful assistant that provides comprehensive answers based on the retrieved information. Cite your sources when appropriate."},
-                    # The system message sets the behavior of the assistant
-                    # This content tells the model to act as a helpful assistant and cite sources
-                    {"role": "user", "content": f"Based on the following information, please provide a comprehensive answer to this question: '{query}'\n\nRetrieved Information:\n{context}"}
-                    # The user message contains the user's question and the context
-                    # This content includes the user's question and the formatted context
-                ],
-                "max_tokens": 1000
-                # Set the maximum number of tokens (words/parts of words) in the response
-            }
-            
-            # Since requests doesn't have async methods, we'll use it in a thread pool
-            # This is a way to run a synchronous function asynchronously without blocking the event loop
-            loop = asyncio.get_event_loop()
-            # Get the current event loop
-            
-            response = await loop.run_in_executor(
-                # Run the synchronous requests.post function in a thread pool
-                None,  # Use the default executor (ThreadPoolExecutor)
-                lambda: requests.post(self.api_url, headers=headers, json=data)
-                # This lambda function makes a POST request to the Deepseek API
-                # It sends the headers and data as JSON
-            )
-            # The response contains the HTTP response from the API
+            data = self._build_payload(query, context, stream=True)
+            # Build the JSON body, asking for a streamed response
             
-            response_json = response.json()
-            # Parse the JSON response into a Python dictionary
+            estimate = self._estimate_tokens(data["messages"][0]["content"] + data["messages"][1]["content"])
+            # The tokens the rate limiter reserves until the stream reports what it used
             
-            if "choices" in response_json and len(response_json["choices"]) > 0:
-                # Check if the response contains choices and at least one choice
-                return response_json["choices"][0]["message"]["content"]
-                # Extract the content of the first choice's message and return it
-                # This is the actual answer generated by the model
-            else:
-                # If the response doesn't contain choices or is empty
-                print(f"Unexpected response format from Deepseek: {response_json}")
-                # Print the unexpected response format for debugging
+            async def open_stream():
+                """Send the request and return the response once its headers arrive, raising for error status codes."""
+                client = self._get_client()
+                # The shared keep-alive HTTP client
+                
+                response = await client.send(client.build_request("POST", self.api_url, headers=headers, json=data), stream=True)
+                # Send the request without reading the body yet
                 
-                return "I couldn't generate an answer based on the retrieved information."
-                # Return a fallback message to the user
+                if response.is_error:
+                    # Read the error body and release the connection before raising, so a retry starts clean
+                    await response.aread()
+                    await response.aclose()
+                    response.raise_for_status()
                 
+                return response
+            
+            with self._provider_call() as call:
+                # Time the API call and export it as a metric
+                usage = {}
+                # The token usage, once the API reports it
+                
+                response = await self._rate_limiter().call(open_stream, tokens=estimate)
+                # Wait for budget; a 429 when opening the stream is retried before any text is sent
+                
+                try:
+                    async for line in response.aiter_lines():
+                        # Loop over the response lines as they arrive
+                        
+                        if not line.startswith("data: "):
+                            # Skip blank keep-alive lines between events
+                            continue
+                        
+                        payload = line[len("data: "):]
+                        # Strip the "data: " prefix
+                        
+                        if payload == "[DONE]":
+                            # The API signals the end of the answer
+                            break
+                        
+                        chunk = json.loads(payload)
+                        # Parse the chunk into a Python dictionary
+                        
+                        if chunk.get("usage"):
+                            # The last chunk reports the token usage of the whole answer
+                            usage = chunk["usage"]
+                        
+                        delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                        # Get the new text from the chunk, if any (the usage chunk may have no choices)
+                        
+                        if delta:
+                            # Some chunks carry no text
+                            sent = True
+                            yield delta
+                            # Pass the new text on to the caller straight away
+                finally:
+                    await response.aclose()
+                    # Release the connection, also when the caller stopped reading early
+                
+                self._rate_limiter().settle(estimate, usage.get("total_tokens"))
+                # Correct the token budget with what the call really used (the estimate stays if the API didn't say)
+                
+                call.record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+                # Record the tokens the call used (nothing if the API didn't say)
+            
         except Exception as e:
             # If there's an error during the API call or processing
-            print(f"Error generating answer with Deepseek: {e}")
+            print(f"Error streaming answer with Deepseek: {e}")
             # Print the error message for debugging
             
-            return "I couldn't generate an answer based on the retrieved information."
-            # Return a fallback message to the user 
\ No newline at end of file
+            if sent:
+                # Part of the answer is already out: appending the fallback message would pass as the answer's end
+                raise StreamInterruptedError(f"Deepseek stream failed after part of the answer was sent: {e}") from e
+            
+            yield self.FALLBACK_ANSWER
+            # Nothing was sent yet, so send a fallback message to the user
@@ -0,0 +1,183 @@
+import os
+# Import the os module to build file paths and read the Pinecone key from environment variables
+
+import json
+# Import json to read and write one document per line
+
+import mmap
+# Import mmap to read documents straight from the file without loading it all
+
+from typing import Any, Dict, Iterable, List
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# Iterable: Anything that can be looped over
+# List: A list of items of a specific type
+
+import numpy as np
+# Import numpy to store the line offsets as a memory-mapped array
+
+from langchain_core.documents import Document
+# Import Document, the same result type the vector store returns, so local results fit in everywhere
+
+# A document store is two files in an index directory:
+#   docs.jsonl        - one {"id", "text", "metadata"} line per document
+#   docs_offsets.npy  - the byte offset of each line in docs.jsonl (int64)
+# The local indexes (bm25_index.py, local_index.py) refer to documents by their line number.
+
+class DocumentStoreWriter:
+    """Writes documents to a document store, one line at a time."""
+
+    def __init__(self, directory: str, prefix: str = "docs"):
+        """Create (or overwrite) a document store.
+
+        Args:
+            directory (str): The index directory
+            prefix (str, optional): The file name prefix. Defaults to "docs".
+        """
+        self.directory = directory
+        # Store the directory
+
+        self.prefix = prefix
+        # Store the file name prefix
+
+        self._file = open(os.path.join(directory, f"{prefix}.jsonl"), "wb")
+        # Open the documents file for writing
+
+        self._offsets: List[int] = []
+        # Where each line starts
+
+    def write(self, doc_id: Any, text: str, metadata: Dict[str, Any]) -> int:
+        """Append a document and return its number."""
+        self._offsets.append(self._file.tell())
+        # Remember where this document's line starts
+
+        self._file.write(json.dumps({"id": doc_id, "text": text, "metadata": metadata or {}},
+                                    ensure_ascii=False).encode("utf-8") + b"\n")
+        # Write the document as one JSON line
+
+        return len(self._offsets) - 1
+
+    def close(self) -> int:
+        """Finish the store and return how many documents it holds."""
+        self._file.close()
+        # Flush and close the documents file
+
+        np.save(os.path.join(self.directory, f"{self.prefix}_offsets.npy"), np.asarray(self._offsets, dtype=np.int64))
+        # Save the line offsets so any line can be read directly
+
+        return len(self._offsets)
+
+class DocumentStore:
+    """Reads documents from a document store by number, without loading the whole file."""
+
+    def __init__(self, directory: str, prefix: str = "docs"):
+        """Open a document store.
+
+        Args:
+            directory (str): The index directory
+            prefix (str, optional): The file name prefix. Defaults to "docs".
+        """
+        self.offsets = np.load(os.path.join(directory, f"{prefix}_offsets.npy"), mmap_mode="r")
+        # Where each document's line starts
+
+        self._file = open(os.path.join(directory, f"{prefix}.jsonl"), "rb")
+        # Keep the documents file open for the life of the store
+
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Map the file into memory; reading a slice only touches the pages that are needed
+
+    def __len__(self) -> int:
+        """Return how many documents the store holds."""
+        return len(self.offsets)
+
+    def get_record(self, number: int) -> Dict[str, Any]:
+        """Return the raw {"id", "text", "metadata"} record of a document."""
+        start = int(self.offsets[number])
+        # Where the document's line starts
+
+        end = int(self.offsets[number + 1]) if number + 1 < len(self.offsets) else len(self._data)
+        # Where it ends (the next line's start, or the end of the file)
+
+        return json.loads(self._data[start:end])
+        # Parse just this line
+
+    def get_document(self, number: int) -> Document:
+        """Return a document shaped like a vector store result.
+
+        Args:
+            number (int): The document number (its line in the store)
+
+        Returns:
+            Document: The text as page_content and everything else as metadata
+        """
+        record = self.get_record(number)
+        # Read the record
+
+        return Document(page_content=record.get("text", ""), metadata=dict(record.get("metadata") or {}))
+
+    def close(self):
+        """Release the memory map and the file."""
+        self._data.close()
+        self._file.close()
+
+def read_jsonl_records(path: str) -> Iterable[Dict[str, Any]]:
+    """Read documents from a JSONL file.
+
+    Each line needs "text" and may have "id", "values" (its embedding) and "metadata";
+    without a "metadata" field, every other field is used as metadata.
+
+    Args:
+        path (str): The JSONL file
+
+    Returns:
+        Iterable[Dict[str, Any]]: {"id", "text", "values", "metadata"} records
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            # Loop through each line
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            # Parse the line
+
+            yield {
+                "id": record.pop("id", None),
+                "text": record.pop("text", ""),
+                "values": record.pop("values", None),
+                "metadata": record.pop("metadata", None) or record
+                # Use an explicit "metadata" field if there is one, otherwise every remaining field
+            }
+
+def read_pinecone_records(index_name: str, namespace: str = "", batch_size: int = 100) -> Iterable[Dict[str, Any]]:
+    """Read every document (and its embedding) from a Pinecone index.
+
+    Only serverless indexes support listing their ids.
+
+    Args:
+        index_name (str): The Pinecone index
+        namespace (str, optional): The namespace to read. Defaults to "" (the default namespace).
+        batch_size (int, optional): Ids fetched per request. Defaults to 100.
+
+    Returns:
+        Iterable[Dict[str, Any]]: {"id", "text", "values", "metadata"} records
+    """
+    from resource_manager import resource_manager
+    # Import here so building from a JSONL file doesn't need Pinecone
+
+    index = resource_manager.get_client(os.getenv("PINECONE_API_KEY", "").strip()).Index(index_name)
+    # Connect to the index with the shared client
+
+    for ids in index.list(namespace=namespace, limit=batch_size):
+        # Loop through the ids one page at a time
+        response = index.fetch(ids=list(ids), namespace=namespace)
+        # Fetch the embeddings and metadata for this page
+
+        for vector_id, vector in response.vectors.items():
+            # Loop through the fetched vectors
+            metadata = dict(vector.metadata or {})
+            # Copy the metadata
+
+            yield {"id": vector_id, "text": metadata.pop("text", ""), "values": list(vector.values), "metadata": metadata}
+            # The vector store keeps the text under the "text" key
@@ -0,0 +1,169 @@
+import concurrent.futures
+# Import concurrent.futures to hand each caller its vector, and to run several batches at once
+
+import queue
+# Import queue to collect texts from every thread
+
+import threading
+# Import threading for the thread that groups texts into batches
+
+import time
+# Import time to close a batch once its collection window has passed
+
+from typing import Callable, List, Optional, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Callable: A function
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+
+from metrics import registry
+# Import the process-wide metrics registry
+
+from tracing import current_trace
+# Import the current query's trace, to remember which session each text came from
+
+# Groups query embeddings from concurrent requests into one multi-input API call.
+#
+# Without it, every query that misses the embedding cache sends its own single-text request, so under load
+# most of the embedding time is per-request overhead (connection, headers, queueing at the provider, one unit
+# of the requests-per-minute budget each). A background thread takes the first waiting text, keeps collecting
+# for a few milliseconds (or until the batch is full) and sends everything collected as one request. The
+# vectors are handed back to the callers in order.
+#
+# A lone query waits at most max_wait_ms; while batches are in flight, new texts keep collecting, so under
+# load the batches grow on their own.
+#
+# The batch is sent from a worker thread, outside any caller's trace, so each text carries the session it was
+# submitted from and embed_many gets them alongside the texts (the rate limiter charges every session its part).
+
+BATCH_SIZE = registry.histogram(
+    "rag_embedding_batch_size", "Texts per batched embedding request.", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+# How well concurrent queries are being grouped
+
+_Request = Tuple[str, str, "concurrent.futures.Future[List[float]]"]
+# A text, the session it came from and where to put its vector
+
+class EmbeddingBatcher:
+    """Collects texts from concurrent callers and embeds them in batches."""
+
+    def __init__(self, embed_many: Callable[[List[str], List[str]], List[List[float]]], max_wait_ms: float = 5.0,
+                 max_batch: int = 64, max_concurrent: int = 4):
+        """Initialize the batcher (its thread starts on first use).
+
+        Args:
+            embed_many (Callable[[List[str], List[str]], List[List[float]]]): Embeds a list of texts in one
+                request, given the texts and the session each came from
+            max_wait_ms (float, optional): How long to keep collecting after the first text. Defaults to 5.
+            max_batch (int, optional): The most texts per request. Defaults to 64.
+            max_concurrent (int, optional): Batches in flight at once. Defaults to 4.
+        """
+        self.embed_many = embed_many
+        # Store the batch embedding function
+
+        self.max_wait = max_wait_ms / 1000.0
+        # Store the collection window in seconds
+
+        self.max_batch = max_batch
+        # Store the batch size limit
+
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        # Texts waiting to be batched
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent,
+                                                               thread_name_prefix="embed-batch")
+        # Threads that send the batches, so collecting the next one doesn't wait for the API
+
+        self._slots = threading.Semaphore(max_concurrent)
+        # Free places for a batch in flight; while they are all taken, texts keep collecting into a bigger batch
+
+        self._thread: Optional[threading.Thread] = None
+        # The collecting thread, started on first use
+
+        self._lock = threading.Lock()
+        # A lock so only one collecting thread is started
+
+    def _start(self):
+        """Start the collecting thread if it isn't running yet."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+                # A daemon thread, so it never keeps the process alive
+                self._thread.start()
+
+    def submit(self, text: str) -> "concurrent.futures.Future[List[float]]":
+        """Queue a text for the next batch.
+
+        Args:
+            text (str): The text to embed
+
+        Returns:
+            Future[List[float]]: Resolves to the text's vector (or the batch's error)
+        """
+        self._start()
+
+        trace = current_trace()
+        session = (trace.session if trace is not None else None) or ""
+        # Captured here, on the caller's thread, because the batch is sent from another one
+
+        future: "concurrent.futures.Future[List[float]]" = concurrent.futures.Future()
+        self._queue.put((text, session, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """Embed a text as part of a batch, blocking until its vector is ready."""
+        return self.submit(text).result()
+
+    def _collect(self):
+        """Group queued texts into batches and send them (runs on the collecting thread)."""
+        while True:
+            batch = [self._queue.get()]
+            # Wait for the first text of the next batch
+
+            deadline = time.monotonic() + self.max_wait
+            # Keep collecting until then
+
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._slots.acquire()
+            # Wait for a free place when every batch slot is busy
+
+            while len(batch) < self.max_batch:
+                # Pick up whatever arrived while we waited for the slot
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: List[_Request]):
+        """Embed one batch and hand every caller its vector."""
+        try:
+            BATCH_SIZE.observe(len(batch))
+
+            vectors = self.embed_many([text for text, _, _ in batch], [session for _, session, _ in batch])
+            # One request for the whole batch
+
+            if len(vectors) != len(batch):
+                # Pairing them up anyway would leave some callers waiting forever (or give them the wrong vector)
+                raise RuntimeError(f"Embedding provider returned {len(vectors)} vectors for {len(batch)} texts")
+
+            for (_, _, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+        except BaseException as e:
+            for _, _, future in batch:
+                # Everyone in the batch gets the error
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
@@ -0,0 +1,602 @@
+import asyncio
+# Import asyncio to await a batched embedding from async code
+
+import os
+# Import the os module to read cache settings from environment variables and manage cache files
+
+import hashlib
+# Import hashlib to turn (model, normalized query) into a short fixed-size cache key
+
+import threading
+# Import threading so the caches can be shared safely between Streamlit sessions
+
+from contextlib import contextmanager
+# Import contextmanager to hold the cross-process file lock with a "with" block
+
+try:
+    import fcntl
+    # Import fcntl to lock the disk cache against other processes (the app, the API and batch_cli can share it)
+except ImportError:
+    fcntl = None
+    # Not available on Windows: there, give each process its own EMBEDDING_CACHE_DIR
+
+from collections import OrderedDict
+# Import OrderedDict, which remembers insertion order and lets us move items to the end (used for LRU)
+
+from typing import Dict, List, Optional
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+
+import numpy as np
+# Import numpy to store vectors compactly as float32 arrays and memory-map them from disk
+
+from langchain_core.embeddings import Embeddings
+# Import the LangChain Embeddings interface, which PineconeVectorStore uses to embed queries
+
+from context_packer import count_tokens
+# Import the token counter, to tell the rate limiter how big an embedding request is
+
+from embedding_batcher import EmbeddingBatcher
+# Import the batcher that groups query embeddings from concurrent requests into one call
+
+from rate_limiter import RateLimiter
+# Import the rate limiter that cache misses go through
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so trivially different spellings share one cache entry.
+
+    Only used for cache (and in-flight) keys; the model always embeds the query as it was asked.
+
+    Args:
+        text (str): The raw query text
+
+    Returns:
+        str: The query with whitespace collapsed and case folded
+    """
+    return " ".join(text.split()).casefold()
+    # split() with no arguments splits on any run of whitespace, so this also trims the ends
+    # casefold() is a stronger lower() that also handles characters like the German "ß"
+
+def make_cache_key(model: str, text: str) -> str:
+    """Build the cache key for a query embedded with a given model.
+
+    Args:
+        model (str): The embedding model name
+        text (str): The raw query text
+
+    Returns:
+        str: A hex digest identifying the (model, normalized query) pair
+    """
+    return hashlib.sha256(f"{model}\n{normalize_query(text)}".encode("utf-8")).hexdigest()[:32]
+    # 32 hex characters (128 bits) is plenty to avoid collisions and keeps the key file small
+
+class LRUCache:
+    """A small thread-safe least-recently-used cache."""
+    # When the cache is full, the entry that hasn't been used for the longest time is removed
+
+    def __init__(self, max_size: int):
+        """Initialize an empty cache.
+
+        Args:
+            max_size (int): The most entries to keep in memory
+        """
+        self.max_size = max_size
+        # Store the size limit
+
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # The cached entries, least recently used first
+
+        self._lock = threading.Lock()
+        # A lock so two sessions can't change the order at the same time
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the cached value for a key, or None if it isn't cached."""
+        with self._lock:
+            # Protect the cache while we read and reorder it
+
+            if key not in self._data:
+                # Not cached
+                return None
+
+            self._data.move_to_end(key)
+            # Mark the entry as most recently used
+
+            return self._data[key]
+            # Return the cached value
+
+    def put(self, key: str, value: np.ndarray):
+        """Store a value, evicting the least recently used entry if the cache is full."""
+        with self._lock:
+            # Protect the cache while we change it
+
+            self._data[key] = value
+            # Store (or replace) the entry
+
+            self._data.move_to_end(key)
+            # Mark it as most recently used
+
+            while len(self._data) > self.max_size:
+                # While we're over the size limit
+                self._data.popitem(last=False)
+                # Remove the least recently used entry
+
+class DiskEmbeddingStore:
+    """An append-only on-disk store of float32 vectors, read through a memory map."""
+    # Layout of the cache directory:
+    #   vectors.f32 - all vectors back to back as raw float32 values (row i = vector i)
+    #   keys.txt    - one cache key per line; line i belongs to row i
+    #   lock        - locked while a process reads new keys, appends or clears, so processes sharing the
+    #                 directory (the app, api_server and batch_cli) never interleave their appends
+    # Memory-mapping vectors.f32 means the operating system loads only the rows we actually read,
+    # so opening a large cache is instant and the data is shared with other processes via the page cache
+
+    def __init__(self, directory: str, max_rows: int = 100000):
+        """Open (or create) the store in a directory.
+
+        Args:
+            directory (str): The directory holding vectors.f32 and keys.txt
+            max_rows (int, optional): The most vectors to keep before the store is reset. Defaults to 100000.
+        """
+        self.directory = directory
+        # Store the directory path
+
+        self.max_rows = max_rows
+        # Store the row limit
+
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        # The file holding the raw vectors
+
+        self._keys_path = os.path.join(directory, "keys.txt")
+        # The file holding one key per row
+
+        self._lock_path = os.path.join(directory, "lock")
+        # The file locked by whichever process is using the other two
+
+        self._lock = threading.Lock()
+        # A lock so appends and reads from this process's threads don't interleave
+
+        self._rows: Dict[str, int] = {}
+        # Maps each cache key to its row in vectors.f32
+
+        self._count = 0
+        # How many rows keys.txt describes (including ones other processes appended)
+
+        self._keys_offset = 0
+        # How many bytes of keys.txt have been read, so only new lines are read next time
+
+        self._keys_file_id: Optional[int] = None
+        # The inode of the keys.txt that was read; clearing replaces the file, so a new one means start over
+
+        self._dim: Optional[int] = None
+        # The vector dimension, known once the first vector has been stored
+
+        self._mmap: Optional[np.memmap] = None
+        # The current memory map over vectors.f32 (re-created when the file grows)
+
+        os.makedirs(directory, exist_ok=True)
+        # Create the cache directory if it doesn't exist
+
+        with self._lock, self._file_lock():
+            self._sync_locked()
+            # Read the existing keys, if any
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold the directory's lock file, so no other process changes the store meanwhile."""
+        with open(self._lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # Released when the file is closed
+
+            yield
+
+    def _reset_locked(self):
+        """Forget every row (the caller holds both locks)."""
+        self._mmap = None
+        # Drop the memory map before the file it points to changes
+
+        self._rows = {}
+        self._count = 0
+        self._keys_offset = 0
+        self._keys_file_id = None
+        # Forget every key
+
+        self._dim = None
+        # The next vector decides the dimension again
+
+    def _sync_locked(self):
+        """Read the keys appended since the last look, by this or another process (the caller holds both locks)."""
+        if not os.path.exists(self._keys_path) or not os.path.exists(self._vectors_path):
+            # Nothing has been cached yet
+            self._reset_locked()
+            return
+
+        keys_file_id = os.stat(self._keys_path).st_ino
+        # Which keys.txt this is
+
+        if keys_file_id != self._keys_file_id:
+            # Another process cleared the store (or this is the first look): read it from the start
+            self._reset_locked()
+            self._keys_file_id = keys_file_id
+
+        with open(self._keys_path, "rb") as f:
+            # Read only what is new
+            f.seek(self._keys_offset)
+            data = f.read()
+
+        data = data[:data.rfind(b"\n") + 1]
+        # Whole lines only
+
+        for line in data.decode("utf-8").splitlines():
+            # One key per line, in row order
+            key = line.strip()
+
+            if key:
+                self._rows[key] = self._count
+                self._count += 1
+
+        self._keys_offset += len(data)
+        # Remember where to continue
+
+        size = os.path.getsize(self._vectors_path)
+        # The size of the vector file in bytes
+
+        if self._count and self._dim is None and size % (self._count * 4) == 0:
+            # Each row holds dim float32 values of 4 bytes each
+            self._dim = size // (self._count * 4)
+
+        if self._count and (self._dim is None or size != self._count * self._dim * 4):
+            # The files don't match (for example after a crash in the middle of an append)
+            self._clear_locked()
+            # Start over rather than serve wrong vectors
+
+    def _changed_elsewhere(self) -> bool:
+        """Whether keys.txt is not the file (or the length) this process last read."""
+        try:
+            stat = os.stat(self._keys_path)
+        except FileNotFoundError:
+            return False
+
+        return (stat.st_ino, stat.st_size) != (self._keys_file_id, self._keys_offset)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the stored vector for a key, or None if it isn't stored."""
+        with self._lock:
+            # Protect the index and memory map while we read
+
+            if self._changed_elsewhere():
+                # Another process has appended to (or cleared) the store: catch up before trusting our rows
+                with self._file_lock():
+                    self._sync_locked()
+
+            row = self._rows.get(key)
+            # Look up the row for this key
+
+            if row is None:
+                # Not stored
+                return None
+
+            if self._mmap is None or self._mmap.shape[0] <= row:
+                # If we haven't mapped the file yet, or it has grown since we mapped it
+                with self._file_lock():
+                    # No other process is halfway through an append while we map
+                    self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r").reshape(-1, self._dim)
+                    # Map the whole file as a (rows, dim) array without reading it into memory
+
+            return np.array(self._mmap[row])
+            # Copy just this row out of the memory map
+
+    def put(self, key: str, vector: np.ndarray):
+        """Append a vector to the store."""
+        vector = np.asarray(vector, dtype=np.float32)
+        # Make sure the vector is stored as float32 (half the size of Python floats in float64)
+
+        with self._lock, self._file_lock():
+            # Protect the files and index while we append, against this process's threads and other processes
+
+            self._sync_locked()
+            # Catch up with other processes' appends, so the new row number is right
+
+            if key in self._rows:
+                # Already stored
+                return
+
+            if self._dim is not None and vector.shape[0] != self._dim:
+                # A vector of a different size can't share this file
+                return
+
+            if self._count >= self.max_rows:
+                # The store is full
+                self._clear_locked()
+                # Start a fresh store instead of growing without bound
+
+            with open(self._vectors_path, "ab") as f:
+                # Open the vector file for appending in binary mode
+                f.write(vector.tobytes())
+                # Write the raw float32 values
+
+            with open(self._keys_path, "ab") as f:
+                # Open the key file for appending
+                f.write((key + "\n").encode("utf-8"))
+                # Write the key on its own line
+
+                self._keys_offset = f.tell()
+                # Everything up to here has been read
+
+            self._keys_file_id = os.stat(self._keys_path).st_ino
+            # The file may have just been created
+
+            self._dim = vector.shape[0]
+            # Remember the dimension (set by the first vector)
+
+            self._rows[key] = self._count
+            self._count += 1
+            # The new vector is the last row
+
+    def clear(self):
+        """Delete every stored vector."""
+        with self._lock, self._file_lock():
+            # Protect the files and index while we clear them
+            self._clear_locked()
+
+    def _clear_locked(self):
+        """Delete every stored vector; the caller must hold both locks."""
+        self._mmap = None
+        # Drop the memory map before truncating the file it points to
+
+        for path in (self._vectors_path, self._keys_path):
+            # For each cache file
+            open(path + ".new", "wb").close()
+            os.replace(path + ".new", path)
+            # Replace it with an empty file (a new file, so other processes can tell it was cleared)
+
+        self._reset_locked()
+        # Forget every key
+
+_disk_stores: Dict[str, DiskEmbeddingStore] = {}
+# Every open disk store, keyed by directory
+# Two writers appending to the same files would corrupt them, so each directory gets exactly one store
+
+_disk_stores_lock = threading.Lock()
+# A lock protecting the dictionary above
+
+def get_disk_store(directory: str, max_rows: int = 100000) -> DiskEmbeddingStore:
+    """Return the process-wide disk store for a directory, opening it on first use.
+
+    Args:
+        directory (str): The directory holding vectors.f32 and keys.txt
+        max_rows (int, optional): The most vectors to keep before the store is reset. Defaults to 100000.
+
+    Returns:
+        DiskEmbeddingStore: The shared store for that directory
+    """
+    with _disk_stores_lock:
+        # Only one thread at a time may open a store
+
+        if directory not in _disk_stores:
+            # If the store isn't open yet
+            _disk_stores[directory] = DiskEmbeddingStore(directory, max_rows)
+            # Open it
+
+        return _disk_stores[directory]
+        # Return the shared store
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings object and caches query embeddings in memory and on disk."""
+    # PineconeVectorStore calls embed_query for every search
+    # Repeated questions (including ones that only differ in spacing or case) are answered from
+    # the in-memory LRU first, then from the on-disk store, and only go to the API on a miss
+
+    def __init__(self, embeddings: Embeddings, model: str, memory_size: int = 1024,
+                 disk_dir: Optional[str] = None, disk_max_rows: int = 100000,
+                 rate_limiter: Optional[RateLimiter] = None, batch_wait_ms: float = 0.0,
+                 batch_size: int = 64):
+        """Initialize the cache around an existing embeddings object.
+
+        Args:
+            embeddings (Embeddings): The embeddings object that calls the API
+            model (str): The embedding model name (part of the cache key)
+            memory_size (int, optional): Entries kept in the in-memory LRU. Defaults to 1024.
+            disk_dir (str, optional): Directory for the on-disk tier; None disables it. Defaults to None.
+            disk_max_rows (int, optional): Vectors kept on disk before it is reset. Defaults to 100000.
+            rate_limiter (RateLimiter, optional): Budgets and retries the API calls made on a miss. Defaults to None.
+            batch_wait_ms (float, optional): How long a query miss waits for other misses to share its API call;
+                0 sends every miss on its own. Defaults to 0.
+            batch_size (int, optional): The most queries per batched API call. Defaults to 64.
+        """
+        self.embeddings = embeddings
+        # Store the wrapped embeddings object
+
+        self.model = model
+        # Store the model name
+
+        self.memory = LRUCache(memory_size)
+        # The fast in-memory tier
+
+        self.disk = get_disk_store(os.path.join(disk_dir, model), disk_max_rows) if disk_dir else None
+        # The on-disk tier (one sub-directory per model, because vector sizes differ between models)
+
+        self.rate_limiter = rate_limiter
+        # Store the rate limiter (cache hits never touch it)
+
+        self.batcher = EmbeddingBatcher(self._embed_misses, batch_wait_ms, batch_size) if batch_wait_ms > 0 else None
+        # Groups misses from concurrent requests into one API call (None sends each miss on its own)
+
+    def _tokens(self, texts: List[str]) -> int:
+        """The tokens an embedding request for these texts uses."""
+        return sum(count_tokens(text) for text in texts)
+
+    def _embed_misses(self, texts: List[str], sessions: Optional[List[str]] = None) -> List[List[float]]:
+        """Embed queries that missed the cache in one API call.
+
+        Args:
+            texts (List[str]): The raw query texts
+            sessions (List[str], optional): The session each text came from, when a batch mixes several;
+                each session then pays for its own texts in the rate limiter's fair queue.
+                Defaults to the current trace's session for all of them.
+
+        Returns:
+            List[List[float]]: One embedding per query, in the same order
+        """
+        batch = list(texts)
+        # The queries as they were asked: normalizing is only for the cache key, because case matters to the
+        # model (acronyms, code identifiers)
+
+        if self.rate_limiter is not None:
+            shares: Dict[str, float] = {}
+            # Each session's part of the request, so batching doesn't hide whose traffic it is
+
+            for text, session in zip(batch, sessions or []):
+                shares[session] = shares.get(session, 0) + count_tokens(text)
+
+            # One request against the budget, sized by all its texts
+            return self.rate_limiter.call_sync(lambda: self.embeddings.embed_documents(batch),
+                                               tokens=self._tokens(batch), shares=shares or None)
+
+        return self.embeddings.embed_documents(batch)
+        # embed_documents takes a list of texts; for OpenAI it gives the same vectors as embed_query
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        """Look a key up in memory, then on disk."""
+        vector = self.memory.get(key)
+        # Try the in-memory tier first
+
+        if vector is None and self.disk is not None:
+            # If it wasn't in memory, try the disk tier
+            vector = self.disk.get(key)
+
+            if vector is not None:
+                # Found on disk
+                self.memory.put(key, vector)
+                # Promote it to memory for next time
+
+        return vector.tolist() if vector is not None else None
+        # LangChain expects a plain list of floats
+
+    def _store(self, key: str, embedding: List[float]):
+        """Store a freshly computed embedding in both tiers."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        # Convert to a compact float32 array
+
+        self.memory.put(key, vector)
+        # Store it in memory
+
+        if self.disk is not None:
+            # If the disk tier is enabled
+            self.disk.put(key, vector)
+            # Store it on disk
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, using the cache when possible.
+
+        Args:
+            text (str): The query text
+
+        Returns:
+            List[float]: The query embedding
+        """
+        key = make_cache_key(self.model, text)
+        # Build the cache key from the model and the normalized query
+
+        cached = self._lookup(key)
+        # Look in the cache
+
+        if cached is not None:
+            # Cache hit: no network round trip
+            return cached
+
+        if self.batcher is not None:
+            # Cache miss: share one API call with the other queries missing right now
+            embedding = self.batcher.embed(text)
+        elif self.rate_limiter is not None:
+            # Cache miss: ask the API within the budget, retrying 429s with backoff
+            embedding = self.rate_limiter.call_sync(lambda: self.embeddings.embed_query(text),
+                                                    tokens=self._tokens([text]))
+        else:
+            embedding = self.embeddings.embed_query(text)
+            # Cache miss: ask the API to embed the query as it was asked
+
+        self._store(key, embedding)
+        # Remember the result
+
+        return embedding
+        # Return the embedding
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Asynchronously embed a query, using the cache when possible.
+
+        Args:
+            text (str): The query text
+
+        Returns:
+            List[float]: The query embedding
+        """
+        key = make_cache_key(self.model, text)
+        # Build the cache key from the model and the normalized query
+
+        cached = self._lookup(key)
+        # Look in the cache
+
+        if cached is not None:
+            # Cache hit: no network round trip
+            return cached
+
+        if self.batcher is not None:
+            # Cache miss: share one API call with the other queries missing right now (without blocking the loop)
+            embedding = await asyncio.wrap_future(self.batcher.submit(text))
+        elif self.rate_limiter is not None:
+            # Cache miss: ask the API within the budget, retrying 429s with backoff
+            embedding = await self.rate_limiter.call(lambda: self.embeddings.aembed_query(text),
+                                                     tokens=self._tokens([text]))
+        else:
+            embedding = await self.embeddings.aembed_query(text)
+            # Cache miss: ask the API to embed the query as it was asked
+
+        self._store(key, embedding)
+        # Remember the result
+
+        return embedding
+        # Return the embedding
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries, using the cache when possible and one API call for all the misses.
+
+        Args:
+            texts (List[str]): The query texts
+
+        Returns:
+            List[List[float]]: One embedding per query, in the same order
+        """
+        keys = [make_cache_key(self.model, text) for text in texts]
+        # Build the cache key for every query
+
+        embeddings = [self._lookup(key) for key in keys]
+        # Look every query up in the cache (None for a miss)
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        # The positions of the queries we still need to embed
+
+        if missing:
+            fresh = self._embed_misses([texts[i] for i in missing])
+            # Embed every miss in a single request instead of one request per query (already a batch, so
+            # it doesn't wait for the batcher)
+
+            for i, embedding in zip(missing, fresh):
+                # Fill in the misses and remember them
+                embeddings[i] = embedding
+                self._store(keys[i], embedding)
+
+        return embeddings
+        # Return the embeddings in input order
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents without caching (documents are embedded once, when the index is built)."""
+        return self.embeddings.embed_documents(texts)
+        # Pass straight through to the wrapped embeddings object
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Asynchronously embed documents without caching."""
+        return await self.embeddings.aembed_documents(texts)
+        # Pass straight through to the wrapped embeddings object
@@ -0,0 +1,349 @@
+import argparse
+# Import argparse to parse the command-line options (quantizing a model, embedding documents for an index)
+
+import asyncio
+# Import asyncio to run inference on the thread pool without blocking the event loop
+
+import concurrent.futures
+# Import concurrent.futures for the inference thread pool
+
+import json
+# Import json to read and write the JSONL documents embedded by the command line
+
+import os
+# Import the os module to read the provider settings from environment variables and find the model files
+
+import sys
+# Import sys to return the exit code of the command line
+
+import threading
+# Import threading so only one session loads the model
+
+from typing import Any, Dict, List, Optional
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+
+import numpy as np
+# Import numpy for pooling and normalizing the model outputs
+
+from langchain_core.embeddings import Embeddings
+# Import the LangChain Embeddings interface, so the vector stores and caches can use either provider
+
+# Where query embeddings come from.
+#
+# By default every query is embedded by the OpenAI API, a full network round trip before the index can even be
+# searched. EMBEDDING_PROVIDER=onnx embeds on this machine's CPU instead, with a small sentence-embedding model
+# exported to ONNX (for example all-MiniLM-L6-v2 or bge-small-en-v1.5), so retrieval no longer waits on an
+# external API. The index must be built with the same model: embed the documents with
+#   python embedding_providers.py --embed-jsonl docs.jsonl --out docs_embedded.jsonl
+# and build a local index from the result (python local_index.py --jsonl docs_embedded.jsonl), or upload them
+# to a Pinecone index.
+#
+# onnxruntime and tokenizers are only needed for EMBEDDING_PROVIDER=onnx, and are imported when the model loads.
+
+def embedding_provider() -> str:
+    """The configured embedding provider: "openai" (the default) or "onnx"."""
+    return os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+
+class OnnxEmbeddings(Embeddings):
+    """Embeds text locally on the CPU with an ONNX sentence-embedding model (requires onnxruntime and tokenizers)."""
+    # The model directory holds what an ONNX export (for example optimum-cli export onnx) writes:
+    #   model.onnx            - the model
+    #   model_quantized.onnx  - the int8 version (python embedding_providers.py --quantize DIR), used when present
+    #   tokenizer.json        - the matching Hugging Face tokenizer
+    #
+    # onnxruntime releases the GIL while it runs, so several batches run at once on the thread pool; each run
+    # also uses a few threads of its own. The model loads on first use, or up front with warm_up().
+
+    def __init__(self, model_dir: str, quantized: bool = True, pooling: str = "mean", normalize: bool = True,
+                 max_length: int = 256, batch_size: int = 32, workers: int = 2, threads: Optional[int] = None):
+        """Initialize the embeddings. The model is loaded on first use.
+
+        Args:
+            model_dir (str): The directory holding the ONNX model and tokenizer.json
+            quantized (bool, optional): Use model_quantized.onnx when it exists. Defaults to True.
+            pooling (str, optional): "mean" (average the token vectors) or "cls" (the first token's vector);
+                use what the model was trained with. Defaults to "mean".
+            normalize (bool, optional): Scale every vector to length 1. Defaults to True.
+            max_length (int, optional): Tokens kept per text (the rest is cut off). Defaults to 256.
+            batch_size (int, optional): Texts per model run. Defaults to 32.
+            workers (int, optional): Model runs at the same time. Defaults to 2.
+            threads (int, optional): Threads per model run. Defaults to the CPU count divided among the workers.
+        """
+        self.model_dir = model_dir
+        # Store the model directory
+
+        self.quantized = quantized
+        # Store whether to prefer the int8 model
+
+        self.pooling = pooling
+        # Store how token vectors become one vector
+
+        self.normalize = normalize
+        # Store whether to normalize the vectors
+
+        self.max_length = max_length
+        # Store the token limit
+
+        self.batch_size = batch_size
+        # Store the batch size
+
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        # Threads per run, so all the workers together use the whole CPU without fighting over it
+
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="onnx-embed")
+        # The threads that run the model
+
+        self._session = None
+        # The onnxruntime session (None until first use)
+
+        self._tokenizer = None
+        # The tokenizer (None until first use)
+
+        self._input_names: List[str] = []
+        # The inputs the model takes (input_ids, attention_mask and sometimes token_type_ids)
+
+        self._lock = threading.Lock()
+        # A lock so two sessions don't both load the model
+
+    @property
+    def model_path(self) -> str:
+        """The ONNX file that is (or will be) loaded."""
+        quantized = os.path.join(self.model_dir, "model_quantized.onnx")
+        # The int8 model: smaller and usually about twice as fast on CPU, with nearly the same vectors
+
+        if self.quantized and os.path.exists(quantized):
+            return quantized
+
+        return os.path.join(self.model_dir, "model.onnx")
+
+    @property
+    def name(self) -> str:
+        """The model name used in cache keys (different files give different vectors)."""
+        model_file = os.path.splitext(os.path.basename(self.model_path))[0]
+        # "model" or "model_quantized"
+
+        return f"onnx-{os.path.basename(os.path.normpath(self.model_dir))}-{model_file}"
+        # Also the disk cache's sub-directory name, so only characters that are safe in a path
+
+    def _load(self):
+        """Load the model and tokenizer the first time they are needed."""
+        with self._lock:
+            # Only one thread at a time may load the model
+            if self._session is None:
+                import onnxruntime
+                # Import here so onnxruntime is only needed when this provider is used
+
+                from tokenizers import Tokenizer
+                # Import here so tokenizers is only needed when this provider is used
+
+                tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+                # Load the tokenizer the model was trained with
+
+                tokenizer.enable_truncation(max_length=self.max_length)
+                # Cut long texts off at max_length tokens
+
+                tokenizer.enable_padding()
+                # Pad every text in a batch to the longest one, so the batch is one rectangular array
+
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = self.threads
+                # Threads per run
+
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                # Fuse operations when the model loads
+
+                session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+                # Load the model for the CPU
+
+                self._input_names = [model_input.name for model_input in session.get_inputs()]
+                self._tokenizer = tokenizer
+                self._session = session
+                # Set last, so other threads only see a fully loaded model
+
+                print(f"DEBUG - Loaded local embedding model {self.model_path} ({self.threads} threads per run)")
+
+    def warm_up(self):
+        """Load the model and run it once, so the first query doesn't pay for either."""
+        self._embed_batch(["warm up"])
+        # The first run also allocates onnxruntime's buffers
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Run the model on one batch of texts."""
+        self._load()
+
+        encodings = self._tokenizer.encode_batch(texts)
+        # Token ids for every text
+
+        mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        # 1 for real tokens, 0 for padding
+
+        inputs: Dict[str, np.ndarray] = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        # Every input the model might take
+
+        output = self._session.run(None, {name: inputs[name] for name in self._input_names})[0]
+        # The first output: one vector per token, or one per text for models that pool themselves
+
+        if output.ndim == 3:
+            # One vector per token
+            if self.pooling == "cls":
+                output = output[:, 0]
+                # The first token's vector
+            else:
+                output = (output * mask[:, :, None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+                # The average of the real tokens' vectors (padding left out)
+
+        if self.normalize:
+            output = output / np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+
+        return output.astype(np.float32).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts, running batches on the thread pool."""
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        # Split into model-sized batches
+
+        if len(batches) <= 1:
+            # One batch runs on the calling thread
+            return self._embed_batch(texts) if texts else []
+
+        return [vector for vectors in self._pool.map(self._embed_batch, batches) for vector in vectors]
+        # The batches run side by side and come back in order
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed one query."""
+        return self._embed_batch([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_documents, texts)
+        # On the default executor: embed_documents hands its batches to the model's pool and waits for them
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed one query without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self.embed_query, text)
+        # One batch, so it runs on the model's pool directly
+
+def create_onnx_embeddings() -> OnnxEmbeddings:
+    """Create the local embeddings configured in the environment.
+
+    Raises:
+        FileNotFoundError: If LOCAL_EMBEDDING_MODEL_DIR doesn't hold an ONNX model
+    """
+    model_dir = os.getenv("LOCAL_EMBEDDING_MODEL_DIR", os.path.join(".cache", "onnx_model"))
+    # Where the exported model is
+
+    embeddings = OnnxEmbeddings(
+        model_dir,
+        quantized=os.getenv("LOCAL_EMBEDDING_QUANTIZED", "true").lower() != "false",
+        # Prefer the int8 model
+        pooling=os.getenv("LOCAL_EMBEDDING_POOLING", "mean").lower(),
+        # How the model's token vectors become one vector
+        max_length=int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "256")),
+        # Tokens kept per text
+        workers=int(os.getenv("LOCAL_EMBEDDING_WORKERS", "2")),
+        # Model runs at the same time
+        threads=int(os.getenv("LOCAL_EMBEDDING_THREADS", "0")) or None
+        # Threads per run (0 divides the CPU among the workers)
+    )
+
+    if not os.path.exists(embeddings.model_path):
+        # Nothing has been exported there yet
+        raise FileNotFoundError(f"No ONNX model found in '{model_dir}'. Export one with: "
+                                f"optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 {model_dir}")
+
+    return embeddings
+
+def quantize_model(model_dir: str) -> str:
+    """Write an int8 copy of model.onnx next to it (model_quantized.onnx).
+
+    Args:
+        model_dir (str): The directory holding model.onnx
+
+    Returns:
+        str: The path of the quantized model
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    # Import here so onnxruntime is only needed when this is used
+
+    output = os.path.join(model_dir, "model_quantized.onnx")
+    quantize_dynamic(os.path.join(model_dir, "model.onnx"), output, weight_type=QuantType.QInt8)
+    # Weights stored as 8-bit integers, activations quantized as the model runs
+
+    return output
+
+def embed_jsonl(embeddings: Embeddings, source: str, output: str, batch_size: int = 256) -> int:
+    """Add an embedding ("values") to every {"id", "text", ...} document in a JSONL file.
+
+    Args:
+        embeddings (Embeddings): The model to embed with (the one queries will use)
+        source (str): The JSONL file to read
+        output (str): The JSONL file to write (the input for local_index.py --jsonl)
+        batch_size (int, optional): Documents embedded per call. Defaults to 256.
+
+    Returns:
+        int: The number of documents written
+    """
+    count = 0
+    # How many documents were written
+
+    def flush(batch: List[Dict[str, Any]], out):
+        """Embed a batch of documents and write them."""
+        for record, values in zip(batch, embeddings.embed_documents([record.get("text", "") for record in batch])):
+            record["values"] = values
+            out.write(json.dumps(record) + "\n")
+
+    with open(source, "r", encoding="utf-8") as f, open(output, "w", encoding="utf-8") as out:
+        batch: List[Dict[str, Any]] = []
+
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+
+            if len(batch) >= batch_size:
+                flush(batch, out)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            flush(batch, out)
+            count += len(batch)
+
+    return count
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Quantize the local model, or embed documents with it, and return the exit code."""
+    from dotenv import load_dotenv
+    # Import load_dotenv to read the model settings from the .env file
+
+    load_dotenv()
+    # Load the environment variables
+
+    parser = argparse.ArgumentParser(description="Prepare the local ONNX embedding model used by EMBEDDING_PROVIDER=onnx.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--quantize", action="store_true", help="Write model_quantized.onnx next to model.onnx")
+    action.add_argument("--embed-jsonl", metavar="FILE", help="Embed every {\"id\", \"text\", ...} document in FILE")
+    parser.add_argument("--out", help="Where --embed-jsonl writes the documents with their embeddings")
+    args = parser.parse_args(argv)
+
+    if args.quantize:
+        model_dir = os.getenv("LOCAL_EMBEDDING_MODEL_DIR", os.path.join(".cache", "onnx_model"))
+        print(f"Wrote {quantize_model(model_dir)}")
+        return 0
+
+    if not args.out:
+        parser.error("--embed-jsonl needs --out")
+
+    count = embed_jsonl(create_onnx_embeddings(), args.embed_jsonl, args.out)
+    print(f"Embedded {count} documents into {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import os
+# Import the os module to read the connection pool settings from environment variables
+
+import asyncio
+# Import asyncio to find the event loop the caller is running on
+
+import threading
+# Import threading so two threads can't create a pool for the same loop at once
+
+import weakref
+# Import weakref so a pool is forgotten automatically when its event loop is garbage collected
+
+import httpx
+# Import httpx, the async HTTP library used by the OpenAI and Anthropic SDKs
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+# One shared HTTP client per event loop
+# Connections in an async pool belong to the loop that opened them, so they can't be shared across loops
+
+_lock = threading.Lock()
+# A lock protecting the dictionary above
+
+def get_pool_limits() -> httpx.Limits:
+    """Read the connection pool limits from environment variables.
+
+    Returns:
+        httpx.Limits: The pool limits to use for the shared client
+    """
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        # The most connections open at once, across all providers
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        # How many idle connections are kept open for reuse
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+        # How many seconds an idle connection is kept before it is closed
+    )
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the keep-alive HTTP client shared by every agent on the current event loop.
+
+    Must be called from inside a running event loop.
+
+    Returns:
+        httpx.AsyncClient: The shared client for this loop
+    """
+    loop = asyncio.get_running_loop()
+    # Get the event loop the caller is running on
+
+    with _lock:
+        # Only one thread at a time may create a client
+
+        client = _clients.get(loop)
+        # Look for an existing client for this loop
+
+        if client is None or client.is_closed:
+            # If there isn't one yet (or it was closed), create it
+            client = httpx.AsyncClient(
+                limits=get_pool_limits(),
+                # Use the configured pool limits
+                timeout=httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "600")), connect=10.0)
+                # Generations can take a while, but connecting should be quick
+            )
+
+            _clients[loop] = client
+            # Store the client so every agent on this loop reuses its connections
+
+        return client
+        # Return the shared client
+
+async def close_async_http_client():
+    """Close the shared HTTP client for the current event loop, if there is one."""
+    # Call this before shutting a loop down so open connections are closed cleanly
+
+    with _lock:
+        # Protect the dictionary while we remove the client
+        client = _clients.pop(asyncio.get_running_loop(), None)
+
+    if client is not None:
+        # If there was a client for this loop
+        await client.aclose()
+        # Close its connections
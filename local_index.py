@@ -0,0 +1,415 @@
+import os
+# Import the os module to build file paths and read the index settings from environment variables
+
+import argparse
+# Import argparse to parse the command-line options of the index builder
+
+import json
+# Import json to read and write the index settings
+
+import math
+# Import math to pick a sensible number of clusters
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# Iterable: Anything that can be looped over
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+import numpy as np
+# Import numpy to store the vectors as a memory-mapped float32 matrix and search them with matrix products
+
+from langchain_core.documents import Document
+# Import Document, the same result type the vector store returns
+
+from document_store import DocumentStore, DocumentStoreWriter, read_jsonl_records, read_pinecone_records
+# Import the document sidecar shared by the local indexes, and the readers for the builder's document sources
+
+# Files that make up an index directory:
+#   meta.json         - number of vectors, dimension, metric, number of clusters and the default nprobe
+#   vectors.npy       - the vectors, one float32 row each, grouped by cluster
+#   centroids.npy     - the cluster centres (float32, only when the index has clusters)
+#   list_offsets.npy  - where each cluster's rows start and end in vectors.npy (int64)
+#   docs.jsonl        - the documents, in the same order as the vectors (see document_store.py)
+#   docs_offsets.npy  - where each document starts in docs.jsonl
+#
+# Small indexes are searched exactly: every vector is compared with the query.
+# Large indexes use IVF (an inverted file): the vectors are grouped into clusters with k-means, and a query
+# only scans the nprobe clusters whose centres are closest to it. That trades a little recall for a lot of speed.
+
+CHUNK_ROWS = 65536
+# Rows scored per matrix product, so a search never needs more than a few MB of scratch memory
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale every row to length 1 (all-zero rows are left unchanged)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # The length of each row
+
+    return matrix / np.where(norms > 0, norms, 1)
+
+def _top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the k highest-scoring rows and their scores, in no particular order."""
+    if len(scores) <= k:
+        # Everything fits
+        return rows, scores
+
+    best = np.argpartition(-scores, k - 1)[:k]
+    # The k best positions (faster than sorting everything)
+
+    return rows[best], scores[best]
+
+class LocalVectorIndex:
+    """A read-only, memory-mapped vector index searched with NumPy (exact or IVF)."""
+
+    def __init__(self, directory: str, nprobe: Optional[int] = None):
+        """Open an index directory.
+
+        Args:
+            directory (str): The directory written by build_local_index()
+            nprobe (int, optional): Clusters scanned per query. Defaults to the value stored with the index.
+        """
+        self.directory = directory
+        # Store the directory
+
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            # Read the index settings
+            meta = json.load(f)
+
+        self.count: int = meta["count"]
+        # How many vectors are indexed
+
+        self.dimension: int = meta["dimension"]
+        # The length of each vector
+
+        self.metric: str = meta.get("metric", "cosine")
+        # "cosine" (vectors are stored normalized) or "dotproduct"
+
+        self.nlist: int = meta.get("nlist", 0)
+        # The number of clusters (0 means exact search)
+
+        self.nprobe: int = nprobe or meta.get("nprobe", 8)
+        # How many clusters a query scans
+
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        # The vectors, paged in by the operating system as they are used
+
+        self.centroids = np.load(os.path.join(directory, "centroids.npy")) if self.nlist else None
+        # The cluster centres (small, so loaded fully)
+
+        self.list_offsets = np.load(os.path.join(directory, "list_offsets.npy")) if self.nlist else None
+        # Where each cluster's rows start and end
+
+        self.documents = DocumentStore(directory)
+        # The document text and metadata, read on demand
+
+    def _scan(self, query: np.ndarray, start: int, end: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score rows start..end against the query and keep the k best."""
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        # The best rows found so far
+
+        for chunk_start in range(start, end, CHUNK_ROWS):
+            # Score the rows one chunk at a time
+            chunk_end = min(end, chunk_start + CHUNK_ROWS)
+
+            scores = np.asarray(self.vectors[chunk_start:chunk_end]) @ query
+            # Similarity of every row in the chunk (a dot product; cosine for normalized vectors)
+
+            rows, scores = _top_k(np.arange(chunk_start, chunk_end), scores, k)
+            # The chunk's best rows
+
+            best_rows, best_scores = _top_k(np.concatenate([best_rows, rows]), np.concatenate([best_scores, scores]), k)
+            # Merge them with the best rows so far
+
+        return best_rows, best_scores
+
+    def search(self, vector: Sequence[float], k: int = 5) -> List[Tuple[Document, float]]:
+        """Return the k documents most similar to a query vector.
+
+        Args:
+            vector (Sequence[float]): The query embedding
+            k (int, optional): How many results to return. Defaults to 5.
+
+        Returns:
+            List[Tuple[Document, float]]: (document, similarity) pairs, best first
+
+        Raises:
+            ValueError: If the query has a different dimension from the index
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        # Convert the query to a float32 array
+
+        if query.shape != (self.dimension,):
+            # The query was embedded with a different model
+            raise ValueError(f"Query has dimension {query.size}, but the local index has dimension {self.dimension}")
+
+        if self.metric == "cosine":
+            # The stored vectors are normalized, so normalizing the query turns dot products into cosine similarity
+            query = _normalize_rows(query[None, :])[0]
+
+        if not self.nlist:
+            # Exact search over every vector
+            rows, scores = self._scan(query, 0, self.count, k)
+        else:
+            # IVF search over the closest clusters only
+            probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+            # The clusters whose centres are most similar to the query
+
+            found = [self._scan(query, int(self.list_offsets[c]), int(self.list_offsets[c + 1]), k) for c in probes]
+            # The best rows of each scanned cluster
+
+            rows, scores = _top_k(np.concatenate([r for r, _ in found]), np.concatenate([s for _, s in found]), k)
+            # The best rows overall
+
+        order = np.argsort(-scores)
+        # Best first
+
+        return [(self.documents.get_document(int(rows[i])), float(scores[i])) for i in order]
+        # Read the documents from the sidecar
+
+def _kmeans(sample: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cluster normalized vectors with spherical k-means and return the (normalized) centres."""
+    rng = np.random.default_rng(seed)
+    # A seeded random generator, so rebuilding the same data gives the same index
+
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    # Start from nlist random vectors
+
+    for _ in range(iterations):
+        # Refine the centres a fixed number of times
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        # Assign every vector to its most similar centre
+
+        for c in range(nlist):
+            # Move each centre to the mean of its vectors
+            members = sample[labels == c]
+
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                centroids[c] = sample[rng.integers(len(sample))]
+                # An empty cluster restarts from a random vector
+
+        centroids = _normalize_rows(centroids)
+        # Keep the centres on the unit sphere
+
+    return centroids.astype(np.float32)
+
+def build_local_index(records: Iterable[Dict[str, Any]], directory: str, nlist: Optional[int] = None,
+                      nprobe: int = 8, metric: str = "cosine", sample_size: int = 100000) -> int:
+    """Build an index directory from documents with embeddings.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): Documents as {"id", "text", "values", "metadata"}
+        directory (str): Where to write the index
+        nlist (int, optional): Number of clusters; 0 for exact search.
+            Defaults to 0 below 10,000 vectors and about 4 * sqrt(count) above.
+        nprobe (int, optional): Default number of clusters scanned per query. Defaults to 8.
+        metric (str, optional): "cosine" or "dotproduct" (match the Pinecone index). Defaults to "cosine".
+        sample_size (int, optional): Vectors used to train the clusters. Defaults to 100,000.
+
+    Returns:
+        int: The number of vectors indexed
+
+    Raises:
+        ValueError: If there are no documents, or their embeddings have different lengths
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Create the directory if it doesn't exist
+
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        # Remove the old settings first, so a half-rebuilt index can't be opened
+        os.remove(os.path.join(directory, "meta.json"))
+
+    raw_path = os.path.join(directory, "vectors.raw")
+    # Vectors in arrival order, before they are grouped by cluster
+
+    documents = DocumentStoreWriter(directory, prefix="docs.unsorted")
+    # Documents in arrival order
+
+    dimension = None
+    # The vector length, taken from the first document
+
+    with open(raw_path, "wb") as raw:
+        # Stream everything to disk first, so millions of vectors never have to fit in memory
+        for record in records:
+            # Loop through the documents
+            values = np.asarray(record.get("values") if record.get("values") is not None else [], dtype=np.float32)
+            # This document's embedding
+
+            if dimension is None:
+                dimension = len(values)
+
+            if len(values) != dimension or dimension == 0:
+                # Every document needs an embedding of the same length
+                raise ValueError(f"Document {record.get('id')!r} has an embedding of length {len(values)}, expected {dimension}")
+
+            raw.write(values.tobytes())
+            # Append the vector
+
+            documents.write(record.get("id"), record.get("text", ""), record.get("metadata"))
+            # Append the document
+
+    count = documents.close()
+    # How many documents were written
+
+    if count == 0:
+        # An empty index can't be memory-mapped, and would never match anything anyway
+        raise ValueError("No documents to index")
+
+    raw_vectors = np.memmap(raw_path, dtype=np.float32, mode="r", shape=(count, dimension))
+    # Read the streamed vectors back without loading them
+
+    if nlist is None:
+        # Pick the number of clusters from the size of the index
+        nlist = 0 if count < 10000 else int(4 * math.sqrt(count))
+
+    nlist = min(nlist, count)
+    # Never more clusters than vectors
+
+    def prepared(start: int, end: int) -> np.ndarray:
+        """Return rows start..end ready to store (normalized for cosine similarity)."""
+        rows = np.asarray(raw_vectors[start:end])
+        return _normalize_rows(rows) if metric == "cosine" else rows
+
+    if nlist:
+        # Train the clusters on a random sample, then assign every vector to its closest centre
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, min(count, sample_size), replace=False))
+        # A sorted sample reads the file front to back
+
+        sample = _normalize_rows(np.asarray(raw_vectors[sample_rows]))
+        # The training sample (clusters are found by direction, whatever the metric)
+
+        centroids = _kmeans(sample, nlist)
+        # The cluster centres
+
+        labels = np.concatenate([np.argmax(prepared(start, min(count, start + CHUNK_ROWS)) @ centroids.T, axis=1)
+                                 for start in range(0, count, CHUNK_ROWS)])
+        # The cluster of every vector, computed one chunk at a time
+
+        order = np.argsort(labels, kind="stable")
+        # Rows grouped by cluster
+
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+        # Where each cluster's rows start and end
+
+        np.save(os.path.join(directory, "centroids.npy"), centroids)
+        np.save(os.path.join(directory, "list_offsets.npy"), list_offsets)
+    else:
+        # Exact search keeps the arrival order
+        order = np.arange(count)
+
+    vectors = np.lib.format.open_memmap(os.path.join(directory, "vectors.npy"), mode="w+",
+                                        dtype=np.float32, shape=(count, dimension))
+    # The final vector file, written in place
+
+    for start in range(0, count, CHUNK_ROWS):
+        # Copy the vectors into cluster order, one chunk at a time
+        chunk = np.asarray(raw_vectors[order[start:start + CHUNK_ROWS]])
+        # The next rows in cluster order
+
+        vectors[start:start + len(chunk)] = _normalize_rows(chunk) if metric == "cosine" else chunk
+        # Store them (normalized for cosine similarity)
+
+    vectors.flush()
+    del vectors, raw_vectors
+    # Finish writing and release the files
+
+    unsorted = DocumentStore(directory, prefix="docs.unsorted")
+    sorted_documents = DocumentStoreWriter(directory)
+    # Rewrite the documents in the same order as the vectors
+
+    for row in order:
+        record = unsorted.get_record(int(row))
+        sorted_documents.write(record.get("id"), record.get("text", ""), record.get("metadata"))
+
+    sorted_documents.close()
+    unsorted.close()
+
+    for name in ("vectors.raw", "docs.unsorted.jsonl", "docs.unsorted_offsets.npy"):
+        # Remove the temporary files
+        os.remove(os.path.join(directory, name))
+
+    if not nlist:
+        for name in ("centroids.npy", "list_offsets.npy"):
+            # Remove cluster files left over from an earlier IVF build
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        # Save the settings last, so a half-written index can't be opened
+        json.dump({"count": count, "dimension": dimension, "metric": metric, "nlist": nlist, "nprobe": nprobe}, f)
+
+    return count
+
+def synthetic_records(count: int, dimension: int, seed: int = 0) -> Iterable[Dict[str, Any]]:
+    """Generate random documents for load tests (clustered, so IVF behaves as it would on real data).
+
+    Args:
+        count (int): How many documents to generate
+        dimension (int): The embedding length
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        Iterable[Dict[str, Any]]: {"id", "text", "values", "metadata"} records
+    """
+    rng = np.random.default_rng(seed)
+    # A seeded random generator, so every run builds the same index
+
+    topics = rng.standard_normal((256, dimension)).astype(np.float32)
+    # Topic centres the documents are scattered around
+
+    for start in range(0, count, 1024):
+        # Generate the vectors in blocks (much faster than one at a time)
+        size = min(1024, count - start)
+        block = topics[rng.integers(len(topics), size=size)] + 0.5 * rng.standard_normal((size, dimension)).astype(np.float32)
+
+        for offset, values in enumerate(block):
+            number = start + offset
+            yield {"id": f"doc-{number}", "text": f"Synthetic document {number}", "values": values,
+                   "metadata": {"title": f"Document {number}"}}
+
+def main():
+    """Build a local vector index from Pinecone, a JSONL file, or random data."""
+    from dotenv import load_dotenv
+    # Import load_dotenv to read the Pinecone settings from the .env file
+
+    load_dotenv()
+    # Load the environment variables
+
+    parser = argparse.ArgumentParser(description="Build the local vector index used by RETRIEVAL_BACKEND=local.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--jsonl", help="Build from a JSONL file with one {\"id\", \"text\", \"values\", ...} document per line")
+    source.add_argument("--pinecone-index", default=os.getenv("PINECONE_INDEX_NAME", "pydanticai"),
+                        help="Copy every document and embedding from this Pinecone index (default: PINECONE_INDEX_NAME)")
+    source.add_argument("--synthetic", type=int, metavar="COUNT", help="Generate COUNT random documents (for load tests)")
+    parser.add_argument("--dimension", type=int, default=1536, help="Embedding length for --synthetic (default: 1536)")
+    parser.add_argument("--namespace", default="", help="Pinecone namespace to read (default: the default namespace)")
+    parser.add_argument("--nlist", type=int, help="Number of IVF clusters; 0 for exact search (default: automatic)")
+    parser.add_argument("--nprobe", type=int, default=8, help="Clusters scanned per query (default: 8)")
+    parser.add_argument("--metric", choices=["cosine", "dotproduct"], default="cosine",
+                        help="Similarity metric; match your Pinecone index (default: cosine)")
+    parser.add_argument("--out", default=os.getenv("LOCAL_INDEX_DIR") or ".cache/local_index",
+                        help="Where to write the index (default: LOCAL_INDEX_DIR or .cache/local_index)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        records = synthetic_records(args.synthetic, args.dimension)
+    elif args.jsonl:
+        records = read_jsonl_records(args.jsonl)
+    else:
+        records = read_pinecone_records(args.pinecone_index, args.namespace)
+    # Pick the document source
+
+    count = build_local_index(records, args.out, nlist=args.nlist, nprobe=args.nprobe, metric=args.metric)
+    # Build the index
+
+    print(f"Indexed {count} vectors into {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import os
+# Import the os module to read the metrics port from environment variables
+
+import threading
+# Import threading to protect the metric values and to run the metrics server in the background
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# Import the standard library HTTP server, so exporting metrics needs no extra dependency
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Dict: A dictionary with keys and values of specific types
+# Iterable: Anything that can be looped over
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+# Prometheus-style counters and histograms, rendered in the Prometheus text format
+# Set METRICS_PORT to serve them at http://<host>:<port>/metrics for Prometheus to scrape
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Histogram bucket bounds in seconds, from a cached embedding (a few ms) to a long LLM answer
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """Format labels as {name="value",...} (empty when there are none)."""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+
+    if extra is not None:
+        # An extra label, like a histogram's "le"
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    """Format a number the way Prometheus expects."""
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    """A value that only goes up (for example, tokens used), one per combination of labels."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        """Initialize the counter.
+
+        Args:
+            name (str): The metric name
+            help_text (str): What the metric measures
+            labelnames (Sequence[str], optional): The label names. Defaults to none.
+        """
+        self.name = name
+        # Store the metric name
+
+        self.help_text = help_text
+        # Store the description
+
+        self.labelnames = tuple(labelnames)
+        # Store the label names
+
+        self._values: Dict[Tuple[str, ...], float] = {}
+        # The value for each combination of label values
+
+        self._lock = threading.Lock()
+        # A lock, because every session and the event loop update metrics
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        """Add to the counter.
+
+        Args:
+            amount (float, optional): How much to add. Defaults to 1.
+            **labels: A value for every label name
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        # The label values, in label name order
+
+        with self._lock:
+            # Protect the values while we change them
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        """Return the counter in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+
+        with self._lock:
+            # Copy the values while holding the lock
+            items = sorted(self._values.items())
+
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+
+        return lines
+
+class Histogram:
+    """Counts observations (for example, latencies) into buckets, one set per combination of labels."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Initialize the histogram.
+
+        Args:
+            name (str): The metric name
+            help_text (str): What the metric measures
+            labelnames (Sequence[str], optional): The label names. Defaults to none.
+            buckets (Sequence[float], optional): Bucket upper bounds. Defaults to DEFAULT_BUCKETS.
+        """
+        self.name = name
+        # Store the metric name
+
+        self.help_text = help_text
+        # Store the description
+
+        self.labelnames = tuple(labelnames)
+        # Store the label names
+
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Store the bucket bounds, ending with +Inf (which counts everything)
+
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+        # (count per bucket, sum of observations) for each combination of label values
+
+        self._lock = threading.Lock()
+        # A lock, because every session and the event loop update metrics
+
+    def observe(self, value: float, **labels: str):
+        """Record an observation.
+
+        Args:
+            value (float): The observed value (seconds, for latencies)
+            **labels: A value for every label name
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        # The label values, in label name order
+
+        with self._lock:
+            # Protect the values while we change them
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+
+            for index, bound in enumerate(self.buckets):
+                # Buckets are cumulative: an observation counts in every bucket it fits under
+                if value <= bound:
+                    counts[index] += 1
+
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        """Return the histogram in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            # Copy the values while holding the lock
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_number(bound)))} {count}")
+
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}")
+
+        return lines
+
+class Registry:
+    """The set of metrics a process exports."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics: Dict[str, object] = {}
+        # Metrics by name, in the order they were registered
+
+        self._lock = threading.Lock()
+        # A lock so two modules can't register the same name at once
+
+    def _register(self, metric):
+        """Add a metric, or return the one already registered under its name."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Return the counter with this name, creating it on first use."""
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Return the histogram with this name, creating it on first use."""
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render_prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            # Copy the list while holding the lock
+            metrics: Iterable = list(self._metrics.values())
+
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+registry = Registry()
+# The single, process-wide registry
+# Because Python caches imported modules, it is shared by every rerun and every session
+
+STAGE_SECONDS = registry.histogram(
+    "rag_stage_duration_seconds", "Time spent in each stage of the query pipeline.", ["stage"])
+# Filled by tracing.span (embed, search, fusion, rerank, format_context, generate, first_token)
+
+PROVIDER_CALL_SECONDS = registry.histogram(
+    "rag_provider_call_duration_seconds", "Time spent in each LLM provider API call.", ["provider", "model", "outcome"])
+# Filled by tracing.provider_call, which every agent wraps its API call in
+
+PROVIDER_CALLS = registry.counter(
+    "rag_provider_calls_total", "LLM provider API calls.", ["provider", "model", "outcome"])
+# outcome is "ok", "error" or "cancelled", so error rates can be alerted on
+
+PROVIDER_TOKENS = registry.counter(
+    "rag_provider_tokens_total", "Tokens used per LLM provider.", ["provider", "model", "kind"])
+# kind is "prompt" or "completion"
+
+CONTEXT_TOKENS_SAVED = registry.counter(
+    "rag_context_tokens_saved_total", "Context tokens removed by the context packer (duplicates and trimming).",
+    ["provider"])
+# Filled by BaseAgent.format_context; provider is whose tokenizer counted them
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves GET /metrics."""
+
+    def do_GET(self):
+        """Answer a scrape."""
+        if self.path.split("?")[0] != "/metrics":
+            # Only /metrics exists
+            self.send_error(404)
+            return
+
+        body = registry.render_prometheus().encode("utf-8")
+        # Render every metric
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Don't print a line for every scrape."""
+        pass
+
+_server: Optional[ThreadingHTTPServer] = None
+# The running metrics server, if any
+
+_server_lock = threading.Lock()
+# A lock so Streamlit reruns can't start two servers
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on a background thread (only once per process).
+
+    Args:
+        port (int, optional): The port to listen on. Defaults to the METRICS_PORT environment variable.
+
+    Returns:
+        Optional[ThreadingHTTPServer]: The server, or None if no port is configured
+    """
+    global _server
+
+    if port is None:
+        # Read the port from the environment
+        port = int(os.getenv("METRICS_PORT", "0") or 0)
+
+    if not port:
+        # Metrics export is turned off
+        return None
+
+    with _server_lock:
+        # Only start one server, however many times app.py reruns
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            # Listen on every interface
+
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            # Serve scrapes without blocking the app
+
+            print(f"DEBUG - Serving Prometheus metrics on port {port}")
+
+        return _server
@@ -1,16 +1,22 @@
-from typing import List, Dict, Any
+from typing import List, Dict, AsyncIterator
 # Import typing hints to specify the expected types of variables and function parameters/returns
 # List: A list of items of a specific type
 # Dict: A dictionary with keys and values of specific types
-# Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
 
 from openai import AsyncOpenAI
 # Import the AsyncOpenAI client from the openai package
 # This is the asynchronous version of the OpenAI client, which allows for non-blocking API calls
 
-from base_agent import BaseAgent
+from base_agent import BaseAgent, StreamInterruptedError
 # Import the BaseAgent abstract base class that defines the common interface for all agents
 
+from context_packer import count_tokens
+# Import the token counter, used for streamed answers (which don't report their usage)
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
 class OpenAIAgent(BaseAgent):
     """Agent for generating answers using OpenAI's GPT models."""
     # This class implements the BaseAgent interface for OpenAI's GPT models
@@ -33,16 +39,102 @@ class OpenAIAgent(BaseAgent):
         self.model_name = model_name
         # Store the model name as an instance variable
         
-        self.client = AsyncOpenAI(api_key=api_key)
-        # Create an AsyncOpenAI client with the provided API key
-        # This client will be used to make API calls to OpenAI
+        # The AsyncOpenAI client is created on first use by _get_client (see BaseAgent)
+        # so it can share the event loop's keep-alive connection pool
+
+    def _create_client(self, http_client) -> AsyncOpenAI:
+        """Create an AsyncOpenAI client on top of the shared HTTP client.
+        
+        Args:
+            http_client (httpx.AsyncClient): The shared keep-alive HTTP client for the current loop
+            
+        Returns:
+            AsyncOpenAI: The client used to make API calls to OpenAI
+        """
+        return AsyncOpenAI(api_key=self.api_key, http_client=http_client, max_retries=0)
+        # Create an AsyncOpenAI client with the API key that sends its requests through the shared pool
+        # The SDK's own retries are turned off; the rate limiter retries instead (see _rate_limiter)
+
+    def _build_messages(self, query: str, context: str) -> List[Dict[str, str]]:
+        """Build the chat messages sent to OpenAI.
+        
+        Args:
+            query (str): The user's question
+            context (str): The formatted retrieved information
+            
+        Returns:
+            List[Dict[str, str]]: The system and user messages
+        """
+        # Shared by generate_answer and stream_answer so both send exactly the same prompt
+        
+        return [
+            # Provide a list of messages that define the conversation
+            {
+                "role": "system",
+                # The system message sets the behavior of the assistant
+                "content": "You are a helpful assistant that provides comprehensive answers based on the retrieved information. Cite your sources when appropriate."
+                # This content tells the model to act as a helpful assistant and cite sources
+            },
+            {
+                "role": "user",
+                # The user message contains the user's question and the context
+                "content": f"Based on the following information, please provide a comprehensive answer to this question: '{query}'\n\nRetrieved Information:\n{context}"
+                # This content includes the user's question and the formatted context
+            }
+        ]
 
-    async def generate_answer(self, query: str, results: List[Dict[str, Any]]) -> str:
+    async def request_answer(self, query: str, results: List[RetrievedChunk]) -> str:
+        """Generate an answer using OpenAI, raising an exception if the API call fails.
+        
+        Args:
+            query (str): The user's question
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
+            
+        Returns:
+            str: The generated answer
+        """
+        # Callers that need to know about failures (like the provider router) use this method
+        # generate_answer below wraps it and turns failures into the fallback message
+        
+        context = self.format_context(results)
+        # Format the retrieved results into a context string using the method from BaseAgent
+        
+        messages = self._build_messages(query, context)
+        # Build the conversation
+        
+        with self._provider_call() as call:
+            # Time the API call and export it as a metric
+            response = await self._rate_limiter().call(
+                lambda: self._get_client().chat.completions.create(
+                    # Make an asynchronous API call to create a chat completion
+                    model=self.model_name,
+                    # Specify which model to use (e.g., "gpt-4")
+                    messages=messages,
+                    # Provide the list of messages that define the conversation
+                    max_tokens=self.max_output_tokens
+                    # Limit the answer length, so the rate limiter's token estimate holds
+                ),
+                tokens=self._estimate_tokens("".join(message["content"] for message in messages)),
+                # Wait for request and token budget, and retry 429s with backoff (see rate_limiter.py)
+                usage=lambda response: response.usage.total_tokens if response.usage else None
+                # Correct the token budget with what the call really used
+            )
+            # The API call returns a response object with the generated completion
+            
+            if response.usage:
+                # Record the tokens OpenAI says the call used
+                call.record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        
+        return response.choices[0].message.content
+        # Extract the content of the first (and only) message in the response and return it
+        # This is the actual answer generated by the model
+
+    async def generate_answer(self, query: str, results: List[RetrievedChunk]) -> str:
         """Generate a comprehensive answer from retrieved results using OpenAI.
         
         Args:
             query (str): The user's question
-            results (List[Dict[str, Any]]): Retrieved results from Pinecone
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
             
         Returns:
             str: The generated answer
@@ -51,41 +143,93 @@ class OpenAIAgent(BaseAgent):
         # This method generates an answer to the user's question based on the retrieved results
         # It's marked as async, which means it's an asynchronous method that can be awaited
         
+        try:
+            # Try to generate an answer using the OpenAI API
+            return await self.request_answer(query, results)
+            
+        except Exception as e:
+            # If there's an error during the API call
+            print(f"Error generating answer with OpenAI: {e}")
+            # Print the error message for debugging
+            
+            return self.FALLBACK_ANSWER
+            # Return a fallback message to the user
+
+    async def stream_answer(self, query: str, results: List[RetrievedChunk]) -> AsyncIterator[str]:
+        """Stream an answer from retrieved results using OpenAI, one text delta at a time.
+        
+        Args:
+            query (str): The user's question
+            results (List[RetrievedChunk]): Retrieved results from Pinecone
+            
+        Yields:
+            str: The next piece of the generated answer
+        """
+        # Same request as generate_answer, but with stream=True
+        # OpenAI then sends the answer in small chunks as it is generated
+        
         context = self.format_context(results)
         # Format the retrieved results into a context string using the method from BaseAgent
         
+        sent = False
+        # Whether any text has reached the caller yet
+        
         try:
-            # Try to generate an answer using the OpenAI API
-            response = await self.client.chat.completions.create(
-                # Make an asynchronous API call to create a chat completion
-                model=self.model_name,
-                # Specify which model to use (e.g., "gpt-4")
-                messages=[
-                    # Provide a list of messages that define the conversation
-                    {
-                        "role": "system",
-                        # The system message sets the behavior of the assistant
-                        "content": "You are a helpful assistant that provides comprehensive answers based on the retrieved information. Cite your sources when appropriate."
-                        # This content tells the model to act as a helpful assistant and cite sources
-                    },
-                    {
-                        "role": "user",
-                        # The user message contains the user's question and the context
-                        "content": f"Based on the following information, please provide a comprehensive answer to this question: '{query}'\n\nRetrieved Information:\n{context}"
-                        # This content includes the user's question and the formatted context
-                    }
-                ]
-            )
-            # The API call returns a response object with the generated completion
+            # Try to stream an answer using the OpenAI API
+            messages = self._build_messages(query, context)
+            # Build the conversation once, so its size can be counted afterwards
             
-            return response.choices[0].message.content
-            # Extract the content of the first (and only) message in the response and return it
-            # This is the actual answer generated by the model
+            prompt_tokens = count_tokens("".join(message["content"] for message in messages), "openai", self.model_name)
+            # The prompt's size
+            
+            with self._provider_call() as call:
+                # Time the API call and export it as a metric
+                stream = await self._rate_limiter().call(
+                    lambda: self._get_client().chat.completions.create(
+                        model=self.model_name,
+                        # Specify which model to use (e.g., "gpt-4")
+                        messages=messages,
+                        # Provide the list of messages that define the conversation
+                        max_tokens=self.max_output_tokens,
+                        # Limit the answer length, so the rate limiter's token estimate holds
+                        stream=True
+                        # Ask OpenAI to send the answer in chunks as it is generated
+                    ),
+                    tokens=prompt_tokens + self.max_output_tokens
+                    # Wait for budget; a 429 when opening the stream is retried before any text is sent
+                )
+                
+                pieces = []
+                # The text received so far, used to count completion tokens
+                
+                async for chunk in stream:
+                    # Loop over the chunks as they arrive
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        # Some chunks (like the final one) carry no text
+                        pieces.append(chunk.choices[0].delta.content)
+                        # Remember the text for the token count
+                        
+                        sent = True
+                        yield chunk.choices[0].delta.content
+                        # Pass the new text on to the caller straight away
+                
+                completion_tokens = count_tokens("".join(pieces), "openai", self.model_name)
+                # Streamed responses don't report usage, so count the tokens ourselves (exact when tiktoken is installed)
+                
+                self._rate_limiter().settle(prompt_tokens + self.max_output_tokens, prompt_tokens + completion_tokens)
+                # Return the part of the answer budget that wasn't used
+                
+                call.record_usage(prompt_tokens, completion_tokens)
+                # Record the tokens the call used
             
         except Exception as e:
             # If there's an error during the API call
-            print(f"Error generating answer with OpenAI: {e}")
+            print(f"Error streaming answer with OpenAI: {e}")
             # Print the error message for debugging
             
-            return "I couldn't generate an answer based on the retrieved information."
-            # Return a fallback message to the user 
\ No newline at end of file
+            if sent:
+                # Part of the answer is already out: appending the fallback message would pass as the answer's end
+                raise StreamInterruptedError(f"OpenAI stream failed after part of the answer was sent: {e}") from e
+            
+            yield self.FALLBACK_ANSWER
+            # Nothing was sent yet, so send a fallback message to the user
@@ -0,0 +1,375 @@
+import os
+# Import the os module to read the routing settings from environment variables
+
+import asyncio
+# Import asyncio to run a primary and a hedged request at the same time and cancel the loser
+
+import threading
+# Import threading so the statistics can be read from Streamlit threads while the loop updates them
+
+import time
+# Import time to measure how long each provider takes
+
+from collections import deque
+# Import deque, a list with a maximum length that drops its oldest items (a rolling window)
+
+from typing import Dict, List, Optional, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+
+from agent_factory import AgentFactory, shared_agent_factory
+# Import the AgentFactory class, which hands out pooled agents for each provider, and its shared instance
+
+from base_agent import BaseAgent
+# Import the BaseAgent class for its FALLBACK_ANSWER message
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
+class ProviderStats:
+    """Rolling latency and error statistics for one provider."""
+    # We only keep the most recent calls, so the numbers follow the provider's current health
+
+    def __init__(self, window: int = 50):
+        """Initialize empty statistics.
+
+        Args:
+            window (int, optional): How many recent calls to remember. Defaults to 50.
+        """
+        self.latencies: deque = deque(maxlen=window)
+        # Seconds taken by recent successful calls
+
+        self.outcomes: deque = deque(maxlen=window)
+        # True for each recent success, False for each recent failure
+
+        self._lock = threading.Lock()
+        # A lock so the UI can read the numbers while the loop updates them
+
+    def record_success(self, latency: float):
+        """Record a successful call and how long it took."""
+        with self._lock:
+            # Protect the windows while we change them
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+
+    def record_failure(self):
+        """Record a failed call."""
+        with self._lock:
+            # Protect the window while we change it
+            self.outcomes.append(False)
+
+    def samples(self) -> int:
+        """Return how many recent calls we know about."""
+        with self._lock:
+            return len(self.outcomes)
+
+    def error_rate(self) -> float:
+        """Return the share of recent calls that failed (0.0 when there is no data)."""
+        with self._lock:
+            # Protect the window while we read it
+            if not self.outcomes:
+                # No calls yet
+                return 0.0
+
+            return self.outcomes.count(False) / len(self.outcomes)
+            # Failures divided by all calls
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Return the p-th percentile of recent latencies, or None when there is no data.
+
+        Args:
+            p (float): The percentile, between 0 and 100
+
+        Returns:
+            Optional[float]: The latency in seconds
+        """
+        with self._lock:
+            # Protect the window while we copy it
+            latencies = sorted(self.latencies)
+
+        if not latencies:
+            # No successful calls yet
+            return None
+
+        index = min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))
+        # The position of the percentile in the sorted list (nearest rank)
+
+        return latencies[index]
+
+class ProviderRouter:
+    """Routes a generation to the healthiest provider, with hedged requests and failover."""
+    # How a query is routed:
+    #   1. Providers are ordered: the preferred one first (unless it is mostly failing), then the others
+    #      by error rate and typical latency.
+    #   2. The first provider is called. If it hasn't answered after its usual p95 latency, a hedged
+    #      request is sent to the next provider. Whichever answers first wins and the other is cancelled.
+    #   3. If a provider fails, the next one is tried straight away.
+    # This keeps the slowest answers bounded when one provider is having an incident.
+
+    def __init__(self, factory: AgentFactory, hedge: bool = True, window: int = 50,
+                 min_samples: int = 5, default_hedge_delay: float = 10.0, min_hedge_delay: float = 1.0,
+                 max_hedge_delay: float = 30.0, max_error_rate: float = 0.5):
+        """Initialize the router.
+
+        Args:
+            factory (AgentFactory): The factory that hands out pooled agents
+            hedge (bool, optional): Whether to send hedged requests at all. Defaults to True.
+            window (int, optional): How many recent calls per provider to remember. Defaults to 50.
+            min_samples (int, optional): Calls needed before the statistics are trusted. Defaults to 5.
+            default_hedge_delay (float, optional): Hedge delay in seconds while statistics are missing. Defaults to 10.0.
+            min_hedge_delay (float, optional): Shortest hedge delay in seconds. Defaults to 1.0.
+            max_hedge_delay (float, optional): Longest hedge delay in seconds. Defaults to 30.0.
+            max_error_rate (float, optional): Error rate above which the preferred provider is demoted. Defaults to 0.5.
+        """
+        self.factory = factory
+        # Store the agent factory
+
+        self.hedge = hedge
+        # Store whether hedging is enabled
+
+        self.window = window
+        # Store the window size for new statistics
+
+        self.min_samples = min_samples
+        # Store the minimum number of samples
+
+        self.default_hedge_delay = default_hedge_delay
+        # Store the default hedge delay
+
+        self.min_hedge_delay = min_hedge_delay
+        # Store the shortest hedge delay
+
+        self.max_hedge_delay = max_hedge_delay
+        # Store the longest hedge delay
+
+        self.max_error_rate = max_error_rate
+        # Store the error rate threshold
+
+        self.stats: Dict[str, ProviderStats] = {}
+        # Statistics per agent type
+
+        self._lock = threading.Lock()
+        # A lock protecting the dictionary above
+
+    def get_stats(self, agent_type: str) -> ProviderStats:
+        """Return the statistics for an agent type, creating them on first use."""
+        with self._lock:
+            # Protect the dictionary while we check and fill it
+            if agent_type not in self.stats:
+                self.stats[agent_type] = ProviderStats(self.window)
+
+            return self.stats[agent_type]
+
+    def _is_healthy(self, agent_type: str) -> bool:
+        """Return False if a provider has been failing most of the time recently."""
+        stats = self.get_stats(agent_type)
+        # Get the provider's statistics
+
+        return stats.samples() < self.min_samples or stats.error_rate() <= self.max_error_rate
+        # Without enough data we assume the provider is fine
+
+    def rank(self, preferred: str, candidates: List[str]) -> List[str]:
+        """Order the providers to try for a query.
+
+        Args:
+            preferred (str): The agent type the user chose
+            candidates (List[str]): Every agent type that may be used
+
+        Returns:
+            List[str]: The agent types in the order they should be tried
+        """
+        others = [agent_type for agent_type in candidates if agent_type != preferred]
+        # Every provider except the preferred one
+
+        others.sort(key=lambda agent_type: (
+            self.get_stats(agent_type).error_rate(),
+            # Fewer errors first
+            self.get_stats(agent_type).percentile(50) or self.default_hedge_delay
+            # Then faster providers first (unknown ones count as average)
+        ))
+
+        if preferred not in candidates:
+            # The preferred provider isn't available
+            return others
+
+        if self._is_healthy(preferred):
+            # The preferred provider goes first
+            return [preferred] + others
+
+        healthy = [agent_type for agent_type in others if self._is_healthy(agent_type)]
+        # The other providers that are currently working
+
+        unhealthy = [agent_type for agent_type in others if not self._is_healthy(agent_type)]
+        # The other providers that are failing as well
+
+        return healthy + [preferred] + unhealthy
+        # Try working providers first, but keep the preferred one ahead of other failing ones
+
+    def hedge_delay(self, agent_type: str) -> float:
+        """Return how long to wait for a provider before sending a hedged request.
+
+        Args:
+            agent_type (str): The agent type being waited on
+
+        Returns:
+            float: The delay in seconds
+        """
+        stats = self.get_stats(agent_type)
+        # Get the provider's statistics
+
+        p95 = stats.percentile(95)
+        # 95% of recent calls finished within this time
+
+        if p95 is None or len(stats.latencies) < self.min_samples:
+            # Not enough data yet
+            return self.default_hedge_delay
+
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, p95))
+        # Hedge once the call is slower than 95% of recent calls, within sensible limits
+
+    async def _call(self, agent_type: str, agent: BaseAgent, query: str,
+                    results: List[RetrievedChunk]) -> Tuple[str, str]:
+        """Call one provider and record how it went."""
+        stats = self.get_stats(agent_type)
+        # Get the provider's statistics
+
+        start = time.perf_counter()
+        # Note when the call started
+
+        try:
+            answer = await agent.request_answer(query, results)
+            # Generate the answer, raising on failure
+        except asyncio.CancelledError:
+            # We cancelled this call because another provider won; that says nothing about its health
+            raise
+        except Exception:
+            # The provider failed
+            stats.record_failure()
+            raise
+
+        stats.record_success(time.perf_counter() - start)
+        # Record the latency of the successful call
+
+        return answer, agent_type
+        # Return the answer and which provider produced it
+
+    async def generate_answer(self, query: str, results: List[RetrievedChunk], preferred: str,
+                              api_keys: Dict[str, str]) -> Tuple[str, str]:
+        """Generate an answer, hedging and failing over between providers.
+
+        Args:
+            query (str): The user's question
+            results (List[RetrievedChunk]): Retrieved results to base the answer on
+            preferred (str): The agent type the user chose
+            api_keys (Dict[str, str]): API key per agent type; providers without a key are skipped
+
+        Returns:
+            Tuple[str, str]: The answer and the agent type that produced it
+            (BaseAgent.FALLBACK_ANSWER and the preferred type if every provider failed)
+        """
+        candidates = [agent_type for agent_type in self.factory.agent_map if api_keys.get(agent_type)]
+        # Only providers we have an API key for can be used
+
+        queue = self.rank(preferred, candidates)
+        # The providers to try, in order
+
+        running: Dict[asyncio.Task, str] = {}
+        # The calls in flight, mapped to their agent type
+
+        def start_next():
+            """Start a call to the next provider in the queue."""
+            agent_type = queue.pop(0)
+            # Take the next provider
+
+            agent = self.factory.get_agent(agent_type, api_keys[agent_type])
+            # Get a pooled agent for it
+
+            task = asyncio.create_task(self._call(agent_type, agent, query, results))
+            # Start the call without waiting for it
+
+            running[task] = agent_type
+            # Remember the call
+
+        hedged = False
+        # We send at most one hedged request per query
+
+        if queue:
+            # Start with the best provider
+            start_next()
+
+        try:
+            while running:
+                # Wait until we have an answer or every call has failed
+                primary = next(iter(running.values()))
+                # The oldest call still in flight
+
+                timeout = self.hedge_delay(primary) if self.hedge and not hedged and queue else None
+                # Only hedge once per query, and only if there is another provider left to try
+
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                # Wait for the first call to finish, or for the hedge delay to pass
+
+                if not done:
+                    # The call is slower than usual, so send a hedged request to the next provider
+                    print(f"DEBUG - Hedging {primary} with {queue[0]}")
+                    start_next()
+                    hedged = True
+                    continue
+
+                for task in done:
+                    # Look at every call that finished
+                    agent_type = running.pop(task)
+                    # Forget it
+
+                    if task.exception() is None:
+                        # This call succeeded, so it wins
+                        return task.result()
+
+                    print(f"DEBUG - {agent_type} failed: {task.exception()}")
+                    # Print the error message for debugging
+
+                if not running and queue:
+                    # Everything in flight failed, so fail over to the next provider
+                    start_next()
+
+            return BaseAgent.FALLBACK_ANSWER, preferred
+            # Every provider failed
+        finally:
+            for task in running:
+                # Cancel the calls that lost the race (or are still running if we were cancelled)
+                task.cancel()
+
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+                # Wait for them to finish cancelling, so their HTTP streams are closed before we return
+                # and their exceptions are retrieved (no "Task was destroyed but it is pending" warnings)
+
+def create_router(factory: AgentFactory) -> ProviderRouter:
+    """Create a router configured from environment variables.
+
+    Args:
+        factory (AgentFactory): The factory that hands out pooled agents
+
+    Returns:
+        ProviderRouter: The configured router
+    """
+    return ProviderRouter(
+        factory,
+        hedge=os.getenv("ROUTER_HEDGE", "true").lower() == "true",
+        # Whether to send hedged requests
+        default_hedge_delay=float(os.getenv("ROUTER_DEFAULT_HEDGE_DELAY", "10")),
+        # Hedge delay while there isn't enough data yet
+        min_hedge_delay=float(os.getenv("ROUTER_MIN_HEDGE_DELAY", "1")),
+        # Shortest hedge delay
+        max_hedge_delay=float(os.getenv("ROUTER_MAX_HEDGE_DELAY", "30")),
+        # Longest hedge delay
+        max_error_rate=float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+        # Error rate above which the preferred provider is demoted
+    )
+
+provider_router = create_router(shared_agent_factory)
+# The single, process-wide router that app.py uses
+# Because Python caches imported modules, its statistics are shared by every rerun and every session
@@ -0,0 +1,325 @@
+import os
+# Import the os module to read which metadata fields to keep from environment variables
+
+from typing import Any, AsyncIterator, Callable, List, Optional, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
+# Callable: A function
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+from langchain_core.documents import Document
+# Import Document, the result type every backend returns
+
+from base_agent import BaseAgent
+# Import the BaseAgent class, the interface every answering agent implements
+
+from bm25_index import reciprocal_rank_fusion, search_in_background
+# Import the parallel keyword search and the fusion step used for hybrid search
+
+from embedding_cache import normalize_query
+# Import the query normalization shared with the embedding cache, so coalesced queries match the same way
+
+from reranker import FETCH_K, DynamicTopK, Reranker, reranker as default_reranker, top_k_selector as default_top_k
+# Import the process-wide reranker, how many candidates to fetch for it and the dynamic top-k selector
+
+from retrieval_backend import RetrievalBackend
+# Import the search interface shared by Pinecone and the local index
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type passed from retrieval to the agents
+
+from retrieval_cache import RetrievalCache, retrieval_cache as default_retrieval_cache, vector_hash
+# Import the process-wide search result cache, and the helper that identifies a query vector
+
+from semantic_cache import result_ids
+# Import the helper that identifies a set of results (used by the answer cache)
+
+from single_flight import SingleFlight, single_flight as default_single_flight
+# Import the process-wide table of calls in flight, so identical concurrent queries share one call
+
+from tracing import Trace, span, use_trace
+# Import the per-query stage timings
+
+METADATA_FIELDS: Optional[Tuple[str, ...]] = (
+    None if os.getenv("RESULT_METADATA_FIELDS", "").strip() == "*" else
+    tuple(dict.fromkeys(["id", "title", "description"] +
+                        [field.strip() for field in os.getenv("RESULT_METADATA_FIELDS", "").split(",") if field.strip()]))
+)
+# The metadata fields kept in each result: what the prompt shows (title, description), the id the answer cache uses,
+# and any extra fields listed in RESULT_METADATA_FIELDS ("*" keeps everything, as before)
+# Indexes often carry large metadata (raw HTML, embeddings of other fields, long URL lists) that nothing reads
+
+class Retrieval:
+    """What retrieval produced for one query."""
+
+    def __init__(self, query: str, query_vector: List[float], results: List[RetrievedChunk]):
+        """Store the retrieval output.
+
+        Args:
+            query (str): The user's question
+            query_vector (List[float]): Its embedding (also used by the answer cache)
+            results (List[RetrievedChunk]): The processed results passed to the agents
+        """
+        self.query = query
+        # Store the question
+
+        self.query_vector = query_vector
+        # Store the embedding
+
+        self.results = results
+        # Store the processed results
+
+        self.doc_ids = result_ids(results)
+        # Identify the retrieved documents, so cached answers are only reused for the same information
+
+def trim_metadata(search_results: Sequence[Tuple[Any, float]],
+                  fields: Optional[Sequence[str]]) -> List[Tuple[Any, float]]:
+    """Keep only some metadata fields in (document, score) pairs, so cached search results stay small.
+
+    Args:
+        search_results (Sequence[Tuple[Any, float]]): The search results
+        fields (Sequence[str], optional): The metadata fields to keep; None keeps them all
+
+    Returns:
+        List[Tuple[Any, float]]: The results with trimmed documents
+    """
+    if fields is None:
+        return list(search_results)
+
+    return [(Document(page_content=doc.page_content,
+                      metadata={field: doc.metadata[field] for field in fields if field in doc.metadata}), score)
+            for doc, score in search_results]
+    # New documents, so a backend that hands out shared objects is never changed
+
+def process_results(search_results: Sequence[Tuple[Any, float]],
+                    fields: Optional[Sequence[str]] = METADATA_FIELDS) -> List[RetrievedChunk]:
+    """Turn (document, score) pairs into the retrieved chunks the agents expect.
+
+    Args:
+        search_results (Sequence[Tuple[Any, float]]): The search results
+        fields (Sequence[str], optional): The metadata fields to keep; None keeps them all. Defaults to METADATA_FIELDS.
+
+    Returns:
+        List[RetrievedChunk]: One chunk per result, best first
+    """
+    processed_results = []
+    # Create an empty list to store the processed results
+
+    for doc, score in search_results:
+        # For each document and its similarity score
+
+        metadata = doc.metadata
+        # Vector search hits were already trimmed (see trim_metadata), so this is usually shared, not copied
+
+        if fields is not None and any(field not in fields for field in metadata):
+            # A keyword search hit still has every field; keep only the ones we use
+            metadata = {field: metadata[field] for field in fields if field in metadata}
+
+        processed_results.append(RetrievedChunk.from_document(doc, score, metadata))
+        # Add the chunk to the processed results list
+
+    return processed_results
+
+class QueryPipeline:
+    """The retrieval-and-answer path behind the app: embed -> search -> format_context -> generate."""
+    # app.py, the benchmark and any other front end share this class, so they all run exactly the same code
+    # Every stage is timed into a Trace when one is passed in
+
+    def __init__(self, backend: RetrievalBackend, fetch_k: int = FETCH_K,
+                 reranker: Optional[Reranker] = default_reranker,
+                 cache: Optional[RetrievalCache] = default_retrieval_cache,
+                 keyword_search: Optional[Callable[[str, int], Any]] = search_in_background,
+                 flights: Optional[SingleFlight] = default_single_flight,
+                 top_k: Optional[DynamicTopK] = default_top_k,
+                 metadata_fields: Optional[Sequence[str]] = METADATA_FIELDS):
+        """Initialize the pipeline.
+
+        Args:
+            backend (RetrievalBackend): Where documents are searched (it also embeds the queries)
+            fetch_k (int, optional): Candidates fetched per search. Defaults to FETCH_K.
+            reranker (Reranker, optional): Reranks the candidates; None keeps the search order. Defaults to the shared reranker.
+            cache (RetrievalCache, optional): Search result cache; None always searches. Defaults to the shared cache.
+            keyword_search (Callable, optional): Starts a keyword search and returns a future (or None).
+                None turns hybrid search off. Defaults to the shared BM25 index.
+            flights (SingleFlight, optional): Shares embeddings and searches between identical queries in flight
+                at the same time; None turns this off. Defaults to the shared table.
+            top_k (DynamicTopK, optional): Sends fewer results when the scores drop off; None always sends
+                every result the reranker kept. Defaults to the shared selector.
+            metadata_fields (Sequence[str], optional): The metadata kept in each result; None keeps everything.
+                Defaults to METADATA_FIELDS.
+        """
+        self.backend = backend
+        # Store the retrieval backend
+
+        self.fetch_k = fetch_k
+        # Store how many candidates to fetch
+
+        self.reranker = reranker
+        # Store the reranker
+
+        self.cache = cache
+        # Store the search result cache
+
+        self.keyword_search = keyword_search
+        # Store the keyword search starter
+
+        self.flights = flights
+        # Store the in-flight call table
+
+        self.top_k = top_k
+        # Store the dynamic top-k selector
+
+        self.metadata_fields = metadata_fields
+        # Store which metadata fields to keep
+
+    def _embed(self, query: str) -> List[float]:
+        """Embed a query, sharing the call with identical queries being embedded right now."""
+        if self.flights is None:
+            return self.backend.embeddings.embed_query(query)
+
+        return self.flights.do(("embed", self.backend.name, normalize_query(query)),
+                               lambda: self.backend.embeddings.embed_query(query))
+        # The embedding cache normalizes queries the same way, so these queries would share a cache entry anyway
+
+    def _search(self, query_vector: List[float]) -> List[Tuple[Any, float]]:
+        """Search the backend, sharing the search with identical ones in flight right now."""
+        if self.flights is None:
+            return self._search_cached(query_vector)
+
+        return self.flights.do(("search", self.backend.name, self.fetch_k, vector_hash(query_vector)),
+                               lambda: self._search_cached(query_vector))
+        # Keyed like the retrieval cache: the same vector, k and index give the same results
+
+    def _search_cached(self, query_vector: List[float]) -> List[Tuple[Any, float]]:
+        """Search the backend, through the cache when there is one."""
+        search = lambda: trim_metadata(self.backend.search_by_vector(query_vector, self.fetch_k), self.metadata_fields)
+        # The actual search; unused metadata is dropped straight away, so it isn't kept in the cache
+        # (Pinecone can't leave out individual metadata fields, so they are still sent over the network)
+
+        if self.cache is None:
+            # No cache, so always search
+            return search()
+
+        return self.cache.get_or_search(
+            query_vector,               # The embedding of the user's question
+            self.fetch_k,               # Over-fetch candidates for reranking - set RETRIEVAL_FETCH_K to change this
+            self.backend.name,          # The index being searched (part of the cache key)
+            search
+            # The actual search, only run on a cache miss
+        )
+
+    def retrieve(self, query: str, trace: Optional[Trace] = None,
+                 query_vector: Optional[List[float]] = None) -> Retrieval:
+        """Embed the question, search for it and prepare the results for the agents.
+
+        Args:
+            query (str): The user's question
+            trace (Trace, optional): Where to record the stage timings. Defaults to None.
+            query_vector (List[float], optional): The question's embedding, if the caller already has it
+                (for example from a batched embedding call). Defaults to None (embed it here).
+
+        Returns:
+            Retrieval: The query embedding and the processed results (empty if nothing was found)
+        """
+        keyword_future = self.keyword_search(query, self.fetch_k) if self.keyword_search else None
+        # Start the keyword (BM25) search first, so it runs while we embed and search
+        # None when no local keyword index is configured (BM25_INDEX_DIR)
+
+        if query_vector is None:
+            with use_trace(trace), span("embed"):
+                # Convert the question to a vector embedding (served from the embedding cache when possible)
+                # The trace is made current so the embedding rate limiter knows whose query this is
+                query_vector = self._embed(query)
+                # We embed the question ourselves so the same vector can be used for the search and the answer cache
+
+        with span("search", trace):
+            # Search the index (Pinecone or local) for similar documents (or reuse a cached result)
+            search_results = self._search(query_vector)
+
+        if self.top_k is not None:
+            # Drop vector hits that are too dissimilar before they are fused and reranked
+            search_results = self.top_k.filter_hits(search_results)
+
+        if keyword_future is not None:
+            with span("fusion", trace):
+                # Merge the keyword matches with the vector matches
+                search_results = reciprocal_rank_fusion([search_results, keyword_future.result()], top_k=self.fetch_k)
+                # Reciprocal rank fusion: documents ranked high by either search come first
+
+        if self.reranker is not None:
+            with span("rerank", trace):
+                # Rescore the candidates locally and keep only the best few for the LLM
+                search_results = self.reranker.rerank(query, search_results)
+                # Returns the top RERANK_TOP_N (default 5) results, best first
+
+        if self.top_k is not None and (self.reranker is not None or keyword_future is None):
+            # Send fewer results when the scores drop off sharply
+            # Not for fused results without a reranker: RRF scores are about 1 / (60 + rank), nearly uniform,
+            # so a gap between them means nothing and the fixed k is kept
+            search_results = self.top_k.select(search_results)
+
+            if trace is not None:
+                trace.add("top_k", len(search_results))
+                # Show how many results were sent with the query
+
+        return Retrieval(query, query_vector, process_results(search_results, self.metadata_fields))
+
+    async def generate(self, agent: BaseAgent, query: str, results: List[RetrievedChunk],
+                       trace: Optional[Trace] = None) -> str:
+        """Generate an answer with an agent.
+
+        Args:
+            agent (BaseAgent): The agent to use
+            query (str): The user's question
+            results (List[RetrievedChunk]): The processed results
+            trace (Trace, optional): Where to record the stage timings. Defaults to None.
+
+        Returns:
+            str: The answer (the agent's fallback message if it failed)
+        """
+        with use_trace(trace):
+            # Make the trace current, so the agent's format_context is timed too
+            with span("generate"):
+                # Time the whole generation (including format_context)
+                return await agent.generate_answer(query, results)
+
+    async def stream(self, agent: BaseAgent, query: str, results: List[RetrievedChunk],
+                     trace: Optional[Trace] = None) -> AsyncIterator[str]:
+        """Stream an answer with an agent, one piece at a time.
+
+        Args:
+            agent (BaseAgent): The agent to use
+            query (str): The user's question
+            results (List[RetrievedChunk]): The processed results
+            trace (Trace, optional): Where to record the stage timings. Defaults to None.
+
+        Yields:
+            str: The next piece of the answer
+        """
+        pieces = agent.stream_answer(query, results)
+        # The agent's stream
+
+        try:
+            with span("generate", trace):
+                # Time the whole generation (including format_context)
+                with span("first_token", trace):
+                    # Time how long the user waits before anything appears
+                    with use_trace(trace):
+                        # The first step runs format_context, so make the trace current for it
+                        piece = await pieces.__anext__()
+
+                while True:
+                    yield piece
+
+                    piece = await pieces.__anext__()
+                    # Wait for the next piece
+        except StopAsyncIteration:
+            # The stream has finished
+            return
+        finally:
+            await pieces.aclose()
+            # Close the agent's stream if we stopped early
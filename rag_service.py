@@ -0,0 +1,336 @@
+import asyncio
+# Import asyncio to run the synchronous retrieval off the event loop
+
+import os
+# Import the os module to read API keys and settings from environment variables
+
+import threading
+# Import threading so the shared service is only created once
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+
+from agent_factory import AgentFactory, shared_agent_factory
+# Import the shared factory, so every front end reuses the same pooled agents and API clients
+
+from base_agent import BaseAgent
+# Import the BaseAgent class for its FALLBACK_ANSWER message
+
+from embedding_cache import normalize_query
+# Import the query normalization, so questions that only differ in spacing or case share a generation
+
+from provider_router import ProviderRouter, provider_router as default_provider_router
+# Import the router that hedges and fails over between providers
+
+from query_pipeline import QueryPipeline, Retrieval
+# Import the retrieval-and-answer pipeline
+
+from resource_manager import resource_manager
+# Import the shared cache for the Pinecone client, embeddings and vector store
+
+from retrieval_backend import RetrievalBackend
+# Import the search interface shared by Pinecone and the local index
+
+from semantic_cache import SemanticAnswerCache, answer_cache as default_answer_cache
+# Import the process-wide semantic answer cache
+
+from single_flight import SingleFlight, single_flight as default_single_flight
+# Import the process-wide table of calls in flight, so identical concurrent questions share one generation
+
+from tracing import Trace, use_trace
+# Import the per-query stage timings
+
+# The question-answering service behind every front end: the Streamlit page (app.py), the HTTP API (api_server.py)
+# It adds what sits around the pipeline - picking agents, the answer cache and provider failover - so they all behave the same
+
+API_KEY_ENV = {"gpt-4": "OPENAI_API_KEY", "claude": "ANTHROPIC_API_KEY", "deepseek": "DEEPSEEK_API_KEY"}
+# The environment variable holding each agent type's API key
+
+def load_api_keys() -> Dict[str, str]:
+    """Read every provider's API key from the environment (missing keys are left out)."""
+    return {agent_type: os.getenv(name) for agent_type, name in API_KEY_ENV.items() if os.getenv(name)}
+
+def open_backend(openai_api_key: Optional[str] = None) -> RetrievalBackend:
+    """Open the retrieval backend configured in the environment.
+
+    Args:
+        openai_api_key (str, optional): The key used for query embeddings. Defaults to OPENAI_API_KEY.
+
+    Returns:
+        RetrievalBackend: The local index (RETRIEVAL_BACKEND=local) or the Pinecone index (the default)
+
+    Raises:
+        IndexNotFoundError: If the Pinecone index does not exist
+        FileNotFoundError: If no local index has been built
+    """
+    openai_api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
+    # Query embeddings come from OpenAI unless EMBEDDING_PROVIDER=onnx
+
+    if os.getenv("RETRIEVAL_BACKEND", "pinecone").lower() == "local":
+        # Search the local, memory-mapped index
+        return resource_manager.get_local_backend(openai_api_key, os.getenv("LOCAL_INDEX_DIR", ".cache/local_index"))
+
+    return resource_manager.get_pinecone_backend(
+        (os.getenv("PINECONE_API_KEY") or "").strip(),         # The Pinecone API key (stray whitespace removed)
+        openai_api_key,                                        # The OpenAI API key used for query embeddings
+        os.getenv("PINECONE_INDEX_NAME", "pydanticai")         # The name of the Pinecone index
+    )
+
+class Answer:
+    """One generated (or cached) answer."""
+
+    def __init__(self, answer: str, agent_type: str, model: str, cached: bool = False, interrupted: bool = False):
+        """Store the answer.
+
+        Args:
+            answer (str): The answer text (BaseAgent.FALLBACK_ANSWER if generation failed)
+            agent_type (str): The agent type that answered (may differ from the requested one after failover)
+            model (str): The model that answered
+            cached (bool, optional): Whether it came from the answer cache. Defaults to False.
+            interrupted (bool, optional): Whether the stream failed partway, so the text is incomplete.
+                Defaults to False.
+        """
+        self.answer = answer
+        # Store the text
+
+        self.agent_type = agent_type
+        # Store who answered
+
+        self.model = model
+        # Store the model
+
+        self.cached = cached
+        # Store whether it was reused
+
+        self.interrupted = interrupted
+        # Store whether the text stops partway
+
+    @property
+    def ok(self) -> bool:
+        """Whether this is a complete, real answer rather than the failure message or a partial one."""
+        return bool(self.answer) and self.answer != BaseAgent.FALLBACK_ANSWER and not self.interrupted
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the answer as a JSON-friendly dictionary."""
+        return {"answer": self.answer, "answered_by": self.agent_type, "model": self.model,
+                "cached": self.cached, "ok": self.ok, "interrupted": self.interrupted}
+
+class RAGService:
+    """Retrieves, answers and caches questions; shared by every front end."""
+    # Everything here is safe to call from several threads and several event loops at once:
+    # the pipeline, caches and agent pool all protect their own state
+
+    def __init__(self, pipeline: QueryPipeline, api_keys: Dict[str, str],
+                 factory: AgentFactory = shared_agent_factory,
+                 router: Optional[ProviderRouter] = default_provider_router,
+                 cache: Optional[SemanticAnswerCache] = default_answer_cache,
+                 flights: Optional[SingleFlight] = default_single_flight):
+        """Initialize the service.
+
+        Args:
+            pipeline (QueryPipeline): The retrieval-and-answer pipeline
+            api_keys (Dict[str, str]): API key per agent type
+            factory (AgentFactory, optional): Where agents come from. Defaults to the shared, pooled factory.
+            router (ProviderRouter, optional): Used for failover; None turns failover off. Defaults to the shared router.
+            cache (SemanticAnswerCache, optional): Reuses answers to near-identical questions; None turns it off.
+                Defaults to the shared cache.
+            flights (SingleFlight, optional): Shares a generation between identical questions asked at the same time;
+                None turns this off. Defaults to the shared table.
+        """
+        self.pipeline = pipeline
+        # Store the pipeline
+
+        self.api_keys = api_keys
+        # Store the API keys
+
+        self.factory = factory
+        # Store the agent factory
+
+        self.router = router
+        # Store the provider router
+
+        self.cache = cache
+        # Store the answer cache
+
+        self.flights = flights
+        # Store the in-flight call table
+
+    @property
+    def agent_types(self) -> List[str]:
+        """The agent types that can answer (every known type with an API key)."""
+        return [agent_type for agent_type in self.factory.agent_map if self.api_keys.get(agent_type)]
+
+    def get_agent(self, agent_type: str) -> BaseAgent:
+        """Return the pooled agent for an agent type.
+
+        Raises:
+            ValueError: If the agent type is unknown or has no API key
+        """
+        agent = self.factory.get_agent(agent_type, self.api_keys.get(agent_type)) if self.api_keys.get(agent_type) else None
+        # Reuse the pooled agent (and its open connections) when there is one
+
+        if agent is None:
+            raise ValueError(f"Unknown model '{agent_type}' or no API key for it. Available: {self.agent_types}")
+
+        return agent
+
+    def _cache_model(self, agent_type: str, agent: BaseAgent) -> str:
+        """The answer cache key for a model; answers are only reused for the same model."""
+        return f"{agent_type}:{agent.model_name}"
+
+    def retrieve(self, query: str, trace: Optional[Trace] = None) -> Retrieval:
+        """Embed the question, search for it and prepare the results (see QueryPipeline.retrieve)."""
+        return self.pipeline.retrieve(query, trace)
+
+    async def aretrieve(self, query: str, trace: Optional[Trace] = None) -> Retrieval:
+        """Like retrieve, but runs on a worker thread so the event loop stays free."""
+        return await asyncio.to_thread(self.pipeline.retrieve, query, trace)
+
+    def cached_answer(self, retrieval: Retrieval, agent_type: str) -> Optional[Answer]:
+        """Return a cached answer to a near-identical question with the same results, or None."""
+        if self.cache is None:
+            return None
+
+        agent = self.get_agent(agent_type)
+        # The cache is keyed by model
+
+        answer = self.cache.lookup(retrieval.query_vector, self._cache_model(agent_type, agent), retrieval.doc_ids)
+        # None if no similar enough question has been answered recently
+
+        return Answer(answer, agent_type, agent.model_name, cached=True) if answer is not None else None
+
+    def _flight_key(self, kind: str, retrieval: Retrieval, agent_type: str, *options: Any) -> Tuple[Any, ...]:
+        """The key identical generations share: the normalized question, the model and the retrieved documents."""
+        return (kind, normalize_query(retrieval.query), self._cache_model(agent_type, self.get_agent(agent_type)),
+                retrieval.doc_ids, *options)
+        # The documents stand in for k and the index: the same ones mean the same prompt
+
+    def _store(self, retrieval: Retrieval, answer: Answer):
+        """Remember a real answer (never the failure message) for similar questions."""
+        if self.cache is not None and answer.ok and not answer.cached:
+            agent = self.get_agent(answer.agent_type)
+            self.cache.store(retrieval.query_vector, self._cache_model(answer.agent_type, agent), retrieval.doc_ids, answer.answer)
+
+    async def generate(self, retrieval: Retrieval, agent_type: str, trace: Optional[Trace] = None,
+                       failover: bool = False) -> Answer:
+        """Answer a retrieved question, from the cache when possible.
+
+        Args:
+            retrieval (Retrieval): What retrieve returned
+            agent_type (str): The agent type to answer with
+            trace (Trace, optional): Where to record the stage timings. Defaults to None.
+            failover (bool, optional): Hedge and fail over to other providers when this one is slow or failing.
+                Defaults to False.
+
+        Returns:
+            Answer: The answer (its text is BaseAgent.FALLBACK_ANSWER if every provider failed)
+        """
+        cached = self.cached_answer(retrieval, agent_type)
+        # Look for an answer to a near-identical question
+
+        if cached is not None:
+            return cached
+
+        if self.flights is None:
+            return await self._generate(retrieval, agent_type, trace, failover)
+
+        return await self.flights.do_async(self._flight_key("generate", retrieval, agent_type, failover),
+                                           lambda: self._generate(retrieval, agent_type, trace, failover))
+        # Callers asking the same question at the same time wait for one generation
+        # Only the first caller's trace records its stages
+
+    async def _generate(self, retrieval: Retrieval, agent_type: str, trace: Optional[Trace], failover: bool) -> Answer:
+        """Generate and cache an answer (see generate)."""
+        if failover and self.router is not None:
+            # Let the router pick (and if needed replace) the provider
+            with use_trace(trace):
+                # Make the trace current, so the spans inside the router's tasks are recorded
+                text, answered_by = await self.router.generate_answer(
+                    retrieval.query, retrieval.results, agent_type, self.api_keys)
+        else:
+            text = await self.pipeline.generate(self.get_agent(agent_type), retrieval.query, retrieval.results, trace)
+            answered_by = agent_type
+
+        answer = Answer(text, answered_by, self.get_agent(answered_by).model_name)
+        # Wrap the text with who answered
+
+        self._store(retrieval, answer)
+        # Remember it for similar questions
+
+        return answer
+
+    async def stream(self, retrieval: Retrieval, agent_type: str, trace: Optional[Trace] = None) -> AsyncIterator[str]:
+        """Stream an answer to a retrieved question, one piece at a time.
+
+        The finished answer is cached. Check cached_answer first to skip generation for repeated questions.
+
+        Args:
+            retrieval (Retrieval): What retrieve returned
+            agent_type (str): The agent type to answer with
+            trace (Trace, optional): Where to record the stage timings. Defaults to None.
+
+        Yields:
+            str: The next piece of the answer
+        """
+        if self.flights is None:
+            stream = self._stream(retrieval, agent_type, trace)
+        else:
+            stream = self.flights.stream(self._flight_key("stream", retrieval, agent_type),
+                                         lambda: self._stream(retrieval, agent_type, trace))
+            # Callers asking the same question at the same time read one stream; late ones get the start replayed
+
+        try:
+            async for piece in stream:
+                # Pass each piece on as it arrives
+                yield piece
+        finally:
+            await stream.aclose()
+            # Leave the shared stream (it stops when nobody reads it any more)
+
+    async def _stream(self, retrieval: Retrieval, agent_type: str, trace: Optional[Trace]) -> AsyncIterator[str]:
+        """Stream and cache an answer (see stream)."""
+        agent = self.get_agent(agent_type)
+        # Get the pooled agent
+
+        pieces = []
+        # Everything streamed so far
+
+        async for piece in self.pipeline.stream(agent, retrieval.query, retrieval.results, trace):
+            # Pass each piece on as it arrives
+            pieces.append(piece)
+            yield piece
+
+        self._store(retrieval, Answer("".join(pieces), agent_type, agent.model_name))
+        # Only reached when the stream finished: an agent raises StreamInterruptedError when it fails partway,
+        # so partial answers are never cached
+
+def create_service() -> RAGService:
+    """Create a service configured from environment variables (API keys and the retrieval backend)."""
+    api_keys = load_api_keys()
+    # Every provider's API key
+
+    return RAGService(QueryPipeline(open_backend(api_keys.get("gpt-4"))), api_keys)
+    # The pipeline uses the shared retrieval cache, keyword index and reranker
+
+_service: Optional[RAGService] = None
+# The shared service, created on first use
+
+_service_lock = threading.Lock()
+# A lock so two threads can't create it at once
+
+def get_service() -> RAGService:
+    """Return the process-wide service, creating it on first use (see create_service)."""
+    global _service
+
+    with _service_lock:
+        # Only create it once
+        if _service is None:
+            _service = create_service()
+
+        return _service
@@ -0,0 +1,574 @@
+import asyncio
+# Import asyncio so callers on any event loop can wait for their turn without blocking it
+
+import collections
+# Import collections for the per-session waiting lines
+
+import email.utils
+# Import email.utils to read a Retry-After header given as a date
+
+import os
+# Import the os module to read the rate limits from environment variables
+
+import random
+# Import random to add jitter to the backoff delays
+
+import threading
+# Import threading because the same limiter is shared by every thread and event loop in the process
+
+import time
+# Import time to refill the buckets and to wait in synchronous callers
+
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Awaitable: Something that can be awaited, like a coroutine
+# Callable: A function
+# Deque: A double-ended queue
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+# TypeVar: A placeholder for "whatever type the wrapped call returns"
+
+import httpx
+# Import httpx to recognize network errors (the Deepseek agent and the SDKs all use it)
+
+from metrics import registry
+# Import the process-wide metrics registry
+
+from tracing import current_trace, span
+# Import the current query's trace (it says which session the call belongs to) and the stage timer
+
+# Keeps every provider call inside its requests-per-minute and tokens-per-minute quota.
+#
+# Each provider has two token buckets (requests and tokens) that refill continuously. A call waits in line until
+# both buckets can pay for it. The lines are per session and served in turn, so one session sending many requests
+# can't starve the others. A call rejected with 429 (or another temporary error) is retried with jittered
+# exponential backoff, honoring the provider's Retry-After header. While the provider is backing off, no new calls
+# are sent at all, so the process settles at the quota ceiling instead of failing.
+
+T = TypeVar("T")
+# The type the wrapped call returns
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# HTTP statuses worth retrying: timeouts, rate limits, overloads (Anthropic uses 529) and server errors
+
+RATE_LIMIT_WAIT = registry.histogram(
+    "rag_rate_limit_wait_seconds", "Time calls waited for rate limit budget.", ["limiter"])
+# How long calls queue before they are sent
+
+RATE_LIMIT_RETRIES = registry.counter(
+    "rag_rate_limit_retries_total", "Provider calls retried after a temporary error.", ["limiter", "status"])
+# How often each provider pushes back, and with which status
+
+class TokenBucket:
+    """A budget that refills continuously up to a per-minute limit."""
+    # Not thread-safe on its own; RateLimiter protects it with its lock
+
+    def __init__(self, per_minute: float):
+        """Initialize a full bucket.
+
+        Args:
+            per_minute (float): The limit per minute (the bucket holds at most one minute's worth)
+        """
+        self.capacity = float(per_minute)
+        # The most the bucket can hold
+
+        self.rate = self.capacity / 60.0
+        # How much is added per second
+
+        self.level = self.capacity
+        # What is available now (start full)
+
+        self.updated = time.monotonic()
+        # When the level was last brought up to date
+
+    def refill(self, now: float):
+        """Add what has accumulated since the last update."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until the bucket can pay for an amount (0 if it can now)."""
+        amount = min(amount, self.capacity)
+        # A call bigger than the whole bucket waits for a full bucket instead of forever
+
+        return max(0.0, (amount - self.level) / self.rate) if self.rate > 0 else 0.0
+
+    def take(self, amount: float):
+        """Pay for an amount (the level may go negative when a call used more than estimated)."""
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Return an amount that wasn't used."""
+        self.level = min(self.capacity, self.level + amount)
+
+def current_session() -> str:
+    """The session the current call belongs to, from the query's trace ("" when there is none)."""
+    trace = current_trace()
+    return (trace.session if trace is not None else None) or ""
+
+class _Waiter:
+    """One call waiting for budget."""
+
+    def __init__(self, tokens: float, wake: Callable[[], None], requests: int = 1):
+        """Store the cost and how to wake the caller."""
+        self.tokens = tokens
+        # The tokens the call is expected to use
+
+        self.requests = requests
+        # The requests it counts as (0 for the extra shares of a request paid for by several sessions)
+
+        self.wake = wake
+        # Called (from any thread) once the call may go ahead
+
+        self.granted = False
+        # Set when the budget has been paid
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budgets, fair queuing and retries for one provider."""
+
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        """Initialize the limiter.
+
+        Args:
+            name (str): The provider (used in metrics)
+            rpm (float, optional): Requests per minute; None for no limit. Defaults to None.
+            tpm (float, optional): Tokens per minute; None for no limit. Defaults to None.
+            max_retries (int, optional): Retries after a temporary error. Defaults to 5.
+            base_delay (float, optional): The first backoff delay in seconds (it doubles each retry). Defaults to 1.0.
+            max_delay (float, optional): The longest backoff delay in seconds. Defaults to 60.0.
+        """
+        self.name = name
+        # Store the provider name
+
+        self.requests = TokenBucket(rpm) if rpm else None
+        # The request budget
+
+        self.tokens = TokenBucket(tpm) if tpm else None
+        # The token budget
+
+        self.max_retries = max_retries
+        # Store the retry limit
+
+        self.base_delay = base_delay
+        # Store the first backoff delay
+
+        self.max_delay = max_delay
+        # Store the longest backoff delay
+
+        self._lines: "collections.OrderedDict[str, Deque[_Waiter]]" = collections.OrderedDict()
+        # One waiting line per session; the session at the front is served next
+
+        self._paused_until = 0.0
+        # While the provider is backing off (after a 429), nothing is sent before this time
+
+        self._lock = threading.Lock()
+        # One lock for the buckets and the lines, shared by every thread and event loop
+
+    def _refill(self, now: float):
+        """Bring both buckets up to date (the caller holds the lock)."""
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+
+    def _wait_for(self, tokens: float, now: float, requests: int = 1) -> float:
+        """Seconds until a call of this size may be sent (the caller holds the lock)."""
+        waits = [self._paused_until - now]
+        # Wait out a backoff pause first
+
+        if self.requests is not None and requests:
+            waits.append(self.requests.wait_time(requests))
+
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(tokens))
+
+        return max(0.0, *waits)
+
+    def _dispatch(self):
+        """Let waiting calls go, in turn across sessions, while the budget lasts."""
+        woken: List[_Waiter] = []
+        # Calls to wake once the lock is released
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            while self._lines:
+                session, line = next(iter(self._lines.items()))
+                # The session whose turn it is
+
+                waiter = line[0]
+                # Its oldest call
+
+                if self._wait_for(waiter.tokens, now, waiter.requests) > 0:
+                    # Not enough budget yet; later calls wait too, so a big call can't be starved by small ones
+                    break
+
+                if self.requests is not None and waiter.requests:
+                    self.requests.take(waiter.requests)
+
+                if self.tokens is not None:
+                    self.tokens.take(waiter.tokens)
+
+                line.popleft()
+                waiter.granted = True
+                woken.append(waiter)
+
+                self._lines.move_to_end(session)
+                # The session goes to the back, so every session gets a turn
+
+                if not line:
+                    del self._lines[session]
+
+        for waiter in woken:
+            waiter.wake()
+
+    def _enqueue(self, waiter: _Waiter, session: str):
+        """Put a call in its session's line."""
+        with self._lock:
+            self._lines.setdefault(session, collections.deque()).append(waiter)
+
+    def _next_check(self) -> float:
+        """Seconds until the call at the front might be able to go."""
+        with self._lock:
+            if not self._lines:
+                return 0.05
+
+            now = time.monotonic()
+            self._refill(now)
+            line = next(iter(self._lines.values()))
+            return max(0.005, self._wait_for(line[0].tokens, now, line[0].requests))
+
+    def _cancel(self, waiter: _Waiter, session: str):
+        """Take a call out of line, or refund it if it was already let through."""
+        with self._lock:
+            line = self._lines.get(session)
+
+            if not waiter.granted and line is not None and waiter in line:
+                line.remove(waiter)
+
+                if not line:
+                    del self._lines[session]
+            elif waiter.granted:
+                self._refund(waiter.tokens, waiter.requests)
+
+        self._dispatch()
+        # Someone else may fit now
+
+    def _refund(self, tokens: float, requests: int = 1):
+        """Give back a call's budget (the caller holds the lock)."""
+        if self.requests is not None and requests:
+            self.requests.give_back(requests)
+
+        if self.tokens is not None:
+            self.tokens.give_back(tokens)
+
+    def settle(self, estimated: float, actual: Optional[float]):
+        """Correct the token budget once a call reports what it really used.
+
+        Args:
+            estimated (float): The tokens the call was admitted with
+            actual (float, optional): The tokens it used (None leaves the estimate in place)
+        """
+        if self.tokens is None or actual is None:
+            return
+
+        with self._lock:
+            if actual < estimated:
+                # Return what wasn't used
+                self.tokens.give_back(estimated - actual)
+            else:
+                # Pay for the extra
+                self.tokens.level -= actual - estimated
+
+    async def acquire(self, tokens: float = 0.0):
+        """Wait (without blocking the event loop) until a call may be sent.
+
+        Args:
+            tokens (float, optional): The tokens the call is expected to use. Defaults to 0.
+        """
+        if self.requests is None and self.tokens is None and self._paused_until <= time.monotonic():
+            # No limits configured and not backing off
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Resolved from whichever thread dispatches this call
+
+        waiter = _Waiter(tokens, lambda: loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None)))
+        session = current_session()
+        start = time.perf_counter()
+
+        self._enqueue(waiter, session)
+
+        try:
+            with span("rate_limit_wait"):
+                # Show queueing time with the query
+                while not waiter.granted:
+                    self._dispatch()
+                    # Send whatever fits now (including, possibly, this call)
+
+                    if waiter.granted:
+                        break
+
+                    try:
+                        await asyncio.wait_for(asyncio.shield(future), timeout=self._next_check())
+                        # Wake when dispatched, or when the budget should have refilled
+                    except asyncio.TimeoutError:
+                        pass
+        except BaseException:
+            # Cancelled while waiting (for example, a hedged request that lost)
+            self._cancel(waiter, session)
+            raise
+        finally:
+            RATE_LIMIT_WAIT.observe(time.perf_counter() - start, limiter=self.name)
+
+    def acquire_sync(self, tokens: float = 0.0, session: Optional[str] = None, requests: int = 1):
+        """Wait (blocking the calling thread) until a call may be sent.
+
+        Args:
+            tokens (float, optional): The tokens the call is expected to use. Defaults to 0.
+            session (str, optional): Whose line to wait in. Defaults to the current trace's session.
+            requests (int, optional): The requests it counts as. Defaults to 1.
+        """
+        if self.requests is None and self.tokens is None and self._paused_until <= time.monotonic():
+            return
+
+        event = threading.Event()
+        # Set from whichever thread dispatches this call
+
+        waiter = _Waiter(tokens, event.set, requests)
+        session = current_session() if session is None else session
+        start = time.perf_counter()
+
+        self._enqueue(waiter, session)
+
+        try:
+            with span("rate_limit_wait"):
+                while not waiter.granted:
+                    self._dispatch()
+
+                    if not waiter.granted:
+                        event.wait(self._next_check())
+        except BaseException:
+            self._cancel(waiter, session)
+            raise
+        finally:
+            RATE_LIMIT_WAIT.observe(time.perf_counter() - start, limiter=self.name)
+
+    def acquire_shares_sync(self, shares: Dict[str, float]):
+        """Wait until one call shared by several sessions may be sent, each paying its tokens in its own line.
+
+        Used for batched requests (such as the embedding batcher's): every session waits its turn for its part,
+        so a session sending many texts can't get ahead of the others by riding along in a shared batch.
+        The request itself is counted once, with the first share.
+
+        Args:
+            shares (Dict[str, float]): The tokens each session's part of the call is expected to use
+        """
+        granted: List[Tuple[str, float, int]] = []
+        # The shares paid so far, to refund if we are interrupted
+
+        try:
+            for index, (session, tokens) in enumerate(shares.items()):
+                self.acquire_sync(tokens, session=session, requests=1 if index == 0 else 0)
+                granted.append((session, tokens, 1 if index == 0 else 0))
+        except BaseException:
+            with self._lock:
+                for _, tokens, requests in granted:
+                    self._refund(tokens, requests)
+
+            self._dispatch()
+            raise
+
+    def _backoff(self, error: Exception, attempt: int) -> Optional[float]:
+        """Return how long to wait before retrying, or None if the error shouldn't be retried."""
+        status = error_status(error)
+
+        if status is None and not is_network_error(error):
+            # A real failure (bad request, wrong key, ...): retrying won't help
+            return None
+
+        if attempt >= self.max_retries:
+            return None
+
+        RATE_LIMIT_RETRIES.inc(limiter=self.name, status=str(status or "network"))
+        # Count the push-back
+
+        retry_after = error_retry_after(error)
+        # The provider's own estimate, when it gives one
+
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        # Exponential backoff with full jitter, so many callers don't retry in lockstep
+
+        delay = min(self.max_delay, retry_after + random.uniform(0, self.base_delay)) if retry_after is not None else backoff
+
+        if status == 429:
+            with self._lock:
+                # Pause every call to this provider, not just this one
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+        print(f"DEBUG - {self.name} returned {status or type(error).__name__}; retry {attempt + 1} in {delay:.1f}s")
+
+        return delay
+
+    async def call(self, func: Callable[[], Awaitable[T]], tokens: float = 0.0,
+                   usage: Optional[Callable[[T], Optional[float]]] = None) -> T:
+        """Send a provider call within the budget, retrying temporary errors.
+
+        Args:
+            func (Callable[[], Awaitable[T]]): Makes the call (called again for every retry)
+            tokens (float, optional): The tokens the call is expected to use. Defaults to 0.
+            usage (Callable, optional): Reads the tokens actually used from the result, to correct the budget
+
+        Returns:
+            T: What func returned
+
+        Raises:
+            Exception: The last error, once retries run out (or immediately for errors that aren't temporary)
+        """
+        attempt = 0
+        # How many retries so far
+
+        while True:
+            await self.acquire(tokens)
+
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+
+                if delay is None:
+                    raise
+
+                self.settle(tokens, 0)
+                # A rejected call used no tokens
+
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            if usage is not None:
+                self.settle(tokens, usage(result))
+
+            return result
+
+    def call_sync(self, func: Callable[[], T], tokens: float = 0.0,
+                  usage: Optional[Callable[[T], Optional[float]]] = None,
+                  shares: Optional[Dict[str, float]] = None) -> T:
+        """Like call, for synchronous provider calls (such as LangChain's embed_query).
+
+        shares splits a call made for several sessions (a batch) between them, see acquire_shares_sync;
+        tokens is then their total.
+        """
+        attempt = 0
+
+        while True:
+            if shares:
+                self.acquire_shares_sync(shares)
+            else:
+                self.acquire_sync(tokens)
+
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+
+                if delay is None:
+                    raise
+
+                self.settle(tokens, 0)
+                # A rejected call used no tokens
+
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            if usage is not None:
+                self.settle(tokens, usage(result))
+
+            return result
+
+def _response(error: Exception) -> Optional[Any]:
+    """The HTTP response attached to an SDK or httpx error, if any."""
+    return getattr(error, "response", None)
+
+def error_status(error: Exception) -> Optional[int]:
+    """Return the HTTP status of a retryable error, or None."""
+    status = getattr(error, "status_code", None)
+    # openai and anthropic errors carry it directly
+
+    if status is None and _response(error) is not None:
+        # httpx.HTTPStatusError carries the response
+        status = getattr(_response(error), "status_code", None)
+
+    return status if status in RETRYABLE_STATUS else None
+
+def is_network_error(error: Exception) -> bool:
+    """Whether an error is a dropped connection or timeout (worth retrying)."""
+    return isinstance(error, httpx.TransportError) or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+    # The SDKs wrap httpx's errors in their own classes
+
+def error_retry_after(error: Exception) -> Optional[float]:
+    """Return the Retry-After delay in seconds from an error's response, or None."""
+    headers = getattr(_response(error), "headers", None) or {}
+
+    try:
+        if headers.get("retry-after-ms"):
+            # OpenAI also sends milliseconds
+            return float(headers["retry-after-ms"]) / 1000
+
+        value = headers.get("retry-after")
+
+        if not value:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            # An HTTP date instead of seconds
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        # A header we can't read
+        return None
+
+_limiters: Dict[str, RateLimiter] = {}
+# One limiter per provider, shared by the whole process
+
+_limiters_lock = threading.Lock()
+# A lock so two threads can't create the same limiter
+
+def _env_number(name: str) -> Optional[float]:
+    """Read a positive number from the environment (None when unset or 0)."""
+    value = float(os.getenv(name, "0") or 0)
+    return value if value > 0 else None
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """Return the process-wide limiter for a provider, configured from environment variables.
+
+    RATE_LIMIT_<NAME>_RPM and RATE_LIMIT_<NAME>_TPM set the budgets (unset means unlimited, but temporary errors
+    are still retried). RATE_LIMIT_MAX_RETRIES and RATE_LIMIT_MAX_DELAY apply to every provider.
+
+    Args:
+        name (str): "openai", "anthropic", "deepseek" or "openai-embeddings"
+
+    Returns:
+        RateLimiter: The shared limiter
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            prefix = "RATE_LIMIT_" + name.upper().replace("-", "_")
+            # For example RATE_LIMIT_OPENAI_EMBEDDINGS_RPM
+
+            _limiters[name] = RateLimiter(
+                name,
+                rpm=_env_number(f"{prefix}_RPM"),
+                tpm=_env_number(f"{prefix}_TPM"),
+                max_retries=int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5")),
+                max_delay=float(os.getenv("RATE_LIMIT_MAX_DELAY", "60"))
+            )
+
+        return _limiters[name]
@@ -0,0 +1,366 @@
+import os
+# Import the os module to read the reranking settings from environment variables
+
+import math
+# Import math for the logarithm used in the lexical scorer
+
+import re
+# Import re (regular expressions) to split text into words
+
+import threading
+# Import threading so the cross-encoder model is only loaded once
+
+from collections import Counter
+# Import Counter to count how often each word appears
+
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Callable: A function
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+Scorer = Callable[[str, List[str]], List[float]]
+# A scorer takes the query and a batch of passages and returns one relevance score per passage
+# Any function with this shape can be plugged into the Reranker
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase words.
+
+    Args:
+        text (str): The text to split
+
+    Returns:
+        List[str]: The words
+    """
+    return re.findall(r"\w+", text.lower())
+    # \w+ matches runs of letters, digits and underscores, so codes like "ERR_42" stay whole
+
+class LexicalOverlapScorer:
+    """Scores passages by how well they match the query's words (BM25 over the candidate set)."""
+    # This runs in microseconds on the CPU and needs no model
+    # It rewards passages that contain the query's rarer words, which dense embeddings sometimes miss
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """Initialize the scorer with the usual BM25 parameters.
+
+        Args:
+            k1 (float, optional): How quickly repeated words stop adding to the score. Defaults to 1.2.
+            b (float, optional): How much long passages are penalized. Defaults to 0.75.
+        """
+        self.k1 = k1
+        # Store the term frequency saturation
+
+        self.b = b
+        # Store the length normalization
+
+    def __call__(self, query: str, texts: List[str]) -> List[float]:
+        """Score a batch of passages against the query.
+
+        Args:
+            query (str): The user's question
+            texts (List[str]): The passages to score
+
+        Returns:
+            List[float]: One score per passage
+        """
+        query_terms = set(tokenize(query))
+        # The distinct words in the query
+
+        docs = [Counter(tokenize(text)) for text in texts]
+        # Word counts for each passage
+
+        if not docs or not query_terms:
+            # Nothing to compare
+            return [0.0] * len(texts)
+
+        average_length = sum(sum(doc.values()) for doc in docs) / len(docs) or 1.0
+        # The average passage length in words
+
+        document_frequency = Counter(term for doc in docs for term in query_terms if term in doc)
+        # How many passages contain each query word (computed once for the whole batch)
+
+        idf = {
+            term: math.log(1 + (len(docs) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            for term in query_terms
+        }
+        # Rare words count for more than common ones
+
+        scores = []
+        # One score per passage
+
+        for doc in docs:
+            # Score each passage
+            length = sum(doc.values())
+            # This passage's length in words
+
+            score = 0.0
+            # Start at zero
+
+            for term in query_terms:
+                # Add a contribution for every query word the passage contains
+                tf = doc.get(term, 0)
+                # How often the word appears in this passage
+
+                if tf == 0:
+                    continue
+
+                score += idf[term] * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average_length))
+                # The BM25 formula
+
+            scores.append(score)
+
+        return scores
+
+class CrossEncoderScorer:
+    """Scores passages with a small cross-encoder model (requires sentence-transformers)."""
+    # A cross-encoder reads the query and passage together, which is more accurate than comparing
+    # two separate embeddings, but slower; that's why it only runs on the over-fetched candidates
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
+        """Initialize the scorer. The model is loaded on first use.
+
+        Args:
+            model_name (str, optional): The cross-encoder model to load.
+                Defaults to "cross-encoder/ms-marco-MiniLM-L-6-v2".
+        """
+        self.model_name = model_name
+        # Store the model name
+
+        self._model = None
+        # The loaded model (None until first use)
+
+        self._lock = threading.Lock()
+        # A lock so two sessions don't both load the model
+
+    def _get_model(self):
+        """Load the model the first time it is needed."""
+        with self._lock:
+            # Only one thread at a time may load the model
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                # Import here so sentence-transformers is only needed when this scorer is used
+
+                self._model = CrossEncoder(self.model_name)
+                # Load the model (downloads it the first time)
+
+            return self._model
+
+    def __call__(self, query: str, texts: List[str]) -> List[float]:
+        """Score a batch of passages against the query.
+
+        Args:
+            query (str): The user's question
+            texts (List[str]): The passages to score
+
+        Returns:
+            List[float]: One score per passage
+        """
+        return [float(score) for score in self._get_model().predict([(query, text) for text in texts])]
+        # Score every (query, passage) pair in one call
+
+def _min_max(values: Sequence[float]) -> List[float]:
+    """Scale values to the range 0..1 so scores from different scorers can be combined."""
+    low, high = min(values), max(values)
+    # The smallest and largest value
+
+    if high == low:
+        # All values are the same
+        return [1.0] * len(values)
+
+    return [(value - low) / (high - low) for value in values]
+
+class Reranker:
+    """Re-orders over-fetched search results with a local scorer and keeps the best few."""
+    # Pinecone returns the top results by embedding similarity. We ask it for more than we need
+    # (for example 50), score those candidates again on the CPU, and send only the best few to the LLM.
+    # Fewer, better chunks means a shorter prompt and a faster answer.
+
+    def __init__(self, scorer: Optional[Scorer] = None, top_n: int = 5, batch_size: int = 32,
+                 dense_weight: float = 0.5):
+        """Initialize the reranker.
+
+        Args:
+            scorer (Scorer, optional): The scoring function. Defaults to LexicalOverlapScorer().
+            top_n (int, optional): How many results to keep. Defaults to 5.
+            batch_size (int, optional): Passages scored per scorer call. Defaults to 32.
+            dense_weight (float, optional): Weight of the original similarity score (0..1). Defaults to 0.5.
+        """
+        self.scorer = scorer or LexicalOverlapScorer()
+        # Store the scorer
+
+        self.top_n = top_n
+        # Store how many results to keep
+
+        self.batch_size = batch_size
+        # Store the batch size
+
+        self.dense_weight = dense_weight
+        # Store the weight of the original similarity score
+
+    def rerank(self, query: str, search_results: List[Tuple[Any, float]]) -> List[Tuple[Any, float]]:
+        """Rerank (document, score) pairs and keep the best top_n.
+
+        Args:
+            query (str): The user's question
+            search_results (List[Tuple[Any, float]]): The over-fetched (document, similarity) pairs
+
+        Returns:
+            List[Tuple[Any, float]]: The best top_n (document, combined score) pairs, best first
+        """
+        if len(search_results) <= 1:
+            # Nothing to reorder
+            return list(search_results)[:self.top_n]
+
+        texts = [doc.page_content for doc, _ in search_results]
+        # The passage text of every candidate
+
+        if isinstance(self.scorer, LexicalOverlapScorer):
+            # BM25 statistics must be computed over the whole candidate set, so score it in one go
+            rerank_scores = self.scorer(query, texts)
+        else:
+            rerank_scores = []
+            # Scores from the plugged-in scorer
+
+            for start in range(0, len(texts), self.batch_size):
+                # Score the candidates in batches, so model scorers run efficiently
+                rerank_scores.extend(self.scorer(query, texts[start:start + self.batch_size]))
+
+        combined = [
+            self.dense_weight * dense + (1 - self.dense_weight) * rerank
+            for dense, rerank in zip(_min_max([score for _, score in search_results]), _min_max(rerank_scores))
+        ]
+        # Blend the original similarity with the reranker's score (both scaled to 0..1)
+
+        ranked = sorted(zip(search_results, combined), key=lambda pair: pair[1], reverse=True)
+        # Best combined score first
+
+        return [(doc, score) for (doc, _), score in ranked[:self.top_n]]
+        # Keep the best top_n, with their combined score
+
+def create_reranker() -> Optional[Reranker]:
+    """Create the reranker configured by environment variables.
+
+    RERANKER selects the scorer: "lexical" (default), "cross-encoder" or "none".
+
+    Returns:
+        Optional[Reranker]: The reranker, or None if reranking is turned off
+    """
+    kind = os.getenv("RERANKER", "lexical").lower()
+    # Which scorer to use
+
+    if kind == "none":
+        # Reranking is turned off
+        return None
+
+    scorer = CrossEncoderScorer(os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")) \
+        if kind == "cross-encoder" else LexicalOverlapScorer()
+    # Pick the scorer
+
+    return Reranker(
+        scorer,
+        top_n=int(os.getenv("RERANK_TOP_N", "5")),
+        # How many results to send to the LLM
+        batch_size=int(os.getenv("RERANK_BATCH_SIZE", "32")),
+        # Passages per scorer call
+        dense_weight=float(os.getenv("RERANK_DENSE_WEIGHT", "0.5"))
+        # Weight of the original similarity score
+    )
+
+reranker = create_reranker()
+# The single, process-wide reranker that app.py uses (None when RERANKER=none)
+
+class DynamicTopK:
+    """Decides how many of the best results go to the LLM, from their scores."""
+    # A fixed k sends five chunks even when only the first two are about the question
+    # The extra chunks cost prompt tokens and can distract the model, so we stop at a clear drop in score
+
+    def __init__(self, min_k: int = 2, max_gap: float = 0.25, min_score: float = 0.0):
+        """Initialize the selector.
+
+        Args:
+            min_k (int, optional): Always keep at least this many results. Defaults to 2.
+            max_gap (float, optional): Stop at the first drop between neighbouring scores larger than this share
+                of the best score (0 turns it off). Defaults to 0.25.
+            min_score (float, optional): Drop vector search hits with a lower similarity before fusion and
+                reranking (0 turns it off; it depends on the embedding model and metric). Defaults to 0.
+        """
+        self.min_k = min_k
+        # Store the minimum number of results
+
+        self.max_gap = max_gap
+        # Store the largest allowed drop between neighbours
+
+        self.min_score = min_score
+        # Store the similarity threshold
+
+    def filter_hits(self, search_results: List[Tuple[Any, float]]) -> List[Tuple[Any, float]]:
+        """Drop vector search hits below min_score (keeping at least min_k), so they aren't reranked or sent.
+
+        Args:
+            search_results (List[Tuple[Any, float]]): (document, similarity) pairs, best first
+
+        Returns:
+            List[Tuple[Any, float]]: The hits worth keeping
+        """
+        if self.min_score <= 0:
+            # No threshold
+            return list(search_results)
+
+        kept = [(doc, score) for doc, score in search_results if score >= self.min_score]
+        # The hits similar enough to the query
+
+        return kept if len(kept) >= self.min_k else list(search_results)[:self.min_k]
+        # Never leave the LLM with less than min_k results to work with
+
+    def select(self, search_results: List[Tuple[Any, float]]) -> List[Tuple[Any, float]]:
+        """Cut the ranked results at the first large drop in score.
+
+        Only meaningful for similarities and reranked scores: reciprocal rank fusion scores are about
+        1 / (60 + rank), so their gaps say nothing about relevance (the pipeline doesn't call this for them).
+
+        Args:
+            search_results (List[Tuple[Any, float]]): (document, score) pairs, best first
+
+        Returns:
+            List[Tuple[Any, float]]: The results before the drop (at least min_k)
+        """
+        if self.max_gap <= 0 or len(search_results) <= self.min_k:
+            # Nothing to decide
+            return list(search_results)
+
+        scores = [score for _, score in search_results]
+        # The scores, best first
+
+        gap = self.max_gap * abs(scores[0]) if scores[0] else self.max_gap
+        # The largest drop allowed, relative to the best score (so it works for similarities, fused and reranked scores)
+
+        for k in range(self.min_k, len(scores)):
+            # Look for the first large drop after the first min_k results
+            if scores[k - 1] - scores[k] > gap:
+                return list(search_results)[:k]
+
+        return list(search_results)
+
+def create_top_k() -> Optional[DynamicTopK]:
+    """Create the dynamic top-k selector configured by environment variables (None when DYNAMIC_TOP_K=false)."""
+    if os.getenv("DYNAMIC_TOP_K", "true").lower() == "false":
+        # Always send every result the reranker (or search) kept
+        return None
+
+    return DynamicTopK(
+        min_k=int(os.getenv("TOP_K_MIN", "2")),
+        # The fewest results to send
+        max_gap=float(os.getenv("TOP_K_MAX_GAP", "0.25")),
+        # Cut at a drop bigger than this share of the best score
+        min_score=float(os.getenv("TOP_K_MIN_SCORE", "0"))
+        # Drop vector hits below this similarity (0 = off)
+    )
+
+top_k_selector = create_top_k()
+# The single, process-wide selector that app.py uses
+
+FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "50")) if reranker is not None else int(os.getenv("RERANK_TOP_N", "5"))
+# How many results to ask the vector store for: over-fetch when reranking, otherwise just what we send
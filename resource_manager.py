@@ -0,0 +1,382 @@
+import os
+# Import the os module to read the embedding cache settings from environment variables
+
+import threading
+# Import threading so the shared caches can be protected with a lock
+# Streamlit runs every user session in its own thread, so the caches below are accessed concurrently
+
+from collections import OrderedDict
+# Import OrderedDict to drop the least recently used API key's resources when there are too many
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# TYPE_CHECKING: True only for type checkers, so the SDK classes can be named without importing them
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+
+if TYPE_CHECKING:
+    # Only for type hints; at runtime the SDKs are imported inside the getters below
+    # pinecone, langchain_openai and langchain_pinecone take about a second to import together,
+    # and a process using a local index (or one that never searches) doesn't need them at all
+    from pinecone.grpc import PineconeGRPC as Pinecone
+    from langchain_pinecone import PineconeVectorStore
+
+from embedding_cache import CachedEmbeddings
+# Import the wrapper that caches query embeddings in memory and on disk
+
+from embedding_providers import create_onnx_embeddings, embedding_provider
+# Import the local ONNX embedding model used when EMBEDDING_PROVIDER=onnx
+
+from local_index import LocalVectorIndex
+# Import the memory-mapped local vector index used when running without Pinecone
+
+from rate_limiter import get_rate_limiter
+# Import the shared per-provider rate limiters
+
+from retrieval_backend import LocalBackend, PineconeBackend
+# Import the backends that search a local index and Pinecone
+
+MAX_API_KEYS = int(os.getenv("RESOURCE_CACHE_MAX_KEYS", "8"))
+# How many API keys keep their clients, embeddings and vector stores at the same time
+# Sessions using different keys keep their own resources; past this, the least recently used key's are dropped
+
+class IndexNotFoundError(Exception):
+    """Raised when the requested index does not exist in the Pinecone account."""
+    # Custom exception so callers can tell "wrong index name" apart from connection errors
+
+    def __init__(self, index_name: str, available_indexes: List[str]):
+        """Store the missing index name and the indexes that do exist.
+
+        Args:
+            index_name (str): The index name that was requested
+            available_indexes (List[str]): The index names found in the account
+        """
+        super().__init__(f"Index '{index_name}' not found in your Pinecone account. Available indexes: {available_indexes}")
+        # Build the same message the app used to show when an index was missing
+
+        self.index_name = index_name
+        # Store the requested index name
+
+        self.available_indexes = available_indexes
+        # Store the list of indexes that were found
+
+class ResourceManager:
+    """Process-wide cache for the Pinecone client, embeddings, vector stores and local indexes."""
+    # Streamlit reruns app.py from top to bottom on every widget interaction
+    # Modules imported by app.py are only imported once per process, so objects stored here survive reruns
+    # This means the gRPC channel, the index list and the vector store are created once and shared by all sessions
+
+    def __init__(self):
+        """Initialize the empty caches."""
+        # Constructor method that runs when a new ResourceManager is created
+
+        self._lock = threading.RLock()
+        # A re-entrant lock, because get_vector_store calls the other getters while holding it
+
+        self._clients: "OrderedDict[str, Pinecone]" = OrderedDict()
+        # Pinecone clients keyed by Pinecone API key, least recently used first
+        # One client per key means one gRPC channel shared by every session using that key
+
+        self._index_names: Dict[str, List[str]] = {}
+        # The result of pc.list_indexes() keyed by Pinecone API key
+
+        self._embeddings: "OrderedDict[Tuple[str, str], CachedEmbeddings]" = OrderedDict()
+        # Embedding clients keyed by (OpenAI API key, embedding model), least recently used first
+
+        self._local_indexes: Dict[str, LocalVectorIndex] = {}
+        # Opened local vector indexes keyed by directory (memory-mapped, so each is opened once)
+
+        self._vector_stores: "OrderedDict[Tuple[str, str, str, str], PineconeVectorStore]" = OrderedDict()
+        # Vector stores keyed by (Pinecone API key, OpenAI API key, index name, embedding model), least recently used first
+
+    def get_client(self, pinecone_api_key: str) -> "Pinecone":
+        """Return the shared Pinecone client for an API key, creating it on first use.
+
+        Args:
+            pinecone_api_key (str): Pinecone API key
+
+        Returns:
+            Pinecone: The cached Pinecone GRPC client
+        """
+        with self._lock:
+            # Only one session at a time may create a client
+
+            if pinecone_api_key not in self._clients:
+                # If we haven't created a client for this key yet
+                while len(self._clients) >= MAX_API_KEYS:
+                    # Too many keys: drop everything created with the least recently used one
+                    self.invalidate(next(iter(self._clients)))
+
+                from pinecone.grpc import PineconeGRPC as Pinecone
+                # Import the Pinecone GRPC client on first use (GRPC is a high-performance remote procedure call framework)
+
+                self._clients[pinecone_api_key] = Pinecone(api_key=pinecone_api_key)
+                # Create a Pinecone client instance with the API key
+
+                print("DEBUG - Pinecone client created")
+                # Print a debug message so we can see how often this actually happens
+
+            self._clients.move_to_end(pinecone_api_key)
+            # Mark the key as most recently used
+
+            return self._clients[pinecone_api_key]
+            # Return the cached client
+
+    def list_index_names(self, pinecone_api_key: str) -> List[str]:
+        """Return the names of the indexes in the Pinecone account, listing them only once.
+
+        Args:
+            pinecone_api_key (str): Pinecone API key
+
+        Returns:
+            List[str]: The index names in the account
+        """
+        with self._lock:
+            # Protect the cache while we check and fill it
+
+            if pinecone_api_key not in self._index_names:
+                # If we haven't listed the indexes for this key yet
+                indexes = self.get_client(pinecone_api_key).list_indexes()
+                # Get a list of all indexes in the Pinecone account (one network round trip)
+
+                print(f"DEBUG - Successfully listed indexes: {indexes}")
+                # Print a debug message with the list of indexes
+
+                self._index_names[pinecone_api_key] = [idx.name for idx in indexes]
+                # Store just the index names
+
+            return self._index_names[pinecone_api_key]
+            # Return the cached index names
+
+    def get_embeddings(self, openai_api_key: str, model: str = "text-embedding-3-small") -> CachedEmbeddings:
+        """Return the shared (cached) embeddings client, creating it on first use.
+
+        With EMBEDDING_PROVIDER=onnx, queries are embedded by the local model instead (the OpenAI key and model
+        are then ignored), and the model is loaded and run once here so the first query doesn't wait for it.
+
+        Args:
+            openai_api_key (str): OpenAI API key
+            model (str, optional): Embedding model to use. Defaults to "text-embedding-3-small".
+
+        Returns:
+            CachedEmbeddings: The shared embeddings client, with a query embedding cache in front of it
+
+        Raises:
+            FileNotFoundError: If EMBEDDING_PROVIDER=onnx and no model has been exported
+        """
+        if embedding_provider() == "onnx":
+            # Embed queries on this machine instead of calling the API
+            return self._get_onnx_embeddings()
+
+        key = (openai_api_key, model)
+        # Build the cache key from the API key and the model name
+
+        with self._lock:
+            # Protect the cache while we check and fill it
+
+            if key not in self._embeddings:
+                # If we haven't created embeddings for this key and model yet
+                while len(self._embeddings) >= MAX_API_KEYS:
+                    # Too many keys: drop the least recently used embeddings (other sessions' keys stay cached)
+                    self._embeddings.popitem(last=False)
+
+                from langchain_openai import OpenAIEmbeddings
+                # Import the LangChain OpenAI embeddings on first use
+
+                self._embeddings[key] = CachedEmbeddings(
+                    OpenAIEmbeddings(
+                        model=model,                  # The embedding model to use
+                        openai_api_key=openai_api_key, # Pass the OpenAI API key
+                        max_retries=0                  # The rate limiter below retries instead
+                    ),
+                    model=model,
+                    # The model name is part of every cache key
+                    memory_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+                    # How many query embeddings to keep in memory
+                    disk_dir=os.getenv("EMBEDDING_CACHE_DIR", os.path.join(".cache", "embeddings")) or None,
+                    # Where to keep query embeddings on disk (set to an empty string to disable)
+                    disk_max_rows=int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000")),
+                    # How many query embeddings to keep on disk
+                    rate_limiter=get_rate_limiter("openai-embeddings"),
+                    # Keep embedding calls within OpenAI's embedding rate limits
+                    batch_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")),
+                    # How long a query miss waits for others to share its API call (0 disables batching)
+                    batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+                    # The most queries per batched API call
+                )
+                # Wrap the OpenAI embeddings so repeated queries skip the API call
+
+            self._embeddings.move_to_end(key)
+            # Mark the key as most recently used
+
+            return self._embeddings[key]
+            # Return the cached embeddings client
+
+    def _get_onnx_embeddings(self) -> CachedEmbeddings:
+        """Return the shared local ONNX embeddings, loading and warming up the model on first use."""
+        key = ("", "onnx")
+        # One local model per process, whatever the OpenAI key
+
+        with self._lock:
+            # Protect the cache while we check and fill it
+
+            if key not in self._embeddings:
+                # Load the model the first time it is needed
+                embeddings = create_onnx_embeddings()
+
+                embeddings.warm_up()
+                # Load the model and run it once now, instead of during the first query
+
+                self._embeddings[key] = CachedEmbeddings(
+                    embeddings,
+                    model=embeddings.name,
+                    # The model file is part of every cache key, so vectors from another model are never reused
+                    memory_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+                    disk_dir=os.getenv("EMBEDDING_CACHE_DIR", os.path.join(".cache", "embeddings")) or None,
+                    disk_max_rows=int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000")),
+                    # The same cache settings as the OpenAI embeddings
+                    batch_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")),
+                    batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+                    # One model run for queries arriving together is cheaper than one run each
+                )
+                # No rate limiter: nothing leaves the machine
+
+            return self._embeddings[key]
+            # Return the cached embeddings client
+
+    def get_vector_store(self, pinecone_api_key: str, openai_api_key: str, index_name: str,
+                         embedding_model: str = "text-embedding-3-small") -> "PineconeVectorStore":
+        """Return the shared vector store for an index, connecting to it only once.
+
+        Args:
+            pinecone_api_key (str): Pinecone API key
+            openai_api_key (str): OpenAI API key used for query embeddings
+            index_name (str): Name of the Pinecone index
+            embedding_model (str, optional): Embedding model to use. Defaults to "text-embedding-3-small".
+
+        Returns:
+            PineconeVectorStore: The cached vector store
+
+        Raises:
+            IndexNotFoundError: If the index does not exist in the Pinecone account
+        """
+        key = (pinecone_api_key, openai_api_key, index_name, embedding_model)
+        # Build the cache key from everything that affects the vector store
+
+        with self._lock:
+            # Protect the cache while we check and fill it
+
+            if key in self._vector_stores:
+                # Fast path: on most reruns the vector store already exists
+                self._vector_stores.move_to_end(key)
+                # Mark it as most recently used
+
+                return self._vector_stores[key]
+                # Return it without any network calls
+
+            index_names = self.list_index_names(pinecone_api_key)
+            # Get the (cached) list of index names
+
+            if index_name not in index_names:
+                # If the specified index name is not found
+                raise IndexNotFoundError(index_name, index_names)
+                # Let the caller decide how to show the error
+
+            while len(self._vector_stores) >= MAX_API_KEYS:
+                # Too many: drop the least recently used vector store (the ones other sessions use stay cached)
+                self._vector_stores.popitem(last=False)
+
+            from langchain_pinecone import PineconeVectorStore
+            # Import the LangChain Pinecone vector store on first use
+
+            vector_store = PineconeVectorStore(
+                index=self.get_client(pinecone_api_key).Index(index_name),  # Reuse the shared gRPC client's channel
+                embedding=self.get_embeddings(openai_api_key, embedding_model),  # The embedding model to use
+                text_key="text"  # The key in the metadata that contains the text
+            )
+            # Create the vector store on top of the shared client instead of letting LangChain build its own
+
+            print("DEBUG - PineconeVectorStore created successfully")
+            # Print a debug message if the vector store is created successfully
+
+            self._vector_stores[key] = vector_store
+            # Store the vector store for the next rerun and for other sessions
+
+            return vector_store
+            # Return the new vector store
+
+    def get_pinecone_backend(self, pinecone_api_key: str, openai_api_key: str, index_name: str,
+                             embedding_model: str = "text-embedding-3-small") -> PineconeBackend:
+        """Return a backend that searches a Pinecone index (see get_vector_store).
+
+        Raises:
+            IndexNotFoundError: If the index does not exist in the Pinecone account
+        """
+        return PineconeBackend(index_name, self.get_vector_store(pinecone_api_key, openai_api_key, index_name, embedding_model))
+        # The backend itself is just a thin wrapper, so building a new one is free
+
+    def get_local_backend(self, openai_api_key: str, directory: str,
+                          embedding_model: str = "text-embedding-3-small") -> LocalBackend:
+        """Return a backend that searches a local vector index instead of Pinecone.
+
+        Args:
+            openai_api_key (str): OpenAI API key used for query embeddings
+            directory (str): The directory written by local_index.py
+            embedding_model (str, optional): Embedding model to use. Defaults to "text-embedding-3-small".
+
+        Returns:
+            LocalBackend: A backend over the shared, memory-mapped index
+
+        Raises:
+            FileNotFoundError: If no index has been built in the directory
+        """
+        with self._lock:
+            # Protect the cache while we check and fill it
+
+            if directory not in self._local_indexes:
+                # Open the index the first time it is needed
+                if not os.path.exists(os.path.join(directory, "meta.json")):
+                    # Nothing has been built there yet
+                    raise FileNotFoundError(f"No local index found in '{directory}'. Build one with: python local_index.py --out {directory}")
+
+                self._local_indexes[directory] = LocalVectorIndex(directory)
+                # Memory-map the index
+                print(f"DEBUG - Opened local index with {self._local_indexes[directory].count} vectors from {directory}")
+
+            return LocalBackend(f"local:{directory}", self._local_indexes[directory],
+                                self.get_embeddings(openai_api_key, embedding_model))
+            # The backend itself is just a thin wrapper, so building a new one is free
+
+    def invalidate(self, pinecone_api_key: Optional[str] = None):
+        """Drop cached resources so they are recreated on next use.
+
+        Args:
+            pinecone_api_key (str, optional): Only drop resources for this key. Defaults to None (drop everything).
+        """
+        with self._lock:
+            # Protect the caches while we modify them
+
+            if pinecone_api_key is None:
+                # If no key was given, clear everything
+                self._clients.clear()
+                self._index_names.clear()
+                self._embeddings.clear()
+                self._local_indexes.clear()
+                self._vector_stores.clear()
+                return
+
+            self._clients.pop(pinecone_api_key, None)
+            # Drop the client for this key
+
+            self._index_names.pop(pinecone_api_key, None)
+            # Drop the index list for this key
+
+            for key in [k for k in self._vector_stores if k[0] == pinecone_api_key]:
+                # Drop the vector stores that were built with this key
+                del self._vector_stores[key]
+
+resource_manager = ResourceManager()
+# The single, process-wide instance that app.py uses
+# Because Python caches imported modules, this object is shared by every rerun and every session
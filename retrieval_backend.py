@@ -0,0 +1,88 @@
+from abc import ABC, abstractmethod
+# Import ABC (Abstract Base Class) and abstractmethod to create an abstract class, like base_agent.py does
+
+from typing import Any, List, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# List: A list of items of a specific type
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+from langchain_core.documents import Document
+# Import Document, the result type every backend returns
+
+from langchain_core.embeddings import Embeddings
+# Import the Embeddings interface, used to embed queries for the backend
+
+class RetrievalBackend(ABC):
+    """Abstract base class for the stores app.py searches."""
+    # Every backend embeds queries with `embeddings` and returns (Document, similarity) pairs, best first,
+    # so the rest of the query path doesn't care where the vectors live
+
+    def __init__(self, name: str, embeddings: Embeddings):
+        """Initialize the backend.
+
+        Args:
+            name (str): A name for the index, used in cache keys and shown in the sidebar
+            embeddings (Embeddings): The embedding model used for queries
+        """
+        self.name = name
+        # Store the index name
+
+        self.embeddings = embeddings
+        # Store the embedding model
+
+    @abstractmethod
+    def search_by_vector(self, vector: Sequence[float], k: int) -> List[Tuple[Document, float]]:
+        """Return the k documents most similar to a query vector.
+
+        Args:
+            vector (Sequence[float]): The query embedding
+            k (int): How many results to return
+
+        Returns:
+            List[Tuple[Document, float]]: (document, similarity) pairs, best first
+        """
+        pass
+        # This is an abstract method, so it doesn't have an implementation here
+
+class PineconeBackend(RetrievalBackend):
+    """Searches a Pinecone index through LangChain's PineconeVectorStore."""
+
+    def __init__(self, name: str, vector_store: Any):
+        """Initialize the backend.
+
+        Args:
+            name (str): The Pinecone index name
+            vector_store (PineconeVectorStore): The vector store for the index
+        """
+        super().__init__(name, vector_store.embeddings)
+        # Use the vector store's (cached) embeddings for queries
+
+        self.vector_store = vector_store
+        # Store the vector store
+
+    def search_by_vector(self, vector: Sequence[float], k: int) -> List[Tuple[Document, float]]:
+        """Query Pinecone for the k most similar documents."""
+        return self.vector_store.similarity_search_by_vector_with_score(list(vector), k=k)
+
+class LocalBackend(RetrievalBackend):
+    """Searches a local, memory-mapped vector index (see local_index.py); no network needed."""
+
+    def __init__(self, name: str, index: Any, embeddings: Embeddings):
+        """Initialize the backend.
+
+        Args:
+            name (str): A name for the index
+            index (LocalVectorIndex): The opened local index
+            embeddings (Embeddings): The embedding model used for queries (it must match the index)
+        """
+        super().__init__(name, embeddings)
+        # Store the name and embeddings
+
+        self.index = index
+        # Store the local index
+
+    def search_by_vector(self, vector: Sequence[float], k: int) -> List[Tuple[Document, float]]:
+        """Search the local index for the k most similar documents."""
+        return self.index.search(vector, k)
@@ -0,0 +1,236 @@
+import os
+# Import the os module to read the cache settings from environment variables
+
+import hashlib
+# Import hashlib to turn a query vector into a short cache key
+
+import json
+# Import json to turn a metadata filter into a stable string
+
+import threading
+# Import threading so the cache can be shared safely between Streamlit sessions
+
+import time
+# Import time to expire old results
+
+from collections import OrderedDict
+# Import OrderedDict, which remembers insertion order (used for LRU eviction)
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Callable: A function
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+import numpy as np
+# Import numpy to get the exact bytes of a query vector
+
+def vector_hash(vector: Sequence[float]) -> str:
+    """Return a short hash that identifies a query vector.
+
+    Args:
+        vector (Sequence[float]): The query embedding
+
+    Returns:
+        str: A hex digest of the vector's float32 bytes
+    """
+    return hashlib.sha1(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+    # Hash the float32 bytes, so the same embedding always gives the same key
+
+class RetrievalCache:
+    """Caches similarity search results per (query vector, k, index, filter)."""
+    # Switching models for the same question used to repeat the exact same Pinecone query
+    # Search results don't depend on the model that answers, so we can reuse them
+    # Each index has a version number; invalidate() bumps it so results from before an update are never served
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 1000):
+        """Initialize an empty cache.
+
+        Args:
+            ttl_seconds (float, optional): How long search results stay valid. Defaults to 300.
+            max_entries (int, optional): The most result sets to keep. Defaults to 1000.
+        """
+        self.ttl_seconds = ttl_seconds
+        # Store the time-to-live
+
+        self.max_entries = max_entries
+        # Store the size limit
+
+        self._entries: "OrderedDict[Tuple[str, int, str, str], Tuple[List[Any], float, int]]" = OrderedDict()
+        # The cached results, least recently used first
+        # Each value is (search results, time stored, index version when stored)
+
+        self._versions: Dict[str, int] = {}
+        # How often each index has been invalidated on its own
+
+        self._generation = 0
+        # How often every index has been invalidated at once
+        # An index's version is the sum of the two, so either kind of invalidation changes it
+
+        self._lock = threading.Lock()
+        # A lock so two sessions can't change the cache at the same time
+
+    def _version_locked(self, index_name: str) -> int:
+        """The current version of an index (the caller holds the lock)."""
+        return self._generation + self._versions.get(index_name, 0)
+        # Both counts only go up, so the sum changes whenever either does
+
+    def _make_key(self, vector: Sequence[float], k: int, index_name: str,
+                  filter: Optional[Dict[str, Any]]) -> Tuple[str, int, str, str]:
+        """Build the cache key for a search."""
+        return (vector_hash(vector), k, index_name, json.dumps(filter, sort_keys=True, default=str))
+        # sort_keys makes {"a": 1, "b": 2} and {"b": 2, "a": 1} give the same key
+
+    def get(self, vector: Sequence[float], k: int, index_name: str,
+            filter: Optional[Dict[str, Any]] = None) -> Optional[List[Any]]:
+        """Return cached search results, or None on a miss.
+
+        Args:
+            vector (Sequence[float]): The query embedding
+            k (int): Number of results requested
+            index_name (str): The index that was searched
+            filter (Dict[str, Any], optional): The metadata filter used. Defaults to None.
+
+        Returns:
+            Optional[List[Any]]: The cached results, or None
+        """
+        key = self._make_key(vector, k, index_name, filter)
+        # Build the cache key
+
+        with self._lock:
+            # Protect the cache while we read and reorder it
+
+            entry = self._entries.get(key)
+            # Look up the entry
+
+            if entry is None:
+                # Not cached
+                return None
+
+            results, stored_at, version = entry
+            # Unpack the entry
+
+            if time.time() - stored_at > self.ttl_seconds or version != self._version_locked(index_name):
+                # The results are too old, or the index has been updated since
+                del self._entries[key]
+                # Remove the stale entry
+                return None
+
+            self._entries.move_to_end(key)
+            # Mark the entry as most recently used
+
+            return list(results)
+            # Return a copy so callers can't change the cached list
+
+    def index_version(self, index_name: str) -> int:
+        """Return the current version of an index (bumped by invalidate)."""
+        with self._lock:
+            # Protect the version table while we read it
+            return self._version_locked(index_name)
+
+    def put(self, vector: Sequence[float], k: int, index_name: str, results: List[Any],
+            filter: Optional[Dict[str, Any]] = None, version: Optional[int] = None):
+        """Store search results.
+
+        Args:
+            vector (Sequence[float]): The query embedding
+            k (int): Number of results requested
+            index_name (str): The index that was searched
+            results (List[Any]): The search results
+            filter (Dict[str, Any], optional): The metadata filter used. Defaults to None.
+            version (int, optional): The index version the search ran against. Defaults to the current version.
+        """
+        key = self._make_key(vector, k, index_name, filter)
+        # Build the cache key
+
+        with self._lock:
+            # Protect the cache while we change it
+
+            if version is None:
+                # No version given, so the results belong to the current one
+                version = self._version_locked(index_name)
+
+            if version != self._version_locked(index_name):
+                # The index was invalidated while the search ran, so these results may be stale
+                return
+
+            self._entries[key] = (list(results), time.time(), version)
+            # Store the results with the time and the index version they came from
+
+            self._entries.move_to_end(key)
+            # Mark the entry as most recently used
+
+            while len(self._entries) > self.max_entries:
+                # While we're over the size limit
+                self._entries.popitem(last=False)
+                # Remove the least recently used entry
+
+    def get_or_search(self, vector: Sequence[float], k: int, index_name: str,
+                      search: Callable[[], List[Any]], filter: Optional[Dict[str, Any]] = None) -> List[Any]:
+        """Return cached results, or run the search and cache what it returns.
+
+        Args:
+            vector (Sequence[float]): The query embedding
+            k (int): Number of results requested
+            index_name (str): The index being searched
+            search (Callable[[], List[Any]]): Function that runs the actual search
+            filter (Dict[str, Any], optional): The metadata filter used. Defaults to None.
+
+        Returns:
+            List[Any]: The search results
+        """
+        results = self.get(vector, k, index_name, filter)
+        # Look in the cache first
+
+        if results is None:
+            # Cache miss
+            version = self.index_version(index_name)
+            # Note the index version before searching, so an update during the search marks these results stale
+
+            results = search()
+            # Run the real search
+
+            self.put(vector, k, index_name, results, filter, version=version)
+            # Remember the results
+
+        return results
+        # Return the results
+
+    def invalidate(self, index_name: Optional[str] = None):
+        """Forget cached results after an index has been updated.
+
+        Args:
+            index_name (str, optional): The index that changed. Defaults to None (every index).
+        """
+        with self._lock:
+            # Protect the cache while we change it
+
+            if index_name is None:
+                # Every index changed
+                self._generation += 1
+                # Bump every index's version, so searches already in flight can't store what they found
+
+                self._entries.clear()
+                # Drop everything
+                return
+
+            self._versions[index_name] = self._versions.get(index_name, 0) + 1
+            # Bump the index version so older entries are treated as stale
+
+            for key in [key for key in self._entries if key[2] == index_name]:
+                # Find the entries for this index
+                del self._entries[key]
+                # Remove them now rather than waiting for them to be looked up
+
+retrieval_cache = RetrievalCache(
+    ttl_seconds=float(os.getenv("RETRIEVAL_CACHE_TTL", "300")),
+    # How long (in seconds) search results stay valid
+    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1000"))
+    # The most result sets to keep
+)
+# The single, process-wide retrieval cache that app.py uses
+# Because Python caches imported modules, it is shared by every rerun and every session
@@ -0,0 +1,103 @@
+from types import MappingProxyType
+# Import MappingProxyType to expose the metadata read-only without copying it
+
+from typing import Any, Dict, Mapping, Optional
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Dict: A dictionary with keys and values of specific types
+# Mapping: A read-only dictionary-like object
+# Optional: Indicates that a value can be of a specific type or None
+
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+# Shared by every chunk without metadata
+
+class RetrievedChunk:
+    """One retrieved result: the fields the prompt uses, plus the rest of its metadata on demand."""
+    # Results used to be fresh dictionaries merging the score, the text and every metadata field,
+    # built for every hit of every query. A chunk stores the few fields every consumer reads in slots
+    # (no per-instance __dict__) and keeps a reference to the document's metadata instead of copying it.
+    #
+    # It also answers the dictionary-style reads results used to support (result["score"], result.get("title"),
+    # "title" in result), so code written against the old dictionaries keeps working.
+
+    __slots__ = ("score", "text", "title", "description", "id", "_metadata")
+
+    def __init__(self, score: float, text: str, metadata: Optional[Mapping[str, Any]] = None):
+        """Initialize the chunk.
+
+        Args:
+            score (float): The similarity (or fused, or reranked) score
+            text (str): The document text
+            metadata (Mapping[str, Any], optional): The document's metadata; kept by reference, not copied.
+                Defaults to None.
+        """
+        metadata = metadata if metadata is not None else _EMPTY
+
+        self.score = float(score)
+        # The score as a float
+
+        self.text = text
+        # The document text
+
+        self.title: Optional[str] = metadata.get("title")
+        # The title (None if the document has none)
+
+        self.description: Optional[str] = metadata.get("description")
+        # The description (None if the document has none)
+
+        self.id: Optional[str] = metadata.get("id")
+        # The document id (None if the index doesn't store one in the metadata)
+
+        self._metadata = metadata
+        # Everything else, read only when asked for
+
+    @classmethod
+    def from_document(cls, doc: Any, score: float, metadata: Optional[Mapping[str, Any]] = None) -> "RetrievedChunk":
+        """Build a chunk from a (Document, score) search result.
+
+        Args:
+            doc (Document): The document
+            score (float): Its score
+            metadata (Mapping[str, Any], optional): Use this instead of doc.metadata (for example a trimmed copy)
+
+        Returns:
+            RetrievedChunk: The chunk
+        """
+        return cls(score, doc.page_content, doc.metadata if metadata is None else metadata)
+
+    @property
+    def metadata(self) -> Mapping[str, Any]:
+        """All of the document's metadata (read-only)."""
+        return MappingProxyType(self._metadata) if isinstance(self._metadata, dict) else self._metadata
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Read a field by name, like dict.get: score, text or any metadata field."""
+        if key == "score":
+            return self.score
+
+        if key == "text":
+            return self.text
+
+        return self._metadata.get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        """Read a field by name, like a dictionary (raises KeyError for a missing field)."""
+        if key == "score":
+            return self.score
+
+        if key == "text":
+            return self.text
+
+        return self._metadata[key]
+
+    def __contains__(self, key: object) -> bool:
+        """Whether a field exists, like "title" in result."""
+        return key in ("score", "text") or key in self._metadata
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The chunk as the dictionary results used to be: {"score", "text", **metadata}."""
+        return {"score": self.score, "text": self.text, **self._metadata}
+
+    def __repr__(self) -> str:
+        """A short description for debugging."""
+        return f"RetrievedChunk(score={self.score:.4f}, title={self.title!r}, id={self.id!r})"
@@ -0,0 +1,195 @@
+import os
+# Import the os module to read the cache settings from environment variables
+
+import hashlib
+# Import hashlib to build a stable id for results that don't carry one
+
+import threading
+# Import threading so the cache can be shared safely between Streamlit sessions
+
+import time
+# Import time to expire old answers
+
+from collections import OrderedDict
+# Import OrderedDict, which remembers insertion order (oldest entries first)
+
+from typing import List, Optional, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+import numpy as np
+# Import numpy to compare a query against every cached query embedding in one step
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
+def result_ids(results: List[RetrievedChunk]) -> Tuple[str, ...]:
+    """Return a stable, order-independent id for each retrieved result.
+
+    Args:
+        results (List[RetrievedChunk]): The processed search results
+
+    Returns:
+        Tuple[str, ...]: The sorted result ids
+    """
+    ids = []
+    # Collect one id per result
+
+    for result in results:
+        # Loop through each result
+        if result.id:
+            # Use the document id from the metadata if there is one
+            ids.append(str(result.id))
+        else:
+            # Otherwise identify the result by its text
+            ids.append(hashlib.sha1(result.text.encode("utf-8")).hexdigest())
+
+    return tuple(sorted(ids))
+    # Sort, so the same set of documents in a slightly different order still matches
+
+class SemanticAnswerCache:
+    """Caches generated answers and serves them for near-duplicate questions."""
+    # Many questions are paraphrases of earlier ones ("how do I reset my password" / "password reset steps")
+    # A cached answer is reused when:
+    #   1. it was generated by the same model,
+    #   2. the new query's embedding is within a cosine similarity threshold of the cached query, and
+    #   3. retrieval returned the same set of documents (so the answer is based on the same information)
+
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 1000):
+        """Initialize an empty cache.
+
+        Args:
+            threshold (float, optional): Minimum cosine similarity to reuse an answer. Defaults to 0.95.
+            ttl_seconds (float, optional): How long an answer stays valid. Defaults to 3600.
+            max_entries (int, optional): The most answers to keep. Defaults to 1000.
+        """
+        self.threshold = threshold
+        # Store the similarity threshold
+
+        self.ttl_seconds = ttl_seconds
+        # Store the time-to-live
+
+        self.max_entries = max_entries
+        # Store the size limit
+
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, str, Tuple[str, ...], str, float]]" = OrderedDict()
+        # The cached answers, oldest first
+        # Each value is (normalized query vector, model, result ids, answer, time stored)
+
+        self._next_id = 0
+        # A counter used to give every entry a unique key
+
+        self._lock = threading.Lock()
+        # A lock so two sessions can't change the cache at the same time
+
+    def _normalize(self, vector: Sequence[float]) -> np.ndarray:
+        """Return the vector scaled to length 1, so a dot product equals cosine similarity."""
+        vector = np.asarray(vector, dtype=np.float32)
+        # Convert to a float32 array
+
+        norm = np.linalg.norm(vector)
+        # The length of the vector
+
+        return vector / norm if norm > 0 else vector
+        # Divide by the length (leaving an all-zero vector unchanged)
+
+    def _expire(self, now: float):
+        """Remove expired entries; the caller must hold the lock."""
+        while self._entries:
+            # Entries are stored oldest first, so we only need to look at the front
+            key, entry = next(iter(self._entries.items()))
+            # Get the oldest entry
+
+            if now - entry[4] <= self.ttl_seconds:
+                # The oldest entry is still valid, so all newer ones are too
+                break
+
+            del self._entries[key]
+            # Remove the expired entry
+
+    def lookup(self, query_vector: Sequence[float], model: str, doc_ids: Tuple[str, ...]) -> Optional[str]:
+        """Return a cached answer for a similar question, if there is one.
+
+        Args:
+            query_vector (Sequence[float]): The embedding of the new query
+            model (str): The model that would generate the answer
+            doc_ids (Tuple[str, ...]): The ids of the retrieved results (see result_ids)
+
+        Returns:
+            Optional[str]: The cached answer, or None on a miss
+        """
+        query = self._normalize(query_vector)
+        # Normalize the query vector
+
+        with self._lock:
+            # Protect the cache while we read it
+
+            self._expire(time.time())
+            # Drop answers that are too old
+
+            candidates = [(key, entry) for key, entry in self._entries.items()
+                          if entry[1] == model and entry[2] == doc_ids]
+            # Only answers from the same model, based on the same documents, can be reused
+
+            if not candidates:
+                # Nothing to compare against
+                return None
+
+            similarities = np.stack([entry[0] for _, entry in candidates]) @ query
+            # Compare the query against every candidate at once (cosine similarity of unit vectors)
+
+            best = int(np.argmax(similarities))
+            # The most similar cached question
+
+            if similarities[best] < self.threshold:
+                # Not similar enough to reuse its answer
+                return None
+
+            return candidates[best][1][3]
+            # Return the cached answer
+
+    def store(self, query_vector: Sequence[float], model: str, doc_ids: Tuple[str, ...], answer: str):
+        """Cache an answer.
+
+        Args:
+            query_vector (Sequence[float]): The embedding of the query
+            model (str): The model that generated the answer
+            doc_ids (Tuple[str, ...]): The ids of the retrieved results (see result_ids)
+            answer (str): The generated answer
+        """
+        entry = (self._normalize(query_vector), model, doc_ids, answer, time.time())
+        # Build the cache entry
+
+        with self._lock:
+            # Protect the cache while we change it
+
+            self._entries[self._next_id] = entry
+            # Add the entry at the end (newest)
+
+            self._next_id += 1
+            # Move the counter on
+
+            while len(self._entries) > self.max_entries:
+                # While we're over the size limit
+                self._entries.popitem(last=False)
+                # Remove the oldest entry
+
+    def clear(self):
+        """Remove every cached answer."""
+        with self._lock:
+            # Protect the cache while we clear it
+            self._entries.clear()
+
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    # Minimum cosine similarity between questions to reuse an answer
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    # How long (in seconds) a cached answer stays valid
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+    # The most answers to keep
+)
+# The single, process-wide answer cache that app.py uses
+# Because Python caches imported modules, it is shared by every rerun and every session
@@ -0,0 +1,305 @@
+import asyncio
+# Import asyncio to run a shared call as its own task, so it outlives the caller that started it
+
+import concurrent.futures
+# Import concurrent.futures for a result that threads and every event loop can wait on
+
+import os
+# Import the os module to read the setting from environment variables
+
+import threading
+# Import threading because identical calls come from different threads and event loops
+
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# AsyncIterator: An object that produces values one at a time with "async for"
+# Awaitable: Something that can be awaited, like a coroutine
+# Callable: A function
+# Dict: A dictionary with keys and values of specific types
+# Hashable: Anything that can be a dictionary key
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+# TypeVar: A placeholder for "whatever type the shared call returns"
+
+from metrics import registry
+# Import the process-wide metrics registry
+
+# Coalesces identical calls that are in flight at the same time.
+#
+# When many sessions ask the same question at once (after an announcement, say), the caches don't help:
+# they only fill once the first call finishes. Until then every session would embed, search and generate
+# the same thing. Here the first caller runs the call and everyone who asks for the same key while it runs
+# waits for that result instead. Streams are fanned out: late joiners get the pieces sent so far, then the
+# rest as they arrive.
+#
+# Nothing is stored once a call finishes (that is what the caches are for).
+
+T = TypeVar("T")
+# The type the shared call returns
+
+SINGLE_FLIGHT_CALLS = registry.counter(
+    "rag_single_flight_calls_total", "Calls that ran (leader) or joined an identical call in flight (follower).",
+    ["kind", "role"])
+# How often identical calls are coalesced, per kind of call
+
+class _Flight:
+    """One call in flight, and everyone waiting for it."""
+
+    def __init__(self):
+        """Initialize an empty flight."""
+        self.future: "concurrent.futures.Future[Any]" = concurrent.futures.Future()
+        # The result (or error), for non-streaming calls
+
+        self.waiters = 0
+        # Callers still waiting; when it drops to 0 the call is cancelled
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # The event loop running the shared task (async calls and streams)
+
+        self.task: Optional["asyncio.Task[Any]"] = None
+        # The shared task (async calls and streams)
+
+        self.pieces: List[Any] = []
+        # Everything a stream has sent so far
+
+        self.done = False
+        # Whether a stream has finished
+
+        self.error: Optional[BaseException] = None
+        # What a stream failed with, if it did
+
+        self.subscribers: List[Callable[[], None]] = []
+        # How to wake each stream reader (they may be on different event loops)
+
+class SingleFlight:
+    """Lets identical in-flight calls share one execution."""
+    # Keys are (kind, ...) tuples chosen by the caller; everything that changes the result must be part of the key
+
+    def __init__(self):
+        """Initialize with nothing in flight."""
+        self._flights: Dict[Tuple[Hashable, ...], _Flight] = {}
+        # The calls in flight, by key
+
+        self._lock = threading.Lock()
+        # One lock for the table, shared by every thread and event loop
+
+    def _join(self, key: Tuple[Hashable, ...]) -> Tuple[_Flight, bool]:
+        """Join the flight for a key, starting one if there is none (the caller holds the lock).
+
+        Returns:
+            Tuple[_Flight, bool]: The flight and whether this caller leads it
+        """
+        flight = self._flights.get(key)
+
+        if flight is None:
+            # Nobody is running this yet, so this caller does
+            flight = self._flights[key] = _Flight()
+            leader = True
+        else:
+            leader = False
+
+        flight.waiters += 1
+        SINGLE_FLIGHT_CALLS.inc(kind=str(key[0]), role="leader" if leader else "follower")
+
+        return flight, leader
+
+    def _finish(self, key: Tuple[Hashable, ...], flight: _Flight):
+        """Take a finished flight out of the table, so the next call runs fresh (the caller holds the lock)."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _leave(self, key: Tuple[Hashable, ...], flight: _Flight):
+        """A caller stopped waiting; cancel the shared task if nobody else wants the result."""
+        with self._lock:
+            flight.waiters -= 1
+
+            if flight.waiters > 0 or flight.task is None or flight.done or flight.future.done():
+                # Someone still wants it, or it has already finished
+                return
+
+            self._finish(key, flight)
+            # A new caller starts over instead of joining a cancelled call
+
+        flight.loop.call_soon_threadsafe(flight.task.cancel)
+        # The task may belong to another event loop
+
+    def do(self, key: Tuple[Hashable, ...], func: Callable[[], T]) -> T:
+        """Run a blocking call once for all threads asking for the same key at the same time.
+
+        Args:
+            key (Tuple[Hashable, ...]): Identifies the call; the first item names its kind (for metrics)
+            func (Callable[[], T]): Makes the call (only run by the first caller)
+
+        Returns:
+            T: What func returned (the same object for every caller)
+
+        Raises:
+            Exception: Whatever func raised, for every caller
+        """
+        with self._lock:
+            flight, leader = self._join(key)
+
+        if not leader:
+            # Wait for the caller that is already running it
+            return flight.future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            with self._lock:
+                self._finish(key, flight)
+
+            flight.future.set_exception(e)
+            # Everyone waiting gets the same error
+            raise
+
+        with self._lock:
+            self._finish(key, flight)
+
+        flight.future.set_result(result)
+        return result
+
+    async def do_async(self, key: Tuple[Hashable, ...], func: Callable[[], Awaitable[T]]) -> T:
+        """Run a coroutine once for all callers (on any event loop) asking for the same key at the same time.
+
+        The call runs as its own task, so it carries on when the caller that started it is cancelled,
+        as long as someone is still waiting. When every caller has gone, it is cancelled.
+
+        Args:
+            key (Tuple[Hashable, ...]): Identifies the call; the first item names its kind (for metrics)
+            func (Callable[[], Awaitable[T]]): Starts the call (only run by the first caller)
+
+        Returns:
+            T: What the coroutine returned (the same object for every caller)
+        """
+        with self._lock:
+            flight, leader = self._join(key)
+
+            if leader:
+                # Start the shared task on this caller's event loop
+                flight.loop = asyncio.get_running_loop()
+                flight.task = flight.loop.create_task(self._run(key, flight, func))
+                # The task copies the current context, so the leader's trace is recorded
+
+        try:
+            return await asyncio.shield(asyncio.wrap_future(flight.future))
+            # shield: a caller that is cancelled stops waiting without cancelling the shared result
+        finally:
+            self._leave(key, flight)
+
+    async def _run(self, key: Tuple[Hashable, ...], flight: _Flight, func: Callable[[], Awaitable[Any]]):
+        """The shared task behind do_async."""
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            with self._lock:
+                self._finish(key, flight)
+
+            flight.future.cancel()
+            raise
+        except BaseException as e:
+            with self._lock:
+                self._finish(key, flight)
+
+            flight.future.set_exception(e)
+        else:
+            with self._lock:
+                self._finish(key, flight)
+
+            flight.future.set_result(result)
+
+    async def stream(self, key: Tuple[Hashable, ...], func: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Stream once for all callers (on any event loop) asking for the same key at the same time.
+
+        Every caller gets every piece: one that joins late first gets the pieces sent so far.
+
+        Args:
+            key (Tuple[Hashable, ...]): Identifies the stream; the first item names its kind (for metrics)
+            func (Callable[[], AsyncIterator[T]]): Opens the stream (only run by the first caller)
+
+        Yields:
+            T: The next piece of the stream
+        """
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        # Set (from whichever loop runs the stream) when there is something new to read
+
+        def subscriber():
+            """Wake this reader."""
+            loop.call_soon_threadsafe(wake.set)
+
+        with self._lock:
+            flight, leader = self._join(key)
+            flight.subscribers.append(subscriber)
+
+            if leader:
+                # Start pumping the stream on this caller's event loop
+                flight.loop = loop
+                flight.task = loop.create_task(self._pump(key, flight, func))
+
+        read = 0
+        # How many pieces this reader has had
+
+        try:
+            while True:
+                wake.clear()
+                # Clear before looking, so a piece that arrives after we look still wakes us
+
+                with self._lock:
+                    pieces = flight.pieces[read:]
+                    done, error = flight.done, flight.error
+
+                read += len(pieces)
+
+                for piece in pieces:
+                    yield piece
+
+                if done:
+                    # Everything has been read (nothing is added once the stream is done)
+                    if error is not None:
+                        raise error
+
+                    return
+
+                if not pieces:
+                    await wake.wait()
+        finally:
+            with self._lock:
+                flight.subscribers.remove(subscriber)
+
+            self._leave(key, flight)
+
+    async def _pump(self, key: Tuple[Hashable, ...], flight: _Flight, func: Callable[[], AsyncIterator[Any]]):
+        """The shared task behind stream: read the stream and hand every piece to the readers."""
+        source = func()
+
+        try:
+            async for piece in source:
+                with self._lock:
+                    flight.pieces.append(piece)
+                    subscribers = list(flight.subscribers)
+
+                for subscriber in subscribers:
+                    subscriber()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            await source.aclose()
+            # Close the stream if we stopped early
+
+            with self._lock:
+                flight.done = True
+                self._finish(key, flight)
+                subscribers = list(flight.subscribers)
+
+            for subscriber in subscribers:
+                subscriber()
+
+single_flight: Optional[SingleFlight] = (
+    SingleFlight() if os.getenv("SINGLE_FLIGHT", "true").lower() != "false" else None)
+# The single, process-wide table of calls in flight, shared by every session and event loop
+# Set SINGLE_FLIGHT=false to turn coalescing off
@@ -0,0 +1,134 @@
+import argparse
+# Import argparse to parse the command-line options
+
+import statistics
+# Import statistics to report the median of several runs
+
+import subprocess
+# Import subprocess to time every import in a fresh Python process (a warm process has everything cached)
+
+import sys
+# Import sys to start the same Python interpreter
+
+from typing import Dict, List, Optional
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+
+# Measures how long a new process takes to become ready, which is what container cold starts
+# and new autoscaled replicas pay before their first response.
+#
+# Every target is imported in a fresh interpreter, several times, and the median is reported,
+# together with which provider SDKs ended up loaded (they should only load when first used).
+#
+# Example:
+#   python startup_report.py
+#   python startup_report.py --runs 5 --importtime rag_service    # the slowest modules behind one import
+
+TARGETS = [
+    "streamlit",        # The web framework app.py runs in
+    "query_pipeline",   # Retrieval, keyword search and reranking
+    "agent_factory",    # The agent pool (agent modules load on first use)
+    "rag_service",      # Everything app.py and api_server.py import from this project
+    "api_server",       # The HTTP API
+    "openai_agent",     # What the first GPT-4 request adds
+    "anthropic_agent",  # What the first Claude request adds
+    "deepseek_agent",   # What the first Deepseek request adds
+    "resource_manager", # The Pinecone/embeddings cache (SDKs load on first use)
+    "pinecone.grpc",    # What the first Pinecone connection adds
+    "langchain_openai", # What the first embedding call adds
+    "langchain_pinecone"
+]
+# The imports to time, from the outside in
+
+HEAVY_MODULES = ["openai", "anthropic", "pinecone", "langchain_openai", "langchain_pinecone", "PIL", "requests",
+                 "onnxruntime", "tokenizers"]
+# Packages that are slow to import and should not load until they are needed
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {heavy!r} if name in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+# The script run in each fresh process: time the import, then list which heavy packages it pulled in
+
+def time_import(target: str, runs: int) -> Optional[Dict[str, object]]:
+    """Import a module in fresh processes and return the median time and the heavy packages it loaded.
+
+    Args:
+        target (str): The module to import
+        runs (int): How many fresh processes to time
+
+    Returns:
+        Optional[Dict[str, object]]: {"seconds", "loaded"}, or None if the module can't be imported here
+    """
+    timings: List[float] = []
+    # The import time in every run
+
+    loaded = ""
+    # The heavy packages it loaded (the same in every run)
+
+    for _ in range(runs):
+        # Each run starts a new interpreter, so nothing is cached in memory
+        completed = subprocess.run([sys.executable, "-c", PROBE.format(target=target, heavy=HEAVY_MODULES)],
+                                   capture_output=True, text=True)
+
+        if completed.returncode != 0:
+            # Not installed, or it failed to import
+            return None
+
+        seconds, _, loaded = completed.stdout.strip().splitlines()[-1].partition(" ")
+        timings.append(float(seconds))
+
+    return {"seconds": statistics.median(timings), "loaded": loaded}
+
+def print_importtime(target: str, top: int):
+    """Print the slowest modules behind an import, using Python's -X importtime."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {target}"],
+                               capture_output=True, text=True)
+    # -X importtime writes one "import time: self | cumulative | module" line per module to stderr
+
+    rows = []
+    # (cumulative microseconds, module) for every module
+
+    for line in completed.stderr.splitlines():
+        parts = [part.strip() for part in line.replace("import time:", "").split("|")]
+
+        if len(parts) == 3 and parts[1].isdigit():
+            rows.append((int(parts[1]), parts[2]))
+
+    print(f"\nSlowest imports behind 'import {target}' (cumulative):")
+
+    for microseconds, module in sorted(rows, reverse=True)[:top]:
+        print(f"  {microseconds / 1000:>9.1f} ms  {module}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print the startup-time report and return the exit code."""
+    parser = argparse.ArgumentParser(description="Measure cold-start import times.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per module (default: 3)")
+    parser.add_argument("--importtime", metavar="MODULE", help="Also list the slowest modules behind this import")
+    parser.add_argument("--top", type=int, default=15, help="How many modules --importtime lists (default: 15)")
+    args = parser.parse_args(argv)
+
+    print(f"{'module':<20}{'median ms':>12}  heavy packages loaded")
+
+    for target in TARGETS:
+        # Time each target in fresh processes
+        result = time_import(target, args.runs)
+
+        if result is None:
+            print(f"{target:<20}{'n/a':>12}  (not importable here)")
+        else:
+            print(f"{target:<20}{result['seconds'] * 1000:>12.1f}  {result['loaded'] or '-'}")
+
+    if args.importtime:
+        print_importtime(args.importtime, args.top)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
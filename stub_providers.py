@@ -0,0 +1,309 @@
+import asyncio
+# Import asyncio to wait out the injected latency without blocking the event loop
+
+import hashlib
+# Import hashlib to turn text into a repeatable random seed
+
+import random
+# Import random to draw latencies from a seeded (repeatable) generator
+
+import threading
+# Import threading so the latency generators can be shared between threads
+
+import time
+# Import time to wait out the injected latency in synchronous calls
+
+from typing import AsyncIterator, Dict, List, Sequence, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# AsyncIterator: An object that produces values one at a time with "async for"
+# Dict: A dictionary with keys and values of specific types
+# List: A list of items of a specific type
+# Sequence: Any list-like object
+# Tuple: A fixed-size sequence of items of specific types
+
+import numpy as np
+# Import numpy to build repeatable embeddings and search the stub corpus
+
+from langchain_core.documents import Document
+# Import Document, the result type every retrieval backend returns
+
+from langchain_core.embeddings import Embeddings
+# Import the Embeddings interface the pipeline embeds queries with
+
+from base_agent import BaseAgent
+# Import the BaseAgent class, so stub agents go through the real format_context
+
+from retrieved_chunk import RetrievedChunk
+# Import the compact result type retrieval hands to the agents
+
+from retrieval_backend import RetrievalBackend
+# Import the search interface the pipeline searches through
+
+# Local stand-ins for OpenAI, Anthropic, Deepseek and Pinecone, used by benchmark.py
+# They answer instantly apart from an injected latency, and always give the same output for the same input,
+# so a benchmark measures our own code plus a known, configurable amount of "network" time
+
+class Latency:
+    """A repeatable latency: a base delay plus random jitter from a seeded generator."""
+
+    def __init__(self, milliseconds: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        """Initialize the latency.
+
+        Args:
+            milliseconds (float, optional): The typical delay. Defaults to 0.
+            jitter (float, optional): Spread as a share of the delay (0.2 = roughly +/-20%, with a long tail). Defaults to 0.
+            seed (int, optional): Seed for the jitter, so runs are repeatable. Defaults to 0.
+        """
+        self.milliseconds = milliseconds
+        # Store the typical delay
+
+        self.jitter = jitter
+        # Store the spread
+
+        self._random = random.Random(seed)
+        # A seeded generator, so every run draws the same sequence of delays
+
+        self._lock = threading.Lock()
+        # random.Random isn't safe to share between threads without a lock
+
+    def sample(self) -> float:
+        """Return the next delay in seconds."""
+        if self.milliseconds <= 0:
+            # No delay
+            return 0.0
+
+        with self._lock:
+            # Draw the next value from the shared generator
+            factor = self._random.lognormvariate(0.0, self.jitter) if self.jitter > 0 else 1.0
+            # A log-normal factor gives the long tail real network calls have
+
+        return self.milliseconds * factor / 1000
+
+    def sleep(self):
+        """Wait for the next delay (blocking)."""
+        time.sleep(self.sample())
+
+    async def asleep(self):
+        """Wait for the next delay without blocking the event loop."""
+        await asyncio.sleep(self.sample())
+
+def stable_vector(text: str, dimension: int) -> np.ndarray:
+    """Return a repeatable unit vector for a piece of text.
+
+    Args:
+        text (str): The text
+        dimension (int): The vector length
+
+    Returns:
+        np.ndarray: A float32 vector of length 1
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    # A seed that depends only on the text
+
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    # A random vector for that seed
+
+    return vector / np.linalg.norm(vector)
+
+class StubEmbeddings(Embeddings):
+    """Stands in for OpenAIEmbeddings: repeatable vectors after an injected delay."""
+
+    def __init__(self, dimension: int = 1536, latency: Latency = None):
+        """Initialize the embeddings.
+
+        Args:
+            dimension (int, optional): The vector length. Defaults to 1536 (text-embedding-3-small).
+            latency (Latency, optional): The delay per call. Defaults to no delay.
+        """
+        self.dimension = dimension
+        # Store the vector length
+
+        self.latency = latency or Latency()
+        # Store the delay
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed one query."""
+        self.latency.sleep()
+        return stable_vector(text, self.dimension).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts in one call."""
+        self.latency.sleep()
+        return [stable_vector(text, self.dimension).tolist() for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed one query without blocking the event loop."""
+        await self.latency.asleep()
+        return stable_vector(text, self.dimension).tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts without blocking the event loop."""
+        await self.latency.asleep()
+        return [stable_vector(text, self.dimension).tolist() for text in texts]
+
+class StubVectorBackend(RetrievalBackend):
+    """Stands in for Pinecone: an in-memory corpus searched exactly, after an injected delay."""
+
+    def __init__(self, embeddings: StubEmbeddings, num_docs: int = 1000, words_per_doc: int = 200,
+                 latency: Latency = None):
+        """Build the corpus.
+
+        Args:
+            embeddings (StubEmbeddings): The embeddings used for queries (and the corpus)
+            num_docs (int, optional): How many documents to generate. Defaults to 1000.
+            words_per_doc (int, optional): Words per document (drives context size). Defaults to 200.
+            latency (Latency, optional): The delay per search. Defaults to no delay.
+        """
+        super().__init__("stub", embeddings)
+        # Store the name and embeddings
+
+        self.latency = latency or Latency()
+        # Store the delay
+
+        words = ["error", "config", "index", "vector", "agent", "token", "cache", "query", "model", "latency",
+                 "retry", "stream", "search", "prompt", "budget", "deploy", "metric", "answer", "client", "pool"]
+        # A small vocabulary, so keyword scoring has overlapping words to work with
+
+        rng = random.Random(0)
+        # A seeded generator, so the corpus is the same on every run
+
+        self.documents = [
+            Document(
+                page_content=" ".join(rng.choice(words) for _ in range(words_per_doc)) + f" ERR_{number}",
+                metadata={"title": f"Stub document {number}", "description": f"Generated for benchmarking ({number})"}
+            )
+            for number in range(num_docs)
+        ]
+        # The corpus; each document ends with a unique code, like the keyword-heavy text in real indexes
+
+        self.matrix = np.stack([stable_vector(doc.page_content, embeddings.dimension) for doc in self.documents])
+        # The document vectors, one row each
+
+    def search_by_vector(self, vector: Sequence[float], k: int) -> List[Tuple[Document, float]]:
+        """Return the k most similar documents after the injected delay."""
+        self.latency.sleep()
+        # Pretend to make the network call
+
+        scores = self.matrix @ np.asarray(vector, dtype=np.float32)
+        # Cosine similarity (every vector has length 1)
+
+        top = np.argsort(-scores)[:k]
+        # The k best documents
+
+        return [(self.documents[i], float(scores[i])) for i in top]
+
+class StubAgent(BaseAgent):
+    """Stands in for an LLM agent: runs the real format_context, then answers after an injected delay."""
+
+    def __init__(self, api_key: str = "stub", model_name: str = "stub", token_provider: str = "openai",
+                 latency: Latency = None, token_latency: Latency = None, answer_words: int = 60):
+        """Initialize the agent.
+
+        Args:
+            api_key (str, optional): Ignored, but BaseAgent requires one. Defaults to "stub".
+            model_name (str, optional): The model this agent stands in for. Defaults to "stub".
+            token_provider (str, optional): Whose tokenizer format_context counts with. Defaults to "openai".
+            latency (Latency, optional): The delay before the first token. Defaults to no delay.
+            token_latency (Latency, optional): The delay between streamed tokens. Defaults to no delay.
+            answer_words (int, optional): Words per answer. Defaults to 60.
+        """
+        super().__init__(api_key)
+        # Store and validate the API key
+
+        self.model_name = model_name
+        # Store the model name
+
+        self.token_provider = token_provider
+        # Count context tokens the way the real provider does
+
+        self.latency = latency or Latency()
+        # Store the delay before the first token
+
+        self.token_latency = token_latency or Latency()
+        # Store the delay between tokens
+
+        self.answer_words = answer_words
+        # Store the answer length
+
+    def _answer_words(self, query: str, results: List[RetrievedChunk]) -> List[str]:
+        """Build the repeatable answer for a query."""
+        words = f"Stub answer from {self.model_name} to '{query}' based on {len(results)} documents.".split()
+        # Say what was asked and what it was based on
+
+        return (words * (self.answer_words // len(words) + 1))[:self.answer_words]
+        # Repeat it up to the answer length
+
+    async def request_answer(self, query: str, results: List[RetrievedChunk]) -> str:
+        """Answer after the injected delays, raising nothing (stubs don't fail)."""
+        context = self.format_context(results)
+        # Build the context exactly as a real agent would
+
+        with self._provider_call() as call:
+            # Export the "API call" like a real agent does
+            await self.latency.asleep()
+            # Wait for the "first token"
+
+            for _ in range(self.answer_words - 1):
+                # Wait for the rest of the "tokens"
+                if self.token_latency.milliseconds > 0:
+                    await self.token_latency.asleep()
+
+            call.record_usage(len(context.split()), self.answer_words)
+            # Report roughly one token per word
+
+        return " ".join(self._answer_words(query, results))
+
+    async def generate_answer(self, query: str, results: List[RetrievedChunk]) -> str:
+        """Generate the stub answer."""
+        return await self.request_answer(query, results)
+
+    async def stream_answer(self, query: str, results: List[RetrievedChunk]) -> AsyncIterator[str]:
+        """Stream the stub answer one word at a time."""
+        context = self.format_context(results)
+        # Build the context exactly as a real agent would
+
+        with self._provider_call() as call:
+            # Export the "API call" like a real agent does
+            await self.latency.asleep()
+            # Wait for the "first token"
+
+            for index, word in enumerate(self._answer_words(query, results)):
+                # Send the answer word by word
+                if index:
+                    await self.token_latency.asleep()
+                    # Wait between "tokens"
+
+                yield word + " "
+
+            call.record_usage(len(context.split()), self.answer_words)
+            # Report roughly one token per word
+
+def create_stub_agents(latencies: Dict[str, float], jitter: float = 0.0,
+                       token_ms: float = 0.0) -> Dict[str, StubAgent]:
+    """Create one stub agent per provider the app supports.
+
+    Args:
+        latencies (Dict[str, float]): Milliseconds before the first token, per agent type
+            ("gpt-4", "claude", "deepseek")
+        jitter (float, optional): Latency spread (see Latency). Defaults to 0.
+        token_ms (float, optional): Milliseconds between tokens. Defaults to 0.
+
+    Returns:
+        Dict[str, StubAgent]: The agents, keyed by agent type
+    """
+    providers = {
+        "gpt-4": ("gpt-4", "openai"),
+        "claude": ("claude-3-5-sonnet-20240620", "anthropic"),
+        "deepseek": ("deepseek-chat", "deepseek")
+    }
+    # The model and tokenizer of each agent type, as in AgentFactory
+
+    return {
+        agent_type: StubAgent(
+            model_name=model_name,
+            token_provider=token_provider,
+            latency=Latency(latencies.get(agent_type, 0.0), jitter, seed=index),
+            token_latency=Latency(token_ms, jitter, seed=100 + index)
+        )
+        for index, (agent_type, (model_name, token_provider)) in enumerate(providers.items())
+    }
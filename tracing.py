@@ -0,0 +1,209 @@
+import asyncio
+# Import asyncio to recognize a provider call that was cancelled (rather than one that failed)
+
+import contextvars
+# Import contextvars so code deep inside an agent can find the trace of the query it is working on
+
+import threading
+# Import threading so several threads can add timings to the same trace
+
+import time
+# Import time to measure how long each stage takes
+
+from contextlib import contextmanager
+# Import contextmanager to write the "with span(...)" helpers as simple generators
+
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple
+# Import typing hints to specify the expected types of variables and function parameters/returns
+# Any: Can be any type
+# Awaitable: Something that can be awaited, like a coroutine
+# Dict: A dictionary with keys and values of specific types
+# Iterator: An object that produces values one at a time
+# List: A list of items of a specific type
+# Optional: Indicates that a value can be of a specific type or None
+# Tuple: A fixed-size sequence of items of specific types
+
+from metrics import PROVIDER_CALL_SECONDS, PROVIDER_CALLS, PROVIDER_TOKENS, STAGE_SECONDS
+# Import the process-wide metrics every span and provider call is also exported to
+
+class Trace:
+    """The time spent in each stage of one query (embed, search, format_context, generate, ...)."""
+
+    def __init__(self, session: Optional[str] = None):
+        """Initialize an empty trace.
+
+        Args:
+            session (str, optional): Who asked (a browser session or an API client), so rate limits can be shared fairly.
+                Defaults to None.
+        """
+        self.session = session
+        # Store who asked
+
+        self.spans: List[Tuple[str, float]] = []
+        # (stage name, seconds) for every timed stage, in the order they finished
+
+        self.counts: Dict[str, float] = {}
+        # Other per-query numbers, like tokens used per provider
+
+        self._lock = threading.Lock()
+        # A lock, because the retrieval and the generation may run on different threads
+
+    def record(self, stage: str, seconds: float):
+        """Add a timing for a stage."""
+        with self._lock:
+            # Protect the list while we change it
+            self.spans.append((stage, seconds))
+
+    def add(self, name: str, amount: float):
+        """Add to a per-query number (for example "tokens:openai:prompt")."""
+        with self._lock:
+            # Protect the dictionary while we change it
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def durations(self) -> Dict[str, float]:
+        """Return the total seconds per stage (a stage timed twice is added up)."""
+        totals: Dict[str, float] = {}
+        # Seconds per stage
+
+        with self._lock:
+            # Protect the list while we read it
+            for stage, seconds in self.spans:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+
+        return totals
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+# The trace of the query being worked on in the current thread or asyncio task
+
+def current_trace() -> Optional[Trace]:
+    """Return the trace of the query being worked on, or None."""
+    return _current_trace.get()
+
+@contextmanager
+def use_trace(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """Make a trace the current one inside a with block.
+
+    Args:
+        trace (Trace, optional): The trace to use (None leaves timing off)
+    """
+    token = _current_trace.set(trace)
+    # Make the trace current
+
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        # Restore whatever was current before
+
+@contextmanager
+def span(stage: str, trace: Optional[Trace] = None) -> Iterator[None]:
+    """Time a with block, record it as a stage of the query and export it as a metric.
+
+    Args:
+        stage (str): The stage name
+        trace (Trace, optional): Where to record it. Defaults to the current trace (only the metric is recorded without one).
+    """
+    start = time.perf_counter()
+    # Note when the stage started
+
+    target = trace or _current_trace.get()
+    # Find where to record the timing (looked up now, while the query's trace is current)
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        # How long the stage took
+
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        # Export it
+
+        if target is not None:
+            target.record(stage, elapsed)
+
+async def run_traced(awaitable: Awaitable[Any], trace: Optional[Trace]) -> Any:
+    """Await something with a trace current, so the spans inside it (and in tasks it starts) are recorded.
+
+    Args:
+        awaitable (Awaitable[Any]): For example provider_router.generate_answer(...)
+        trace (Trace, optional): The trace to record into
+
+    Returns:
+        Any: What the awaitable returned
+    """
+    with use_trace(trace):
+        # Tasks created inside copy the current context, so they see the trace too
+        return await awaitable
+
+class ProviderCall:
+    """One call to an LLM provider; records its token usage (see provider_call)."""
+
+    def __init__(self, provider: str, model: str, trace: Optional[Trace]):
+        """Initialize the call.
+
+        Args:
+            provider (str): "openai", "anthropic" or "deepseek"
+            model (str): The model name
+            trace (Trace, optional): The trace of the query making the call
+        """
+        self.provider = provider
+        # Store the provider
+
+        self.model = model
+        # Store the model
+
+        self.trace = trace
+        # Store the trace
+
+    def record_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+        """Record the tokens the call used (None means the provider didn't say)."""
+        for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+            # Record both kinds of token
+            if not tokens:
+                continue
+
+            PROVIDER_TOKENS.inc(tokens, provider=self.provider, model=self.model, kind=kind)
+            # Export the count
+
+            if self.trace is not None:
+                self.trace.add(f"tokens:{self.provider}:{kind}", tokens)
+                # Show it with the query
+
+@contextmanager
+def provider_call(provider: str, model: str) -> Iterator[ProviderCall]:
+    """Time a provider API call, record its outcome and let the caller record its token usage.
+
+    Args:
+        provider (str): "openai", "anthropic" or "deepseek"
+        model (str): The model name
+
+    Yields:
+        ProviderCall: Call record_usage on it once the response arrives
+    """
+    call = ProviderCall(provider, model, _current_trace.get())
+    # Capture the query's trace now; a stream's later steps may run where it isn't current
+
+    start = time.perf_counter()
+    # Note when the call started
+
+    outcome = "error"
+    # Assume failure until the block finishes
+
+    try:
+        yield call
+        outcome = "ok"
+    except (GeneratorExit, asyncio.CancelledError):
+        # The caller stopped waiting (a closed stream, or a hedged request that lost); not the provider's fault
+        outcome = "cancelled"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        # How long the call took
+
+        PROVIDER_CALL_SECONDS.observe(elapsed, provider=provider, model=model, outcome=outcome)
+        PROVIDER_CALLS.inc(provider=provider, model=model, outcome=outcome)
+        # Export the latency and the outcome
+
+        if call.trace is not None:
+            call.trace.record(f"provider_call:{provider}", elapsed)
+            # Show the call with the query